@@ -0,0 +1,458 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import content_store
+import db_cloud_utils
+import instrumentation
+import sql_get
+from bq_storage_sink import StorageWriteSink, LocalArrowBackend
+from bq_writer import split_chunks
+
+logger = logging.getLogger(__name__)
+
+DATASET_DIR = os.path.join('bench_results', 'datasets')
+RESULTS_DIR = 'bench_results'
+DEFAULT_THRESHOLD = 0.15
+# Stages shorter than this (median total) are too noisy to gate on
+MIN_GATED_SECONDS = 0.05
+# Modules whose cold import time is measured: the HTTP entry point (paid at
+# instance startup) and the collection code it defers to the first request
+STARTUP_MODULES = ('main', 'sql_get')
+# Slowest direct imports listed per module
+STARTUP_TOP_IMPORTS = 8
+
+SCALES = {
+    'small': dict(tickers=20, quarters=8, paragraphs=40, paragraph_chars=300),
+    'medium': dict(tickers=100, quarters=12, paragraphs=80, paragraph_chars=400),
+    'large': dict(tickers=500, quarters=20, paragraphs=120, paragraph_chars=500),
+}
+
+SPEAKERS = ['Operator', 'Chief Executive Officer', 'Chief Financial Officer', 'Analyst', 'Investor Relations']
+WORDS = ('revenue margin guidance quarter growth demand customers pricing supply inventory capital '
+         'operating segment outlook headwinds tailwinds bookings backlog cash flow dividend').split()
+
+PARAGRAPH_TYPE = pa.struct([
+    ('paragraph_number', pa.int64()),
+    ('speaker', pa.string()),
+    ('content', pa.string()),
+])
+DATASET_SCHEMA = pa.schema([
+    ('symbol', pa.string()),
+    ('fiscal_year', pa.int64()),
+    ('fiscal_quarter', pa.int64()),
+    ('report_date', pa.string()),
+    ('transcripts', pa.list_(PARAGRAPH_TYPE)),
+])
+
+def generate_dataset(path, tickers, quarters, paragraphs, paragraph_chars, duplicate_fraction=0.01, seed=0):
+    """
+    Write a synthetic parquet file in the stock_earning_call_transcripts schema:
+    tickers x quarters calls (most recent quarters) with `paragraphs` paragraphs of
+    ~paragraph_chars characters each. duplicate_fraction of the calls appear twice,
+    as they occasionally do upstream. One row group per ticker keeps memory flat.
+    """
+    rnd = random.Random(seed)
+    today = datetime.date.today()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with pq.ParquetWriter(path + '.tmp', DATASET_SCHEMA, compression='zstd') as writer:
+        for t in range(tickers):
+            rows = []
+            for q in range(quarters):
+                report_date = today - datetime.timedelta(days=91 * (quarters - q) - rnd.randint(0, 20))
+                text = []
+                for p in range(paragraphs):
+                    words = []
+                    while sum(len(w) + 1 for w in words) < paragraph_chars:
+                        words.append(rnd.choice(WORDS))
+                    text.append({'paragraph_number': p + 1, 'speaker': rnd.choice(SPEAKERS), 'content': " ".join(words)})
+                rows.append({
+                    'symbol': f"SYM{t:04d}",
+                    'fiscal_year': report_date.year,
+                    'fiscal_quarter': (report_date.month - 1) // 3 + 1,
+                    'report_date': report_date.isoformat(),
+                    'transcripts': text,
+                })
+            rows += [dict(r) for r in rows if rnd.random() < duplicate_fraction]
+            writer.write_table(pa.Table.from_pylist(rows, schema=DATASET_SCHEMA))
+    os.replace(path + '.tmp', path)
+    return path
+
+def dataset_path(params):
+    name = "transcripts_t{tickers}_q{quarters}_p{paragraphs}_c{paragraph_chars}.parquet".format(**params)
+    return os.path.abspath(os.path.join(DATASET_DIR, name))
+
+class LocalHuggingFaceClient:
+    """Stand-in for HuggingFaceClient resolving the dataset to a local file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_url_path(self, name):
+        return self.path
+
+class LocalDuckDBClient:
+    """Stand-in for defeatbeta's DuckDBClient: a plain in-process DuckDB connection."""
+
+    def __init__(self, log_level=None, config=None):
+        self.connection = duckdb.connect(config={'threads': getattr(config, 'threads', None) or 1})
+
+    def close(self):
+        self.connection.close()
+
+class LocalConfiguration:
+    def __init__(self, threads=None, **kwargs):
+        self.threads = threads
+
+class InMemoryBigQuery:
+    """
+    Stand-in for BigQuery: keeps the loaded transcript IDs, content fingerprints and
+    watermarks in memory. As a writer (bq_sink) it does the client-side work of
+    BigQueryWriter (DATE conversion, splitting normalized content, chunking, Parquet
+    serialization) without the network, with the same write() signature.
+    """
+
+    def __init__(self, known_ids=(), content_mode='inline', known_fingerprint=None):
+        self.ids = list(known_ids)
+        self.fingerprints = dict.fromkeys(self.ids, known_fingerprint)
+        self.content_mode = content_mode
+        self.known_hashes = content_store.KnownHashes()
+        self.watermarks = {}
+        self.checkpoints = []
+        self.bytes_loaded = 0
+
+    def write(self, metadata_df, content_df, paragraph_text=None, replace=False):
+        metadata_df = metadata_df.assign(report_date=pd.to_datetime(metadata_df['report_date']).dt.date)
+        if content_df is not None and self.content_mode == 'normalized':
+            content_df, paragraph_text = content_store.split_content(content_df, self.known_hashes)
+        for df in (content_df, paragraph_text, metadata_df):
+            for chunk in split_chunks(df) if df is not None else []:
+                buffer = io.BytesIO()
+                pq.write_table(pa.Table.from_pandas(chunk, preserve_index=False), buffer, compression='snappy')
+                self.bytes_loaded += buffer.tell()
+        if paragraph_text is not None:
+            self.known_hashes.update(paragraph_text['content_hash'])
+        self.record(metadata_df)
+
+    def record(self, metadata_df):
+        """Register merged metadata rows; revised calls (replace) update their fingerprint only."""
+        fingerprints = metadata_df.get('content_fingerprint')
+        for i, transcript_id in enumerate(metadata_df['transcript_id']):
+            if transcript_id not in self.fingerprints:
+                self.ids.append(transcript_id)
+            self.fingerprints[transcript_id] = fingerprints.iloc[i] if fingerprints is not None else None
+
+    def row_count(self, project_id, dataset_id, start_date=None, symbols=None):
+        return len(self.ids)
+
+    def ids_table(self, project_id, dataset_id, start_date=None, symbols=None):
+        return pa.table({'transcript_id': pa.array(self.ids, type=pa.string())})
+
+    def get_fingerprints(self, project_id, dataset_id, symbols, start_date=None):
+        return pa.table({'transcript_id': pa.array(list(self.fingerprints), type=pa.string()),
+                         'content_fingerprint': pa.array(list(self.fingerprints.values()), type=pa.string())})
+
+    def record_fingerprints(self, project_id, dataset_id, fingerprints):
+        for transcript_id, fingerprint in zip(fingerprints['transcript_id'], fingerprints['content_fingerprint']):
+            if self.fingerprints.get(transcript_id) is None:
+                self.fingerprints[transcript_id] = fingerprint
+
+    def get_watermarks(self, project_id, dataset_id):
+        return dict(self.watermarks)
+
+    def update_watermarks(self, project_id, dataset_id, watermarks):
+        for symbol, report_date in watermarks.items():
+            self.watermarks[symbol] = max(self.watermarks.get(symbol, report_date), report_date)
+
+    def get_checkpoints(self, project_id, dataset_id, run_id):
+        return [(unit_type, unit) for rid, unit_type, unit in self.checkpoints if rid == run_id]
+
+    def record_checkpoints(self, project_id, dataset_id, run_id, units):
+        self.checkpoints.extend((run_id, unit_type, unit) for unit_type, unit in units)
+
+    def delete_checkpoints(self, project_id, dataset_id, run_id, retention_days):
+        self.checkpoints = [c for c in self.checkpoints if c[0] != run_id]
+
+class RecordingArrowBackend(LocalArrowBackend):
+    """LocalArrowBackend that also registers merged IDs with the stand-in BigQuery."""
+
+    def __init__(self, bigquery, content_mode='inline'):
+        super().__init__(content_mode)
+        self.bigquery = bigquery
+
+    def merge_metadata(self, metadata_df, paragraph_text=None):
+        super().merge_metadata(metadata_df, paragraph_text)
+        self.bigquery.record(metadata_df)
+
+@contextlib.contextmanager
+def stand_ins(dataset, bigquery):
+    """Point sql_get at the local dataset and the in-memory BigQuery for the duration."""
+    patches = [
+        (sql_get, 'DuckDBClient', LocalDuckDBClient),
+        (sql_get, 'Configuration', LocalConfiguration),
+        (sql_get, 'HuggingFaceClient', lambda: LocalHuggingFaceClient(dataset)),
+        (db_cloud_utils, 'count_metadata_rows_bq', bigquery.row_count),
+        (db_cloud_utils, 'get_existing_ids_table_bq', bigquery.ids_table),
+        (db_cloud_utils, 'get_fingerprints_bq', bigquery.get_fingerprints),
+        (db_cloud_utils, 'record_fingerprints_bq', bigquery.record_fingerprints),
+        (db_cloud_utils, 'get_watermarks_bq', bigquery.get_watermarks),
+        (db_cloud_utils, 'update_watermarks_bq', bigquery.update_watermarks),
+        (db_cloud_utils, 'get_checkpoints_bq', bigquery.get_checkpoints),
+        (db_cloud_utils, 'record_checkpoints_bq', bigquery.record_checkpoints),
+        (db_cloud_utils, 'delete_checkpoints_bq', bigquery.delete_checkpoints),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    for module, name, value in patches:
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
+
+def known_transcript_ids(dataset, fraction):
+    """IDs of the first `fraction` of the dataset's calls, to pre-load into the stand-in BigQuery."""
+    if fraction <= 0:
+        return []
+    ids = [row[0] for row in duckdb.sql(
+        f"SELECT DISTINCT md5(symbol || report_date) FROM read_parquet('{dataset}') ORDER BY 1"
+    ).fetchall()]
+    return ids[:int(len(ids) * fraction)]
+
+def run_once(dataset, mode, batch_size, bq_sink, threads, known_fraction, content_mode='inline', refresh=False):
+    """One end-to-end collect_transcripts run in a scratch directory. Returns its report dict."""
+    logging.getLogger().setLevel(logging.WARNING)
+    # With refresh, every known call looks revised upstream, so all of them go through the replace path
+    bigquery = InMemoryBigQuery(known_transcript_ids(dataset, known_fraction), content_mode,
+                                known_fingerprint='stale' if refresh else None)
+    if bq_sink == 'storage':
+        sink = StorageWriteSink(None, None, backend=RecordingArrowBackend(bigquery, content_mode))
+    else:
+        sink = bigquery
+
+    # Cloud mode skips the local SQLite/Parquet writes, as on Cloud Run
+    if mode == 'cloud':
+        os.environ['K_SERVICE'] = 'benchmark'
+    else:
+        os.environ.pop('K_SERVICE', None)
+
+    report = instrumentation.RunReport()
+    with tempfile.TemporaryDirectory(prefix='ecc-bench-') as workdir, stand_ins(dataset, bigquery):
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                sql_get.collect_transcripts(_dataset_tickers(dataset), start_date='1900-01-01', batch_size=batch_size, threads=threads,
+                                            bq_sink=sink, refresh=refresh, report=report,
+                                            index_path=os.path.join(workdir, 'index.npy'))
+        finally:
+            os.chdir(cwd)
+
+    result = report.to_dict()
+    result['durations'] = {name: stats.durations for name, stats in report.stages.items()}
+    return result
+
+def _dataset_tickers(dataset):
+    return [row[0] for row in duckdb.sql(f"SELECT DISTINCT symbol FROM read_parquet('{dataset}') ORDER BY 1").fetchall()]
+
+def import_time(module):
+    """
+    Cold import of module in a fresh interpreter (python -X importtime).
+    Returns {'seconds': total, 'imports': {direct import: seconds}} for the slowest
+    direct imports, or None if the module cannot be imported here.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        logger.warning(f"Could not import {module} to time it: {result.stderr.strip().splitlines()[-1:]}")
+        return None
+
+    # Lines are 'import time: self [us] | cumulative | name', nested imports indented
+    # by two spaces per level and printed before the module importing them
+    children = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        name = name.strip()
+        if depth == 0 and name == module:
+            top = sorted(children.items(), key=lambda item: -item[1])[:STARTUP_TOP_IMPORTS]
+            return {'seconds': round(int(cumulative) / 1e6, 4), 'imports': {k: round(v / 1e6, 4) for k, v in top}}
+        if depth == 0:
+            children = {}
+        elif depth == 1:
+            children[name] = int(cumulative)
+    return None
+
+def startup_times(repeat=3):
+    """Median cold import time of each STARTUP_MODULES entry over repeat fresh interpreters."""
+    startup = {}
+    for module in STARTUP_MODULES:
+        samples = [s for s in (import_time(module) for _ in range(repeat)) if s is not None]
+        if samples:
+            median = statistics.median(s['seconds'] for s in samples)
+            startup[module] = min(samples, key=lambda s: abs(s['seconds'] - median))
+    return startup
+
+def summarize(runs):
+    """Median totals and pooled latency percentiles per stage across repeated runs."""
+    stages = {}
+    for name in runs[0]['stages']:
+        per_run = [r['stages'][name] for r in runs if name in r['stages']]
+        durations = [d for r in runs for d in r['durations'].get(name, [])]
+        stages[name] = {
+            'wall_seconds': round(statistics.median(s['wall_seconds'] for s in per_run), 4),
+            'rows_per_second': round(statistics.median(s['rows_per_second'] or 0 for s in per_run), 1),
+            'p50_ms': instrumentation.percentile_ms(durations, 50),
+            'p95_ms': instrumentation.percentile_ms(durations, 95),
+            'p99_ms': instrumentation.percentile_ms(durations, 99),
+            'max_rss_mb': max(s['max_rss_mb'] for s in per_run),
+        }
+    return {
+        'wall_seconds': round(statistics.median(r['wall_seconds'] for r in runs), 4),
+        'peak_rss_mb': max(r['peak_rss_mb'] for r in runs),
+        'new_calls': runs[0]['counters'].get('new_calls'),
+        'stages': stages,
+    }
+
+def compare(summary, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare a summary with a baseline summary. Returns a list of regressions:
+    total or per-stage wall time, or peak RSS, more than threshold above the baseline.
+    """
+    regressions = []
+
+    def check(label, current, previous, floor=0.0):
+        if previous is None or current is None or previous < floor:
+            return
+        change = (current - previous) / previous if previous else 0.0
+        line = f"{label}: {previous:.4f} -> {current:.4f} ({change:+.1%})"
+        print(("REGRESSION " if change > threshold else "           ") + line)
+        if change > threshold:
+            regressions.append(line)
+
+    check('total wall_seconds', summary['wall_seconds'], baseline['wall_seconds'])
+    check('peak_rss_mb', summary['peak_rss_mb'], baseline['peak_rss_mb'])
+    for name, stage in summary['stages'].items():
+        previous = baseline['stages'].get(name)
+        if previous:
+            check(f"{name} wall_seconds", stage['wall_seconds'], previous['wall_seconds'], floor=MIN_GATED_SECONDS)
+    for module, startup in summary.get('startup', {}).items():
+        previous = baseline.get('startup', {}).get(module)
+        if previous:
+            check(f"import {module} seconds", startup['seconds'], previous['seconds'], floor=MIN_GATED_SECONDS)
+    return regressions
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'duckdb': duckdb.__version__,
+        'pyarrow': pa.__version__,
+        'pandas': pd.__version__,
+    }
+
+def run_benchmark(params, repeat=3, mode='cloud', batch_size=100, bq_sink='load', threads=1, known_fraction=0.0,
+                  content_mode='inline', refresh=False):
+    """Generate (or reuse) the dataset, run collect_transcripts `repeat` times and return the results dict."""
+    dataset = dataset_path(params)
+    if not os.path.exists(dataset):
+        logger.info(f"Generating synthetic dataset {dataset}...")
+        generate_dataset(dataset, **params)
+
+    # Each run gets a fresh process so peak RSS is per run, not cumulative
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    for i in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            runs.append(executor.submit(run_once, dataset, mode, batch_size, bq_sink, threads, known_fraction,
+                                        content_mode, refresh).result())
+        logger.info(f"Run {i + 1}/{repeat}: {runs[-1]['wall_seconds']:.2f}s, peak RSS {runs[-1]['peak_rss_mb']} MB.")
+
+    summary = summarize(runs)
+    summary['startup'] = startup_times(repeat)
+
+    return {
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'params': dict(params, repeat=repeat, mode=mode, batch_size=batch_size, bq_sink=bq_sink,
+                       threads=threads, known_fraction=known_fraction, content_mode=content_mode, refresh=refresh,
+                       dataset_bytes=os.path.getsize(dataset)),
+        'environment': environment(),
+        'summary': summary,
+        'runs': [{k: v for k, v in r.items() if k != 'durations'} for r in runs],
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Offline end-to-end ingestion benchmark on synthetic transcripts.')
+    parser.add_argument('--scale', choices=SCALES, default='small', help='Dataset size preset')
+    parser.add_argument('--tickers', type=int, help='Override: number of tickers')
+    parser.add_argument('--quarters', type=int, help='Override: calls per ticker')
+    parser.add_argument('--paragraphs', type=int, help='Override: paragraphs per call')
+    parser.add_argument('--paragraph_chars', type=int, help='Override: characters per paragraph')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs (each in a fresh process)')
+    parser.add_argument('--mode', choices=['cloud', 'local'], default='cloud', help='cloud skips local SQLite/Parquet writes')
+    parser.add_argument('--batch_size', type=int, default=100, help='collect_transcripts batch_size')
+    parser.add_argument('--bq_sink', choices=['load', 'storage'], default='load', help='BigQuery sink to exercise (in-memory stand-ins)')
+    parser.add_argument('--threads', type=int, default=1, help='DuckDB threads')
+    parser.add_argument('--known_fraction', type=float, default=0.0, help='Fraction of calls already "in BigQuery"')
+    parser.add_argument('--content_mode', choices=['inline', 'normalized'], default='inline', help='Content storage mode of the stand-in BigQuery')
+    parser.add_argument('--refresh', action='store_true', help='Run with refresh; every known call is treated as revised upstream')
+    parser.add_argument('--output', type=str, help='Results JSON path (default: bench_results/<timestamp>.json)')
+    parser.add_argument('--baseline', type=str, help='Results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Allowed slowdown vs. baseline (0.15 = 15%%)')
+    args = parser.parse_args()
+
+    params = dict(SCALES[args.scale])
+    for key in params:
+        if getattr(args, key) is not None:
+            params[key] = getattr(args, key)
+
+    results = run_benchmark(params, repeat=args.repeat, mode=args.mode, batch_size=args.batch_size,
+                            bq_sink=args.bq_sink, threads=args.threads, known_fraction=args.known_fraction,
+                            content_mode=args.content_mode, refresh=args.refresh)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results['summary'], indent=2))
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        differing = sorted(k for k in results['params'] if k != 'repeat' and baseline['params'].get(k) != results['params'][k])
+        if differing:
+            print(f"Warning: baseline was run with different parameters ({', '.join(differing)}).")
+        regressions = compare(results['summary'], baseline['summary'], args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions above {args.threshold:.0%}.")
+            sys.exit(1)
+        print("No regressions.")
@@ -0,0 +1,268 @@
+import logging
+import threading
+import uuid
+import pyarrow as pa
+import pyarrow.compute as pc
+from bq_writer import BigQueryWriter, CONTENT_TABLE, PARAGRAPHS_TABLE
+import content_store
+
+logger = logging.getLogger(__name__)
+
+# Rows per AppendRows request; keeps each request well under the 10 MB API limit
+DEFAULT_ROWS_PER_APPEND = 2000
+# Appends sent before waiting for their acknowledgements
+MAX_IN_FLIGHT = 8
+
+CONTENT_SCHEMA = pa.schema([
+    ('transcript_id', pa.string()),
+    ('paragraph_number', pa.int64()),
+    ('speaker', pa.string()),
+    ('content', pa.string()),
+])
+# Normalized content mode: hash references streamed in place of the content rows
+PARAGRAPHS_SCHEMA = pa.schema([
+    ('transcript_id', pa.string()),
+    ('paragraph_number', pa.int64()),
+    ('speaker', pa.string()),
+    ('content_hash', pa.binary()),
+])
+
+class StorageWriteSink:
+    """
+    Arrow-native BigQuery sink. Content record batches are streamed through the
+    Storage Write API without ever becoming a pandas DataFrame, into a staging
+    table of this write. One transaction then inserts the staged content of calls
+    not yet stored and MERGEs the metadata (one row per call), as BigQueryWriter
+    does with loaded chunks. Content therefore only becomes visible with its
+    metadata, and concurrent runs writing the same calls are serialized by that
+    transaction: the second one finds the metadata and inserts nothing.
+
+    stream_type 'PENDING' commits the staged content atomically; 'COMMITTED' makes
+    rows visible in the staging table as soon as each append is acknowledged.
+    A failed write drops its staging table (which also expires on its own).
+
+    With normalized content (db_cloud_utils.initialize_bq) the hash references are
+    streamed instead, and the distinct paragraph texts are MERGEd with the metadata.
+
+    Revised calls (replace=True) are rare and must swap their old paragraphs out in
+    one transaction; they go through BigQueryWriter.
+
+    backend: BigQueryStorageBackend (default) or LocalArrowBackend for tests.
+    """
+
+    accepts_arrow = True
+
+    def __init__(self, project_id, dataset_id, stream_type='PENDING',
+                 rows_per_append=DEFAULT_ROWS_PER_APPEND, backend=None):
+        self.backend = backend or BigQueryStorageBackend(project_id, dataset_id)
+        self.stream_type = stream_type
+        self.rows_per_append = rows_per_append
+
+    def write(self, metadata_df, content, replace=False):
+        """
+        metadata_df: DataFrame of new calls; content: pyarrow Table of their paragraphs.
+        replace: the calls may already be stored; replace them atomically.
+        """
+        if metadata_df.empty:
+            return
+        content = content.select(CONTENT_SCHEMA.names).cast(CONTENT_SCHEMA)
+        if replace:
+            self.backend.replace(metadata_df, content)
+            logger.info(f"Replaced {len(metadata_df)} revised calls ({content.num_rows} paragraphs).")
+            return
+        table_name, schema, paragraph_text = CONTENT_TABLE, CONTENT_SCHEMA, None
+        if self.backend.content_mode() == 'normalized':
+            content, paragraph_text = content_store.split_content(content)
+            table_name, schema = PARAGRAPHS_TABLE, PARAGRAPHS_SCHEMA
+
+        staging = self.backend.create_staging(table_name)
+        try:
+            stream = self.backend.open_stream(staging, schema, self.stream_type)
+            try:
+                for batch in content.to_batches(max_chunksize=self.rows_per_append):
+                    stream.append(batch)
+                stream.commit()
+            except Exception:
+                stream.abort()
+                raise
+            self.backend.commit(metadata_df, (staging, schema.names), paragraph_text)
+        finally:
+            self.backend.drop_staging(staging)
+        logger.info(f"Streamed {content.num_rows} paragraphs for {len(metadata_df)} calls via the Storage Write API.")
+
+class BigQueryStorageBackend:
+    """Storage Write API streams into staging tables, committed by a BigQueryWriter transaction."""
+
+    def __init__(self, project_id, dataset_id):
+        from google.cloud import bigquery_storage_v1
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self.write_client = bigquery_storage_v1.BigQueryWriteClient()
+        self.metadata_writer = BigQueryWriter(project_id, dataset_id)
+
+    def content_mode(self):
+        return self.metadata_writer.content_mode
+
+    def create_staging(self, table_name):
+        """Name of a new, empty staging table shaped like table_name."""
+        staging_id = self.metadata_writer.create_staging_table(table_name, uuid.uuid4().hex[:12])
+        return staging_id.rsplit('.', 1)[1]
+
+    def drop_staging(self, name):
+        try:
+            self.metadata_writer.client.delete_table(self.metadata_writer.table_id(name), not_found_ok=True)
+        except Exception as e:
+            logger.warning(f"Could not drop staging table {name}: {e}")
+
+    def open_stream(self, table_name, schema, stream_type):
+        path = self.write_client.table_path(self.project_id, self.dataset_id, table_name)
+        return _StorageWriteStream(self.write_client, path, schema, stream_type)
+
+    def commit(self, metadata_df, staged_content, paragraph_text=None):
+        """Insert the staged content of calls not yet stored and MERGE their metadata in one transaction."""
+        staging, columns = staged_content
+        if paragraph_text is not None:
+            paragraph_text = paragraph_text.to_pandas()
+        self.metadata_writer.write(metadata_df, None, paragraph_text=paragraph_text,
+                                   staged_content=(self.metadata_writer.table_id(staging), columns))
+
+    def replace(self, metadata_df, content):
+        self.metadata_writer.write(metadata_df, content.to_pandas(), replace=True)
+
+class _StorageWriteStream:
+    def __init__(self, write_client, table_path, schema, stream_type):
+        from google.cloud.bigquery_storage_v1 import types, writer
+        self.types = types
+        self.write_client = write_client
+        self.table_path = table_path
+        self.stream_type = stream_type
+
+        stream_kind = types.WriteStream.Type.PENDING if stream_type == 'PENDING' else types.WriteStream.Type.COMMITTED
+        self.write_stream = write_client.create_write_stream(
+            parent=table_path, write_stream=types.WriteStream(type_=stream_kind)
+        )
+        template = types.AppendRowsRequest(
+            write_stream=self.write_stream.name,
+            arrow_rows=types.AppendRowsRequest.ArrowData(
+                writer_schema=types.ArrowSchema(serialized_schema=schema.serialize().to_pybytes())
+            ),
+        )
+        self.append_stream = writer.AppendRowsStream(write_client, template)
+        self.offset = 0
+        self.in_flight = []
+
+    def append(self, batch):
+        request = self.types.AppendRowsRequest(
+            offset=self.offset,
+            arrow_rows=self.types.AppendRowsRequest.ArrowData(
+                rows=self.types.ArrowRecordBatch(
+                    serialized_record_batch=batch.serialize().to_pybytes(),
+                    row_count=batch.num_rows,
+                )
+            ),
+        )
+        # Explicit offsets make a resent append fail instead of writing the rows twice
+        self.in_flight.append(self.append_stream.send(request))
+        self.offset += batch.num_rows
+        if len(self.in_flight) >= MAX_IN_FLIGHT:
+            self._drain()
+
+    def commit(self):
+        self._drain()
+        self.append_stream.close()
+        self.write_client.finalize_write_stream(name=self.write_stream.name)
+        if self.stream_type == 'PENDING':
+            response = self.write_client.batch_commit_write_streams(
+                self.types.BatchCommitWriteStreamsRequest(parent=self.table_path, write_streams=[self.write_stream.name])
+            )
+            if response.stream_errors:
+                raise RuntimeError(f"Storage Write API commit failed: {list(response.stream_errors)}")
+
+    def abort(self):
+        # Uncommitted PENDING streams are garbage-collected by BigQuery
+        try:
+            self.append_stream.close()
+        except Exception:
+            pass
+
+    def _drain(self):
+        for future in self.in_flight:
+            future.result()
+        self.in_flight = []
+
+class LocalArrowBackend:
+    """In-memory stand-in for BigQueryStorageBackend (tests, benchmarks, offline runs)."""
+
+    def __init__(self, content_mode='inline'):
+        self.mode = content_mode
+        # Content rows, or hash references in normalized mode
+        self.content = pa.Table.from_batches([], schema=PARAGRAPHS_SCHEMA if content_mode == 'normalized' else CONTENT_SCHEMA)
+        self.paragraph_text = pa.table({'content_hash': pa.array([], pa.binary()), 'content': pa.array([], pa.string())})
+        self.metadata = None
+        self.staging = {}
+        self._lock = threading.Lock()
+
+    def content_mode(self):
+        return self.mode
+
+    def create_staging(self, table_name):
+        name = f"_staging_{table_name}_{uuid.uuid4().hex[:12]}"
+        self.staging[name] = None
+        return name
+
+    def drop_staging(self, name):
+        self.staging.pop(name, None)
+
+    def open_stream(self, table_name, schema, stream_type):
+        return _LocalStream(self, table_name, schema)
+
+    def commit(self, metadata_df, staged_content, paragraph_text=None):
+        staging, _ = staged_content
+        with self._lock:
+            staged = self.staging[staging]
+            if staged is not None and self.metadata is not None:
+                staged = staged.filter(pc.invert(pc.is_in(staged['transcript_id'], value_set=self.metadata['transcript_id'].combine_chunks())))
+            if staged is not None:
+                self.content = pa.concat_tables([self.content, staged.cast(self.content.schema)])
+            self.merge_metadata(metadata_df, paragraph_text)
+
+    def replace(self, metadata_df, content):
+        ids = pa.array(metadata_df['transcript_id'].tolist(), type=pa.string())
+        with self._lock:
+            self.content = self.content.filter(pc.invert(pc.is_in(self.content['transcript_id'], value_set=ids)))
+            if self.metadata is not None:
+                self.metadata = self.metadata.filter(pc.invert(pc.is_in(self.metadata['transcript_id'], value_set=ids)))
+            paragraph_text = None
+            if self.mode == 'normalized':
+                content, paragraph_text = content_store.split_content(content)
+            self.content = pa.concat_tables([self.content, content.cast(self.content.schema)])
+            self.merge_metadata(metadata_df, paragraph_text)
+
+    def merge_metadata(self, metadata_df, paragraph_text=None):
+        if paragraph_text is not None:
+            known = self.paragraph_text['content_hash'].combine_chunks()
+            paragraph_text = paragraph_text.filter(pc.invert(pc.is_in(paragraph_text['content_hash'], value_set=known)))
+            self.paragraph_text = pa.concat_tables([self.paragraph_text, paragraph_text.cast(self.paragraph_text.schema)])
+        new_rows = pa.Table.from_pandas(metadata_df, preserve_index=False)
+        if self.metadata is not None:
+            known = self.metadata['transcript_id']
+            new_rows = new_rows.filter(pc.invert(pc.is_in(new_rows['transcript_id'], value_set=known.combine_chunks())))
+            new_rows = pa.concat_tables([self.metadata, new_rows.cast(self.metadata.schema)])
+        self.metadata = new_rows
+
+class _LocalStream:
+    def __init__(self, backend, table_name, schema):
+        self.backend = backend
+        self.table_name = table_name
+        self.schema = schema
+        self.pending = []
+
+    def append(self, batch):
+        self.pending.append(batch)
+
+    def commit(self):
+        self.backend.staging[self.table_name] = pa.Table.from_batches(self.pending, schema=self.schema)
+        self.pending = []
+
+    def abort(self):
+        self.pending = []
@@ -0,0 +1,279 @@
+import datetime
+import io
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.api_core import exceptions as gexc
+from google.cloud import bigquery
+import content_store
+import db_cloud_utils
+
+logger = logging.getLogger(__name__)
+
+METADATA_TABLE = "earnings_call_transcript_metadata"
+CONTENT_TABLE = db_cloud_utils.CONTENT_TABLE
+PARAGRAPH_TEXT_TABLE = db_cloud_utils.PARAGRAPH_TEXT_TABLE
+PARAGRAPHS_TABLE = db_cloud_utils.PARAGRAPHS_TABLE
+
+DEFAULT_CHUNK_BYTES = 64 * 1024 ** 2  # uncompressed in-memory size per uploaded chunk
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_ATTEMPTS = 5
+STAGING_EXPIRATION = datetime.timedelta(days=1)
+
+def _is_retryable(error):
+    if isinstance(error, (gexc.ServerError, gexc.TooManyRequests, ConnectionError, TimeoutError)):
+        return True
+    # Rate limits and concurrent-transaction aborts are reported as 403/400
+    message = str(error)
+    return 'rateLimitExceeded' in message or 'concurrent update' in message
+
+def with_retries(fn, description, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=1.0):
+    """Call fn(), retrying transient BigQuery errors with exponential backoff."""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_attempts or not _is_retryable(e):
+                raise
+            delay = base_delay * 2 ** (attempt - 1)
+            logger.warning(f"{description} failed (attempt {attempt}/{max_attempts}), retrying in {delay:.0f}s: {e}")
+            time.sleep(delay)
+
+def split_chunks(df, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """Split df into row slices of roughly chunk_bytes in-memory size each."""
+    if df.empty:
+        return []
+    total_bytes = int(df.memory_usage(deep=True).sum())
+    rows_per_chunk = max(1, int(len(df) * chunk_bytes / max(total_bytes, 1)))
+    return [df.iloc[start:start + rows_per_chunk] for start in range(0, len(df), rows_per_chunk)]
+
+class BigQueryWriter:
+    """
+    Loads metadata and content into BigQuery with exactly-once semantics.
+
+    1. Both frames are split into size-bounded chunks, serialized to Parquet and
+       loaded concurrently into per-write staging tables. Within one write() call
+       every load job has a fixed job ID while its outcome is unknown, so retrying
+       an ambiguous upload can never load a chunk twice into that call's staging
+       table. A job known to have failed loaded nothing and is retried under a new ID.
+    2. One transaction then inserts content for calls not yet in the metadata
+       table and MERGEs the metadata. Metadata is therefore only visible once its
+       content has landed. Writing the same batch again (a new call, with new
+       staging tables and job IDs) inserts nothing twice: this commit is what
+       makes batch retries idempotent, not the job IDs.
+    3. Staging tables are dropped (they also expire on their own after a day).
+
+    If the dataset stores normalized content (db_cloud_utils.initialize_bq), content
+    is split into hash references, inserted like inline content, and distinct
+    paragraph texts, MERGEd on their hash in the same transaction. Texts this
+    writer has already committed are not uploaded again.
+
+    With replace (revised calls of a refresh run), the transaction instead deletes
+    the stored content of the batch's calls, inserts the new content and updates
+    their metadata, so readers see either version of a call, never a mix.
+    """
+
+    def __init__(self, project_id, dataset_id, chunk_bytes=DEFAULT_CHUNK_BYTES,
+                 max_workers=DEFAULT_MAX_WORKERS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self.client = db_cloud_utils.get_client(project_id)
+        self.chunk_bytes = chunk_bytes
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self._content_mode = None
+        self._metadata_columns = None
+        self.known_hashes = content_store.KnownHashes()
+
+    @property
+    def content_mode(self):
+        if self._content_mode is None:
+            self._content_mode = db_cloud_utils.get_content_mode_bq(self.project_id, self.dataset_id) or 'inline'
+        return self._content_mode
+
+    @property
+    def metadata_columns(self):
+        """Columns of the metadata table (content_fingerprint is missing until initialize_bq adds it)."""
+        if self._metadata_columns is None:
+            self._metadata_columns = [f.name for f in self.client.get_table(self.table_id(METADATA_TABLE)).schema]
+        return self._metadata_columns
+
+    def table_id(self, name):
+        return f"{self.project_id}.{self.dataset_id}.{name}"
+
+    def write(self, metadata_df, content_df, paragraph_text=None, replace=False, staged_content=None):
+        """
+        Stage, then atomically commit one batch of calls. Raises if it could not be committed.
+        content_df=None only MERGEs the metadata (used when content was written through another path).
+        paragraph_text: DataFrame of (content_hash, content) to MERGE along with the metadata,
+        for normalized content whose references were written through another path.
+        replace: the calls may already be stored; replace their content and metadata.
+        staged_content: (staging table ID, columns) of content rows already written by the
+        caller (the Storage Write API streams them into a create_staging_table() table).
+        They are inserted in the same transaction as the metadata; the caller drops the table.
+        """
+        if metadata_df.empty:
+            return
+        # Ensure report_date is a proper DATE for BigQuery/PyArrow
+        metadata_df = metadata_df.assign(report_date=pd.to_datetime(metadata_df['report_date']).dt.date)
+        metadata_df = metadata_df[[c for c in metadata_df.columns if c in self.metadata_columns]]
+
+        content_table = CONTENT_TABLE
+        if content_df is not None and self.content_mode == 'normalized':
+            content_df, paragraph_text = content_store.split_content(content_df, self.known_hashes)
+            content_table = PARAGRAPHS_TABLE
+        elif staged_content is not None and self.content_mode == 'normalized':
+            content_table = PARAGRAPHS_TABLE
+        if paragraph_text is not None:
+            paragraph_text = paragraph_text[paragraph_text['content_hash'].map(lambda h: h not in self.known_hashes).astype(bool)]
+            if paragraph_text.empty:
+                paragraph_text = None
+
+        write_id = uuid.uuid4().hex[:12]
+        staged_metadata = self.create_staging_table(METADATA_TABLE, write_id)
+        content_columns = list(content_df.columns) if content_df is not None else None
+        if staged_content is not None:
+            staged_content, content_columns = staged_content
+        elif content_df is not None:
+            staged_content = self.create_staging_table(content_table, write_id)
+        staged_text = self.create_staging_table(PARAGRAPH_TEXT_TABLE, write_id) if paragraph_text is not None else None
+        # Staging tables this call created (a caller's staged_content stays with the caller)
+        own_tables = [staged_metadata] + [staged_content] * (content_df is not None) + [staged_text]
+
+        try:
+            uploads = []
+            if content_df is not None:
+                uploads += [(staged_content, chunk) for chunk in split_chunks(content_df, self.chunk_bytes)]
+            if paragraph_text is not None:
+                uploads += [(staged_text, chunk) for chunk in split_chunks(paragraph_text, self.chunk_bytes)]
+            uploads += [(staged_metadata, chunk) for chunk in split_chunks(metadata_df, self.chunk_bytes)]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [
+                    executor.submit(self._load_chunk, table, chunk, f"ecc_{write_id}_{i}")
+                    for i, (table, chunk) in enumerate(uploads)
+                ]
+                for future in futures:
+                    future.result()
+
+            self._commit(staged_metadata, staged_content, list(metadata_df.columns), content_columns,
+                         content_table, staged_text, pd.to_datetime(metadata_df['report_date']).min(), replace)
+            if paragraph_text is not None:
+                self.known_hashes.update(paragraph_text['content_hash'])
+            logger.info(f"Committed {len(metadata_df)} calls to BigQuery in {len(uploads)} chunks.")
+        finally:
+            for staged in own_tables:
+                if staged is None:
+                    continue
+                try:
+                    self.client.delete_table(staged, not_found_ok=True)
+                except Exception as e:
+                    logger.warning(f"Could not drop staging table {staged}: {e}")
+
+    def create_staging_table(self, name, write_id):
+        """Create an empty staging table shaped like table name; it expires after STAGING_EXPIRATION."""
+        target = self.client.get_table(self.table_id(name))
+        # Staging columns are nullable so Parquet chunks load regardless of REQUIRED modes
+        schema = [bigquery.SchemaField(f.name, f.field_type, mode="NULLABLE") for f in target.schema]
+        staging_id = self.table_id(f"_staging_{name}_{write_id}")
+        table = bigquery.Table(staging_id, schema=schema)
+        table.expires = datetime.datetime.now(datetime.timezone.utc) + STAGING_EXPIRATION
+        with_retries(lambda: self.client.create_table(table, exists_ok=True), f"Creating staging table for {name}",
+                     self.max_attempts)
+        return staging_id
+
+    def _load_chunk(self, table_id, chunk, job_id):
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pandas(chunk, preserve_index=False), buffer, compression='snappy')
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition="WRITE_APPEND",
+        )
+
+        attempt = {'number': 0, 'job_id': job_id}
+
+        def load():
+            current_id = attempt['job_id']
+            try:
+                buffer.seek(0)
+                job = self.client.load_table_from_file(buffer, table_id, job_id=current_id, job_config=job_config)
+            except gexc.Conflict:
+                # An earlier request timed out after creating this job; wait for it instead of loading again
+                job = self.client.get_job(current_id)
+            try:
+                return job.result()
+            except Exception:
+                # The job ran and failed, so it loaded nothing: retry under a new ID (reusing this
+                # one would only fetch the failed job again). A job whose outcome is unknown keeps its ID.
+                if job.error_result is not None:
+                    attempt['number'] += 1
+                    attempt['job_id'] = f"{job_id}_a{attempt['number']}"
+                raise
+
+        with_retries(load, f"Loading chunk {job_id}", self.max_attempts)
+
+    def _commit(self, staged_metadata, staged_content, metadata_columns, content_columns,
+                content_table=CONTENT_TABLE, staged_text=None, min_report_date=None, replace=False):
+        metadata_table = self.table_id(METADATA_TABLE)
+        content_table = self.table_id(content_table)
+        metadata_cols = ", ".join(metadata_columns)
+        # A transcript_id always has the same report_date, so existing calls can only be
+        # found from the batch's earliest date on; this prunes the metadata partitions.
+        where_recent, on_recent = "", ""
+        if not pd.isna(min_report_date):
+            where_recent = f"WHERE report_date >= DATE '{min_report_date.date()}'"
+            on_recent = f"AND T.report_date >= DATE '{min_report_date.date()}'"
+
+        insert_content = ""
+        if staged_content is not None and replace:
+            content_cols = ", ".join(content_columns)
+            insert_content = f"""
+        DELETE FROM `{content_table}`
+        WHERE transcript_id IN (SELECT transcript_id FROM `{staged_metadata}`);
+        INSERT INTO `{content_table}` ({content_cols})
+        SELECT {content_cols}
+        FROM `{staged_content}`;
+        """
+        elif staged_content is not None:
+            content_cols = ", ".join(content_columns)
+            insert_content = f"""
+        INSERT INTO `{content_table}` ({content_cols})
+        SELECT {content_cols}
+        FROM `{staged_content}`
+        WHERE transcript_id NOT IN (SELECT transcript_id FROM `{metadata_table}` {where_recent});
+        """
+        update_metadata = ""
+        if replace:
+            updated = [c for c in metadata_columns if c != 'transcript_id']
+            update_metadata = f"""
+        WHEN MATCHED THEN
+          UPDATE SET {", ".join(f"{c} = S.{c}" for c in updated)}"""
+        merge_text = ""
+        if staged_text is not None:
+            merge_text = f"""
+        MERGE `{self.table_id(PARAGRAPH_TEXT_TABLE)}` T
+        USING (SELECT DISTINCT content_hash, content FROM `{staged_text}`) S
+        ON T.content_hash = S.content_hash
+        WHEN NOT MATCHED THEN
+          INSERT (content_hash, content) VALUES (S.content_hash, S.content);
+        """
+        query = f"""
+        BEGIN TRANSACTION;
+        {insert_content}
+        {merge_text}
+        MERGE `{metadata_table}` T
+        USING (
+          SELECT * EXCEPT(rn) FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY transcript_id) AS rn FROM `{staged_metadata}`
+          ) WHERE rn = 1
+        ) S
+        ON T.transcript_id = S.transcript_id {on_recent}{update_metadata}
+        WHEN NOT MATCHED THEN
+          INSERT ({metadata_cols}) VALUES ({", ".join(f"S.{c}" for c in metadata_columns)});
+
+        COMMIT TRANSACTION;
+        """
+        with_retries(lambda: self.client.query(query).result(), "Committing staged batch", self.max_attempts)
@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import time
+import db_cloud_utils
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = '.checkpoints'
+
+TICKER = 'ticker'
+CALL = 'call'
+
+# Checkpointing is opt-in: on Cloud Run every flush is a DML INSERT into BigQuery.
+# 'ticker': record each ticker once all of its new calls are committed.
+# An int N: additionally record committed calls, flushing the manifest every N transcripts.
+DEFAULT_GRANULARITY = None
+
+# Manifests of runs that never completed are pruned after this many days
+RETENTION_DAYS = 7
+
+def parse_granularity(value):
+    """'ticker', a positive number of transcripts, or None/'off' (no checkpointing)."""
+    if value is None or value == TICKER:
+        return value
+    if isinstance(value, str) and value.lower() in ('off', 'none', ''):
+        return None
+    every = int(value)
+    if every <= 0:
+        raise ValueError(f"Checkpoint granularity must be 'ticker' or a positive number of transcripts, got {value!r}")
+    return every
+
+class LocalStore:
+    """Manifest as an append-only JSON lines file (one line per flush) in CHECKPOINT_DIR."""
+
+    def __init__(self, run_id, directory=CHECKPOINT_DIR):
+        self.path = os.path.join(directory, f"{run_id}.jsonl")
+
+    def load(self):
+        units = []
+        if not os.path.exists(self.path):
+            return units
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    units.extend(tuple(unit) for unit in json.loads(line))
+                except ValueError:
+                    # A line cut short by a crash mid-write; its units are simply redone
+                    continue
+        return units
+
+    def append(self, units):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(units) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def delete(self):
+        """Remove this run's manifest and those of runs abandoned more than RETENTION_DAYS ago."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        directory = os.path.dirname(self.path) or '.'
+        if not os.path.isdir(directory):
+            return
+        cutoff = time.time() - RETENTION_DAYS * 86400
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.jsonl') and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+
+class BigQueryStore:
+    """Manifest as rows of the CHECKPOINT_TABLE (survives the instance, for Cloud Run)."""
+
+    def __init__(self, run_id, project_id, dataset_id):
+        self.run_id = run_id
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+
+    def load(self):
+        return db_cloud_utils.get_checkpoints_bq(self.project_id, self.dataset_id, self.run_id)
+
+    def append(self, units):
+        db_cloud_utils.record_checkpoints_bq(self.project_id, self.dataset_id, self.run_id, units)
+
+    def delete(self):
+        db_cloud_utils.delete_checkpoints_bq(self.project_id, self.dataset_id, self.run_id, RETENTION_DAYS)
+
+class Manifest:
+    """
+    Units of a run that are committed to every sink: tickers whose new calls were
+    all written, and (with a numeric granularity) individual calls. A resumed run
+    skips the completed tickers without scanning them and treats the recorded calls
+    as already ingested. Recording is best effort: a failed flush is logged and the
+    units are retried with the next one. Once the run completes its manifest is
+    deleted (discard), so the store only holds runs that may still be resumed.
+    """
+
+    def __init__(self, run_id, store, granularity=TICKER):
+        self.run_id = run_id
+        self.store = store
+        self.granularity = granularity
+        self.tickers = set()
+        self.calls = set()
+        self._pending = []
+        self._pending_calls = 0
+
+    def load(self):
+        for unit_type, unit in self.store.load():
+            (self.tickers if unit_type == TICKER else self.calls).add(unit)
+        return self
+
+    def mark_tickers(self, symbols):
+        new = [s for s in symbols if s not in self.tickers]
+        self.tickers.update(new)
+        self._pending += [(TICKER, s) for s in new]
+
+    def mark_calls(self, transcript_ids):
+        if self.granularity == TICKER:
+            return
+        new = [t for t in transcript_ids if t not in self.calls]
+        self.calls.update(new)
+        self._pending += [(CALL, t) for t in new]
+        self._pending_calls += len(new)
+
+    def flush(self, force=False):
+        """Write pending units: per ticker right away, per N transcripts once N calls are pending."""
+        if not self._pending:
+            return
+        if not force and self.granularity != TICKER and self._pending_calls < self.granularity:
+            return
+        try:
+            self.store.append(self._pending)
+            self._pending = []
+            self._pending_calls = 0
+        except Exception as e:
+            logger.error(f"Failed to record checkpoint for run {self.run_id}: {e}")
+
+    def discard(self):
+        """Delete the manifest of a completed run (and prune abandoned ones)."""
+        self._pending = []
+        self._pending_calls = 0
+        try:
+            self.store.delete()
+            logger.info(f"Run {self.run_id} complete; its checkpoint manifest was deleted.")
+        except Exception as e:
+            logger.warning(f"Could not delete the checkpoint manifest of run {self.run_id}: {e}")
+
+def open_manifest(run_id, granularity=TICKER, is_cloud_run=False, project_id=None, dataset_id=None, resume=False):
+    """
+    run_id's manifest, kept in BigQuery on Cloud Run (local files do not survive
+    the instance) and in CHECKPOINT_DIR otherwise. resume: load what it recorded so far.
+    """
+    store = BigQueryStore(run_id, project_id, dataset_id) if is_cloud_run else LocalStore(run_id)
+    manifest = Manifest(run_id, store, granularity)
+    return manifest.load() if resume else manifest
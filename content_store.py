@@ -0,0 +1,73 @@
+import hashlib
+import pandas as pd
+import pyarrow as pa
+
+# 'inline' stores every paragraph's text in the content table. 'normalized' stores
+# each distinct paragraph text once, keyed by its MD5 digest, and the content rows
+# only reference it; the old content table name becomes a view with the same shape.
+CONTENT_MODES = ('inline', 'normalized')
+
+# Digests remembered per process as already committed (16 bytes each, ~100 bytes in a set)
+KNOWN_HASHES_LIMIT = 200_000
+
+REF_COLUMNS = ['transcript_id', 'paragraph_number', 'speaker', 'content_hash']
+TEXT_COLUMNS = ['content_hash', 'content']
+
+def content_hash(text):
+    """MD5 digest of a paragraph's text (same as BigQuery's MD5(content)), None for missing text."""
+    return hashlib.md5(text.encode()).digest() if isinstance(text, str) else None
+
+class KnownHashes:
+    """
+    Bounded set of paragraph digests this process has already committed, so repeated
+    boilerplate is not uploaded again in later batches. Cleared when it reaches limit.
+    """
+
+    def __init__(self, limit=KNOWN_HASHES_LIMIT):
+        self.limit = limit
+        self._hashes = set()
+
+    def __contains__(self, digest):
+        return digest in self._hashes
+
+    def update(self, digests):
+        if len(self._hashes) >= self.limit:
+            self._hashes.clear()
+        self._hashes.update(digests)
+
+def split_content(content, known_hashes=()):
+    """
+    Split content rows (transcript_id, paragraph_number, speaker, content) into
+    hash references and distinct paragraph texts.
+    content: pyarrow Table or DataFrame; both results are returned as the same kind.
+    Texts whose digest is in known_hashes are left out of the texts result.
+    """
+    is_arrow = isinstance(content, pa.Table)
+    texts = content.column('content').to_pylist() if is_arrow else content['content'].tolist()
+
+    hashes = []
+    first_rows = []
+    seen = set()
+    for i, text in enumerate(texts):
+        # Missing text (None, or NaN/NA from pandas) has no digest and no paragraph_text row
+        digest = content_hash(text)
+        hashes.append(digest)
+        if digest is not None and digest not in seen and digest not in known_hashes:
+            seen.add(digest)
+            first_rows.append(i)
+
+    if is_arrow:
+        hash_array = pa.array(hashes, type=pa.binary())
+        refs = content.select(REF_COLUMNS[:-1]).append_column('content_hash', hash_array)
+        unique_texts = pa.table({
+            'content_hash': hash_array.take(pa.array(first_rows, type=pa.int64())),
+            'content': content.column('content').take(pa.array(first_rows, type=pa.int64())),
+        })
+        return refs, unique_texts
+
+    refs = content[REF_COLUMNS[:-1]].assign(content_hash=hashes)
+    unique_texts = pd.DataFrame({
+        'content_hash': [hashes[i] for i in first_rows],
+        'content': [texts[i] for i in first_rows],
+    })
+    return refs, unique_texts
@@ -0,0 +1,339 @@
+import contextlib
+import datetime
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+import duckdb
+import requests
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+# Held while the mirror is refreshed or the manifest is updated (shards.py runs several processes on one cache)
+LOCK_FILE = '.lock'
+# One lease file per reader, listing the partitions it reads and locked while it may still read them
+READERS_DIR = '.readers'
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3  # 5 GiB
+DOWNLOAD_CHUNK_BYTES = 8 * 1024 ** 2
+
+class DatasetCache:
+    """
+    Local mirror of the stock_earning_call_transcripts parquet, partitioned as
+    symbol=<SYMBOL>/year=<YEAR>/ so DuckDB only opens the files a query needs.
+
+    The upstream file is checked with a HEAD request (ETag + size) on each use and
+    only downloaded when it changed. After a download, only partitions whose
+    fingerprint changed (or that are needed but missing) are rewritten.
+    Partitions are evicted least-recently-used first once the cache exceeds max_bytes,
+    except those a reader still holds a lease on (source_sql() until release()).
+    Processes sharing cache_dir take turns through a file lock: the first one to
+    find the mirror stale refreshes it, the others then find it up to date.
+
+    offline: never touch the network; use what is already cached.
+    fixture: local parquet file or directory used in place of the upstream URL
+             (for tests and local runs).
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, offline=False, fixture=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.fixture = fixture
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.manifest = self._load_manifest()
+        self._lease = None
+
+    def source_sql(self, url, tickers, cutoff_date):
+        """
+        Return a DuckDB table expression reading only the cached partitions for
+        tickers since cutoff_date, or None if the dataset has no such partitions.
+        Refreshes the mirror from upstream first if needed. The partitions are leased
+        to this cache and not evicted by anyone until release() (or this process exits).
+        """
+        upstream = self.fixture or url
+        cutoff_year = datetime.date.fromisoformat(str(cutoff_date)[:10]).year
+        tickers = set(tickers)
+
+        def needed_keys():
+            return [key for key, p in self.manifest['partitions'].items()
+                    if p['symbol'] in tickers and p['year'] >= cutoff_year]
+
+        state = self._upstream_state(upstream)
+        with self._locked():
+            # Another process may have refreshed the mirror since this one loaded the manifest
+            self.manifest = self._load_manifest()
+            missing = [key for key in needed_keys() if not self.manifest['partitions'][key]['present']]
+            if state is not None and (state != self.manifest.get('upstream') or not self.manifest['partitions']):
+                self.refresh(upstream, state, needed=lambda p: p['symbol'] in tickers and p['year'] >= cutoff_year)
+            elif state is not None and missing:
+                self.fill(upstream, missing)
+            elif state is None and missing:
+                logger.warning(f"Offline: {len(missing)} needed partitions are not cached and will be skipped.")
+
+            needed = [key for key in needed_keys() if self.manifest['partitions'][key]['present']]
+            now = time.time()
+            for key in needed:
+                self.manifest['partitions'][key]['last_access'] = now
+            self._hold(needed)
+            self.evict()
+            self._save_manifest()
+
+        if not needed:
+            return None
+
+        files = ", ".join(f"'{os.path.join(self.cache_dir, self.manifest['partitions'][key]['path'])}'" for key in sorted(needed))
+        logger.info(f"Reading {len(needed)} cached partitions from {self.cache_dir}.")
+        return f"read_parquet([{files}], hive_partitioning = true)"
+
+    def refresh(self, upstream, state, needed=None):
+        """
+        Bring the mirror up to date with upstream. The caller holds the cache lock (see source_sql).
+        needed: predicate on a partition entry; partitions it selects are materialized
+        even if they were evicted. Partitions already present are rewritten only if changed.
+        """
+        is_remote = _is_remote(upstream)
+        local_file = self._download(upstream) if is_remote else upstream
+        source = _read_sql(local_file)
+
+        try:
+            with duckdb.connect() as con:
+                rows = con.execute(f"""
+                    SELECT symbol,
+                           year(CAST(report_date AS DATE)) AS year,
+                           count(*) AS row_count,
+                           CAST(bit_xor(hash(report_date, fiscal_year, fiscal_quarter, transcripts)) AS VARCHAR) AS fingerprint
+                    FROM {source}
+                    GROUP BY ALL
+                """).fetchall()
+
+                partitions = self.manifest['partitions']
+                upstream_keys = set()
+                to_write = []
+                for symbol, year, row_count, fingerprint in rows:
+                    key = f"{symbol}/{year}"
+                    upstream_keys.add(key)
+                    entry = partitions.get(key)
+                    fingerprint = f"{row_count}-{fingerprint}"
+                    if entry is None:
+                        entry = partitions[key] = {
+                            'symbol': symbol, 'year': year,
+                            'path': os.path.join(f"symbol={symbol}", f"year={year}", 'data_0.parquet'),
+                            'fingerprint': None, 'bytes': 0, 'last_access': 0, 'present': False,
+                        }
+                    changed = entry['fingerprint'] != fingerprint
+                    wanted = entry['present'] or (needed is not None and needed(entry))
+                    if wanted and (changed or not entry['present']):
+                        to_write.append((symbol, year))
+                    entry['fingerprint'] = fingerprint
+
+                for key in set(partitions) - upstream_keys:
+                    self._remove_partition(partitions.pop(key))
+
+                if to_write:
+                    self._write_partitions(con, source, to_write)
+
+            self.manifest['upstream'] = state
+            self._save_manifest()
+            logger.info(f"Dataset cache refreshed: {len(to_write)} partitions written, {len(upstream_keys)} upstream partitions.")
+        finally:
+            if is_remote and os.path.exists(local_file):
+                os.remove(local_file)
+
+    def fill(self, upstream, keys):
+        """
+        Materialize evicted partitions of an unchanged upstream. Only their rows are
+        read (a remote file through HTTP range requests), not the whole dataset.
+        The caller holds the cache lock.
+        """
+        entries = [self.manifest['partitions'][key] for key in keys]
+        with duckdb.connect() as con:
+            self._write_partitions(con, _read_sql(upstream), [(e['symbol'], e['year']) for e in entries])
+        logger.info(f"Dataset cache: {len(entries)} evicted partitions fetched again.")
+
+    def evict(self, protect=()):
+        """
+        Delete least-recently-used partitions until the cache fits in max_bytes.
+        Partitions in protect or leased by a live reader are kept, so the cache can
+        stay above max_bytes while concurrent runs need more.
+        """
+        present = [p for p in self.manifest['partitions'].values() if p['present']]
+        total = sum(p['bytes'] for p in present)
+        if total <= self.max_bytes:
+            return
+        protect = set(protect) | self._leased_keys()
+        for entry in sorted(present, key=lambda p: p['last_access']):
+            if total <= self.max_bytes:
+                break
+            if f"{entry['symbol']}/{entry['year']}" in protect:
+                continue
+            total -= entry['bytes']
+            self._remove_partition(entry)
+            logger.info(f"Evicted cached partition {entry['path']}.")
+
+    def _write_partitions(self, con, source, keys):
+        staging = os.path.join(self.cache_dir, '.staging')
+        shutil.rmtree(staging, ignore_errors=True)
+        con.execute("CREATE TEMP TABLE wanted_partitions (symbol VARCHAR, year BIGINT)")
+        con.executemany("INSERT INTO wanted_partitions VALUES (?, ?)", keys)
+        con.execute(f"""
+            COPY (
+                SELECT t.*, year(CAST(t.report_date AS DATE)) AS year
+                FROM {source} t
+                SEMI JOIN wanted_partitions w
+                  ON t.symbol = w.symbol AND year(CAST(t.report_date AS DATE)) = w.year
+            ) TO '{staging}' (FORMAT PARQUET, PARTITION_BY (symbol, year), COMPRESSION ZSTD, FILENAME_PATTERN 'data_{{i}}')
+        """)
+
+        for symbol, year in keys:
+            entry = self.manifest['partitions'][f"{symbol}/{year}"]
+            target = os.path.join(self.cache_dir, os.path.dirname(entry['path']))
+            shutil.rmtree(target, ignore_errors=True)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(os.path.join(staging, os.path.dirname(entry['path'])), target)
+            entry['present'] = True
+            entry['bytes'] = os.path.getsize(os.path.join(self.cache_dir, entry['path']))
+            entry['last_access'] = time.time()
+        shutil.rmtree(staging, ignore_errors=True)
+
+    def release(self):
+        """End this cache's lease: its partitions may be evicted again."""
+        if self._lease is None:
+            return
+        path, lease_file = self._lease
+        self._lease = None
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        lease_file.close()
+
+    def _hold(self, keys):
+        """Lease keys to this cache until release(); the caller holds the cache lock."""
+        self.release()
+        readers = os.path.join(self.cache_dir, READERS_DIR)
+        os.makedirs(readers, exist_ok=True)
+        path = os.path.join(readers, f"{uuid.uuid4().hex}.json")
+        lease_file = open(path, 'w')
+        # Locked for as long as the file stays open, so it is released even if the process dies
+        fcntl.flock(lease_file, fcntl.LOCK_EX)
+        json.dump(sorted(keys), lease_file)
+        lease_file.flush()
+        self._lease = (path, lease_file)
+
+    def _leased_keys(self):
+        """Partitions leased by live readers; leases left by dead processes are removed."""
+        readers = os.path.join(self.cache_dir, READERS_DIR)
+        own = self._lease[0] if self._lease else None
+        leased = set()
+        for name in os.listdir(readers) if os.path.isdir(readers) else []:
+            path = os.path.join(readers, name)
+            with open(path) as f:
+                if path != own:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                    except OSError:
+                        pass
+                    else:
+                        # Nobody holds it: the reader is gone
+                        os.remove(path)
+                        continue
+                try:
+                    leased.update(json.load(f))
+                except ValueError:
+                    continue
+        return leased
+
+    def _remove_partition(self, entry):
+        shutil.rmtree(os.path.join(self.cache_dir, os.path.dirname(entry['path'])), ignore_errors=True)
+        entry['present'] = False
+        entry['bytes'] = 0
+
+    def _upstream_state(self, upstream):
+        """ETag/size of the upstream file, or None when it cannot be checked (offline)."""
+        if _is_remote(upstream):
+            if self.offline:
+                return None
+            response = requests.head(upstream, allow_redirects=False, timeout=30)
+            if response.is_redirect:
+                # HuggingFace reports the LFS object's identity on the redirect
+                headers = response.headers
+            else:
+                response.raise_for_status()
+                headers = response.headers
+            return {
+                'location': upstream,
+                'etag': headers.get('X-Linked-Etag') or headers.get('ETag'),
+                'size': int(headers.get('X-Linked-Size') or headers.get('Content-Length') or 0),
+            }
+
+        if os.path.isdir(upstream):
+            files = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(upstream) for name in names if name.endswith('.parquet')
+            )
+        else:
+            files = [upstream]
+        stats = [os.stat(f) for f in files]
+        return {
+            'location': upstream,
+            'etag': "-".join(f"{int(s.st_mtime)}:{s.st_size}" for s in stats),
+            'size': sum(s.st_size for s in stats),
+        }
+
+    def _download(self, url):
+        target = os.path.join(self.cache_dir, '.download.parquet')
+        logger.info(f"Downloading {url} to dataset cache...")
+        with requests.get(url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(target + '.part', 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                    f.write(chunk)
+        os.replace(target + '.part', target)
+        return target
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(os.path.join(self.cache_dir, LOCK_FILE), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _load_manifest(self):
+        path = os.path.join(self.cache_dir, MANIFEST_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        return {'upstream': None, 'partitions': {}}
+
+    def _save_manifest(self):
+        path = os.path.join(self.cache_dir, MANIFEST_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(path + '.tmp', path)
+
+def _is_remote(upstream):
+    return upstream.startswith('http://') or upstream.startswith('https://')
+
+def _read_sql(upstream):
+    """DuckDB table expression reading a parquet file (local or remote) or directory of them."""
+    if not _is_remote(upstream) and os.path.isdir(upstream):
+        return f"read_parquet('{os.path.join(upstream, '**', '*.parquet')}')"
+    return f"read_parquet('{upstream}')"
+
+def from_env(cache_dir=None, offline=None, fixture=None):
+    """
+    Build a DatasetCache from arguments, falling back to the environment:
+    TRANSCRIPT_CACHE_DIR, TRANSCRIPT_CACHE_MAX_BYTES, TRANSCRIPT_CACHE_OFFLINE, TRANSCRIPT_CACHE_FIXTURE.
+    Returns None when no cache directory is configured (read upstream directly).
+    """
+    cache_dir = cache_dir or os.environ.get('TRANSCRIPT_CACHE_DIR')
+    if not cache_dir:
+        return None
+    if offline is None:
+        offline = os.environ.get('TRANSCRIPT_CACHE_OFFLINE', '').lower() in ('1', 'true', 'yes')
+    fixture = fixture or os.environ.get('TRANSCRIPT_CACHE_FIXTURE')
+    max_bytes = int(os.environ.get('TRANSCRIPT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+    return DatasetCache(cache_dir, max_bytes=max_bytes, offline=offline, fixture=fixture)
@@ -1,40 +1,246 @@
 from google.cloud import bigquery
 import logging
+import threading
+import uuid
 import pandas as pd
+import pyarrow as pa
+import content_store
 
 logger = logging.getLogger(__name__)
 
+WATERMARK_TABLE = "earnings_call_ingest_watermark"
+WATERMARK_SCHEMA = [
+    bigquery.SchemaField("symbol", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("last_report_date", "DATE", mode="REQUIRED"),
+    bigquery.SchemaField("updated_at", "TIMESTAMP", mode="NULLABLE"),
+]
+
+# Checkpoint manifests of resumable runs (see checkpoint.py): one row per completed unit
+CHECKPOINT_TABLE = "earnings_call_checkpoints"
+CHECKPOINT_SCHEMA = [
+    bigquery.SchemaField("run_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("unit_type", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("unit", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("recorded_at", "TIMESTAMP", mode="NULLABLE"),
+]
+
+METADATA_TABLE = "earnings_call_transcript_metadata"
+# content_fingerprint: '<paragraph count>-<md5 of the paragraphs>' (see flatten.content_fingerprints);
+# refresh runs compare it with upstream to find revised transcripts. NULL for calls stored before it.
+METADATA_SCHEMA = [
+    bigquery.SchemaField("transcript_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("symbol", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("report_date", "DATE", mode="NULLABLE"),
+    bigquery.SchemaField("fiscal_year", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("fiscal_quarter", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("content_fingerprint", "STRING", mode="NULLABLE"),
+]
+CONTENT_TABLE = "earnings_call_transcript_content"
+# Normalized content mode (see content_store): each distinct paragraph text once,
+# keyed by MD5(content), and per-call rows that reference it. CONTENT_TABLE is
+# then a view over the two with the inline table's columns.
+PARAGRAPH_TEXT_TABLE = "earnings_call_paragraph_text"
+PARAGRAPHS_TABLE = "earnings_call_transcript_paragraphs"
+CONTENT_SCHEMA = [
+    bigquery.SchemaField("transcript_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("paragraph_number", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("speaker", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("content", "STRING", mode="NULLABLE"),
+]
+PARAGRAPH_TEXT_SCHEMA = [
+    bigquery.SchemaField("content_hash", "BYTES", mode="REQUIRED"),
+    bigquery.SchemaField("content", "STRING", mode="NULLABLE"),
+]
+PARAGRAPHS_SCHEMA = [
+    bigquery.SchemaField("transcript_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("paragraph_number", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("speaker", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("content_hash", "BYTES", mode="NULLABLE"),
+]
+
+# Partitioning ((column, granularity) or None) and clustering of each table.
+# Metadata is one small row per call, so daily partitions would be tiny; monthly
+# ones still let date-window queries skip everything outside the window.
+TABLE_LAYOUTS = {
+    METADATA_TABLE: (("report_date", "MONTH"), ["symbol", "transcript_id"]),
+    CONTENT_TABLE: (None, ["transcript_id"]),
+    PARAGRAPHS_TABLE: (None, ["transcript_id"]),
+    PARAGRAPH_TEXT_TABLE: (None, ["content_hash"]),
+    CHECKPOINT_TABLE: (None, ["run_id"]),
+}
+# migrate_layout_bq() rewrites a table into this copy before replacing it
+RELAYOUT_SUFFIX = "_relayout"
+
+# One client per project for the life of the process; bigquery.Client is thread-safe
+_clients = {}
+_clients_lock = threading.Lock()
+
 def get_client(project_id):
-    return bigquery.Client(project=project_id)
+    with _clients_lock:
+        if project_id not in _clients:
+            _clients[project_id] = bigquery.Client(project=project_id)
+        return _clients[project_id]
+
+def initialize_bq(project_id, dataset_id, content_mode=None):
+    """
+    Create the tables. content_mode: 'inline' or 'normalized' (see content_store);
+    None keeps the mode of an existing dataset and creates new ones inline.
+    Asking for 'normalized' on an inline dataset migrates its content.
+    Returns the dataset's content mode.
+    """
+    if content_mode not in (None,) + content_store.CONTENT_MODES:
+        raise ValueError(f"Unknown content_mode '{content_mode}', expected one of {content_store.CONTENT_MODES}")
+    current_mode = get_content_mode_bq(project_id, dataset_id)
+    if current_mode == 'normalized' and content_mode == 'inline':
+        raise ValueError(f"{dataset_id} already stores normalized content; converting it back is not supported")
+    content_mode = content_mode or current_mode or 'inline'
 
-def initialize_bq(project_id, dataset_id):
     client = get_client(project_id)
     dataset_ref = f"{project_id}.{dataset_id}"
     
     # Metadata Table
-    metadata_table_id = f"{dataset_ref}.earnings_call_transcript_metadata"
-    metadata_schema = [
-        bigquery.SchemaField("transcript_id", "STRING", mode="REQUIRED"),
-        bigquery.SchemaField("symbol", "STRING", mode="NULLABLE"),
-        bigquery.SchemaField("report_date", "DATE", mode="NULLABLE"),
-        bigquery.SchemaField("fiscal_year", "INTEGER", mode="NULLABLE"),
-        bigquery.SchemaField("fiscal_quarter", "INTEGER", mode="NULLABLE"),
-    ]
-    _create_table_if_not_exists(client, metadata_table_id, metadata_schema)
+    metadata_table_id = f"{dataset_ref}.{METADATA_TABLE}"
+    _create_table_if_not_exists(client, metadata_table_id, METADATA_SCHEMA)
+    _add_missing_columns(client, metadata_table_id, METADATA_SCHEMA)
 
     # Content Table
-    content_table_id = f"{dataset_ref}.earnings_call_transcript_content"
-    content_schema = [
-        bigquery.SchemaField("transcript_id", "STRING", mode="REQUIRED"),
-        bigquery.SchemaField("paragraph_number", "INTEGER", mode="NULLABLE"),
-        bigquery.SchemaField("speaker", "STRING", mode="NULLABLE"),
-        bigquery.SchemaField("content", "STRING", mode="NULLABLE"),
-    ]
-    _create_table_if_not_exists(client, content_table_id, content_schema)
+    if content_mode == 'normalized':
+        _initialize_normalized_content(client, dataset_ref, migrate=current_mode == 'inline')
+    else:
+        _create_table_if_not_exists(client, f"{dataset_ref}.{CONTENT_TABLE}", CONTENT_SCHEMA)
+
+    # Ingestion state: latest report_date ingested per symbol
+    _create_table_if_not_exists(client, f"{dataset_ref}.{WATERMARK_TABLE}", WATERMARK_SCHEMA)
+    _create_table_if_not_exists(client, f"{dataset_ref}.{CHECKPOINT_TABLE}", CHECKPOINT_SCHEMA)
+    return content_mode
+
+def get_content_mode_bq(project_id, dataset_id):
+    """'inline' or 'normalized' depending on what the content table is, None if neither exists yet."""
+    client = get_client(project_id)
+    dataset_ref = f"{project_id}.{dataset_id}"
+    try:
+        table = client.get_table(f"{dataset_ref}.{CONTENT_TABLE}")
+        return 'normalized' if table.table_type == 'VIEW' else 'inline'
+    except Exception:
+        pass
+    # A migration interrupted before the view was created
+    try:
+        client.get_table(f"{dataset_ref}.{PARAGRAPHS_TABLE}")
+        return 'normalized'
+    except Exception:
+        return None
+
+def _initialize_normalized_content(client, dataset_ref, migrate):
+    """
+    Create the normalized content tables and the compatibility view. With migrate,
+    the inline content table is copied into them first and then replaced by the view.
+    The copy skips rows already present, so an interrupted migration can be re-run.
+    Stop ingestion while migrating.
+    """
+    for name, schema in ((PARAGRAPH_TEXT_TABLE, PARAGRAPH_TEXT_SCHEMA), (PARAGRAPHS_TABLE, PARAGRAPHS_SCHEMA)):
+        client.create_table(_apply_layout(bigquery.Table(f"{dataset_ref}.{name}", schema=schema), name), exists_ok=True)
+
+    content_table = f"{dataset_ref}.{CONTENT_TABLE}"
+    if migrate:
+        logger.info(f"Migrating {content_table} to normalized paragraph storage...")
+        client.query(f"""
+        BEGIN TRANSACTION;
+        INSERT INTO `{dataset_ref}.{PARAGRAPH_TEXT_TABLE}` (content_hash, content)
+        SELECT MD5(content), ANY_VALUE(content)
+        FROM `{content_table}`
+        WHERE content IS NOT NULL
+          AND MD5(content) NOT IN (SELECT content_hash FROM `{dataset_ref}.{PARAGRAPH_TEXT_TABLE}`)
+        GROUP BY 1;
+
+        INSERT INTO `{dataset_ref}.{PARAGRAPHS_TABLE}` (transcript_id, paragraph_number, speaker, content_hash)
+        SELECT transcript_id, paragraph_number, speaker, MD5(content)
+        FROM `{content_table}`
+        WHERE transcript_id NOT IN (SELECT transcript_id FROM `{dataset_ref}.{PARAGRAPHS_TABLE}`);
+        COMMIT TRANSACTION;
+        """).result()
+        # DDL cannot run inside the transaction
+        client.delete_table(content_table)
+        logger.info(f"Copied {content_table} into {PARAGRAPH_TEXT_TABLE} and {PARAGRAPHS_TABLE}.")
+
+    view = bigquery.Table(content_table)
+    view.view_query = f"""
+    SELECT p.transcript_id, p.paragraph_number, p.speaker, t.content
+    FROM `{dataset_ref}.{PARAGRAPHS_TABLE}` p
+    LEFT JOIN `{dataset_ref}.{PARAGRAPH_TEXT_TABLE}` t ON t.content_hash = p.content_hash
+    """
+    client.create_table(view, exists_ok=True)
+    logger.info(f"{content_table} is a view over the normalized paragraph tables.")
+
+def _apply_layout(table, name):
+    """Set the partitioning and clustering TABLE_LAYOUTS defines for name on a bigquery.Table."""
+    partitioning, clustering = TABLE_LAYOUTS.get(name, (None, None))
+    if partitioning:
+        field, granularity = partitioning
+        table.time_partitioning = bigquery.TimePartitioning(type_=granularity, field=field)
+    if clustering:
+        table.clustering_fields = clustering
+    return table
+
+def _has_layout(table, name):
+    partitioning, clustering = TABLE_LAYOUTS.get(name, (None, None))
+    current = table.time_partitioning
+    current_partitioning = (current.field, current.type_) if current else None
+    return current_partitioning == (tuple(partitioning) if partitioning else None) and \
+        list(table.clustering_fields or []) == list(clustering or [])
+
+def migrate_layout_bq(project_id, dataset_id):
+    """
+    Rewrite existing tables whose partitioning/clustering differs from TABLE_LAYOUTS.
+    Each table is copied into a `<table>_relayout` table with the new layout and the
+    same schema, row counts are compared, and the original is replaced by a copy of it.
+    A migration interrupted at any point can be re-run. Stop ingestion while migrating.
+    Returns the names of the tables that were rewritten.
+    """
+    client = get_client(project_id)
+    dataset_ref = f"{project_id}.{dataset_id}"
+    migrated = []
+    for name in TABLE_LAYOUTS:
+        if _relayout_table(client, f"{dataset_ref}.{name}", name):
+            migrated.append(name)
+    return migrated
+
+def _get_table_or_none(client, table_ref):
+    try:
+        return client.get_table(table_ref)
+    except Exception:
+        return None
+
+def _relayout_table(client, table_ref, name):
+    staging_ref = table_ref + RELAYOUT_SUFFIX
+    table = _get_table_or_none(client, table_ref)
+    if table is not None and (table.table_type == 'VIEW' or _has_layout(table, name)):
+        client.delete_table(staging_ref, not_found_ok=True)
+        return False
+    if table is None and _get_table_or_none(client, staging_ref) is None:
+        return False
+
+    if table is not None:
+        logger.info(f"Rewriting {table_ref} with partitioning/clustering {TABLE_LAYOUTS[name]}...")
+        client.delete_table(staging_ref, not_found_ok=True)
+        client.create_table(_apply_layout(bigquery.Table(staging_ref, schema=table.schema), name))
+        client.query(f"INSERT INTO `{staging_ref}` SELECT * FROM `{table_ref}`").result()
+        counts = list(client.query(f"""
+        SELECT (SELECT COUNT(*) FROM `{table_ref}`) AS original, (SELECT COUNT(*) FROM `{staging_ref}`) AS rewritten
+        """).result())[0]
+        if counts.original != counts.rewritten:
+            raise RuntimeError(f"Row count mismatch rewriting {table_ref}: {counts.original} != {counts.rewritten}")
+        # The partitioning of an existing table cannot be changed, so it is replaced
+        client.delete_table(table_ref)
+
+    # A copy job keeps the layout of its source
+    client.copy_table(staging_ref, table_ref).result()
+    client.delete_table(staging_ref)
+    logger.info(f"Rewrote {table_ref}.")
+    return True
 
 def _create_table_if_not_exists(client, table_ref, schema):
     try:
-        table = bigquery.Table(table_ref, schema=schema)
+        table = _apply_layout(bigquery.Table(table_ref, schema=schema), table_ref.rsplit('.', 1)[-1])
         try:
             client.get_table(table_ref)
             logger.info(f"Table {table_ref} already exists.")
@@ -45,37 +251,247 @@ def _create_table_if_not_exists(client, table_ref, schema):
         logger.error(f"Error checking/creating table {table_ref}: {e}")
         raise
 
-def get_existing_ids_bq(project_id, dataset_id):
+def _add_missing_columns(client, table_ref, schema):
+    """Append the (NULLABLE) fields of schema that an existing table does not have yet."""
+    table = client.get_table(table_ref)
+    existing = {f.name for f in table.schema}
+    missing = [f for f in schema if f.name not in existing]
+    if missing:
+        table.schema = list(table.schema) + missing
+        client.update_table(table, ["schema"])
+        logger.info(f"Added columns {[f.name for f in missing]} to {table_ref}.")
+
+def get_existing_ids_bq(project_id, dataset_id, start_date=None):
+    return set(get_existing_ids_table_bq(project_id, dataset_id, start_date).column('transcript_id').to_pylist())
+
+def _metadata_window(start_date=None, symbols=None):
+    """WHERE clause and job config restricting metadata to report_date >= start_date and symbols."""
+    conditions, params = [], []
+    if start_date:
+        conditions.append("report_date >= @start_date")
+        params.append(bigquery.ScalarQueryParameter("start_date", "DATE", str(start_date)[:10]))
+    if symbols is not None:
+        conditions.append("symbol IN UNNEST(@symbols)")
+        params.append(bigquery.ArrayQueryParameter("symbols", "STRING", list(symbols)))
+    if not conditions:
+        return "", None
+    return " WHERE " + " AND ".join(conditions), bigquery.QueryJobConfig(query_parameters=params)
+
+def count_metadata_rows_bq(project_id, dataset_id, start_date=None, symbols=None):
+    """
+    Number of metadata rows with report_date >= start_date (all rows if None) of
+    symbols (all if None), or None if the table does not exist. Unlike Table.num_rows,
+    a query also counts rows just committed through the Storage Write API. Only
+    report_date/symbol of the matching partitions is read.
+    """
     client = get_client(project_id)
-    table_ref = f"{project_id}.{dataset_id}.earnings_call_transcript_metadata"
-    
-    query = f"SELECT transcript_id FROM `{table_ref}`"
-    
+    table_ref = f"{project_id}.{dataset_id}.{METADATA_TABLE}"
+    try:
+        client.get_table(table_ref)
+    except Exception:
+        return None
+
+    where, job_config = _metadata_window(start_date, symbols)
+    query = f"SELECT COUNT(*) AS row_count FROM `{table_ref}`{where}"
+    return next(iter(client.query(query, job_config=job_config).result())).row_count
+
+def get_existing_ids_table_bq(project_id, dataset_id, start_date=None, symbols=None):
+    """
+    Same as get_existing_ids_bq, but returns the IDs as a single-column
+    pyarrow Table so they can be registered in DuckDB without building a Python set.
+    start_date: only calls with report_date >= start_date ('YYYY-MM-DD'); with the
+    table partitioned by report_date, older partitions are not scanned.
+    symbols: only calls of these tickers (clustering keeps the scan to their blocks).
+    """
+    client = get_client(project_id)
+    table_ref = f"{project_id}.{dataset_id}.{METADATA_TABLE}"
+    empty = pa.table({'transcript_id': pa.array([], type=pa.string())})
+
+    where, job_config = _metadata_window(start_date, symbols)
+    query = f"SELECT DISTINCT transcript_id FROM `{table_ref}`{where}"
+
     try:
         try:
             client.get_table(table_ref)
         except Exception:
-            return set()
-            
-        query_job = client.query(query)
-        results = query_job.result()
-        return set(row.transcript_id for row in results)
+            return empty
+
+        query_job = client.query(query, job_config=job_config)
+        return query_job.result().to_arrow()
     except Exception as e:
         logger.warning(f"Could not fetch existing IDs from BigQuery: {e}")
-        return set()
+        return empty
+
+def get_fingerprints_bq(project_id, dataset_id, symbols, start_date=None):
+    """
+    Stored content fingerprints of symbols' calls (report_date >= start_date) as a
+    pyarrow Table (transcript_id, content_fingerprint); partitions and clustering
+    keep this to the metadata rows of those symbols in the window.
+    """
+    client = get_client(project_id)
+    table_ref = f"{project_id}.{dataset_id}.{METADATA_TABLE}"
+    params = [bigquery.ArrayQueryParameter("symbols", "STRING", list(symbols))]
+    query = f"SELECT transcript_id, content_fingerprint FROM `{table_ref}` WHERE symbol IN UNNEST(@symbols)"
+    if start_date:
+        query += " AND report_date >= @start_date"
+        params.append(bigquery.ScalarQueryParameter("start_date", "DATE", str(start_date)[:10]))
+
+    try:
+        client.get_table(table_ref)
+    except Exception:
+        return pa.table({'transcript_id': pa.array([], pa.string()), 'content_fingerprint': pa.array([], pa.string())})
+
+    query_job = client.query(query, job_config=bigquery.QueryJobConfig(query_parameters=params))
+    return query_job.result().to_arrow()
+
+def record_fingerprints_bq(project_id, dataset_id, fingerprints):
+    """
+    Set content_fingerprint on stored calls that have none yet.
+    fingerprints: DataFrame (transcript_id, report_date, content_fingerprint).
+    Loaded into a temporary table and MERGEd, since a first refresh may cover the whole corpus.
+    """
+    if fingerprints.empty:
+        return
+    client = get_client(project_id)
+    dataset_ref = f"{project_id}.{dataset_id}"
+    staging_ref = f"{dataset_ref}._staging_fingerprints_{uuid.uuid4().hex[:12]}"
+    fingerprints = fingerprints.assign(report_date=pd.to_datetime(fingerprints['report_date']).dt.date)
+    job_config = bigquery.LoadJobConfig(schema=[
+        bigquery.SchemaField("transcript_id", "STRING"),
+        bigquery.SchemaField("report_date", "DATE"),
+        bigquery.SchemaField("content_fingerprint", "STRING"),
+    ])
+    try:
+        client.load_table_from_dataframe(fingerprints, staging_ref, job_config=job_config).result()
+        client.query(f"""
+        MERGE `{dataset_ref}.{METADATA_TABLE}` T
+        USING `{staging_ref}` S
+        ON T.transcript_id = S.transcript_id AND T.report_date >= DATE '{fingerprints['report_date'].min()}'
+        WHEN MATCHED AND T.content_fingerprint IS NULL THEN
+          UPDATE SET content_fingerprint = S.content_fingerprint
+        """).result()
+    finally:
+        client.delete_table(staging_ref, not_found_ok=True)
+    logger.info(f"Recorded content fingerprints for {len(fingerprints)} calls.")
+
+def get_watermarks_bq(project_id, dataset_id):
+    """Return {symbol: 'YYYY-MM-DD'} with the latest report_date ingested per symbol."""
+    client = get_client(project_id)
+    table_ref = f"{project_id}.{dataset_id}.{WATERMARK_TABLE}"
+
+    try:
+        client.get_table(table_ref)
+    except Exception:
+        return {}
+
+    query_job = client.query(f"SELECT symbol, last_report_date FROM `{table_ref}`")
+    return {row.symbol: row.last_report_date.isoformat() for row in query_job.result()}
+
+def update_watermarks_bq(project_id, dataset_id, watermarks):
+    """
+    Advance the per-symbol watermarks. watermarks: {symbol: 'YYYY-MM-DD'}.
+    A watermark only ever moves forward, so backfills of older dates leave it untouched.
+    """
+    if not watermarks:
+        return
+    client = get_client(project_id)
+    table_ref = f"{project_id}.{dataset_id}.{WATERMARK_TABLE}"
+    _create_table_if_not_exists(client, table_ref, WATERMARK_SCHEMA)
+
+    rows = [
+        bigquery.StructQueryParameter(
+            None,
+            bigquery.ScalarQueryParameter("symbol", "STRING", symbol),
+            bigquery.ScalarQueryParameter("last_report_date", "DATE", str(report_date)[:10]),
+        )
+        for symbol, report_date in watermarks.items()
+    ]
+    query = f"""
+    MERGE `{table_ref}` T
+    USING (SELECT * FROM UNNEST(@rows)) S
+    ON T.symbol = S.symbol
+    WHEN MATCHED AND S.last_report_date > T.last_report_date THEN
+      UPDATE SET last_report_date = S.last_report_date, updated_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+      INSERT (symbol, last_report_date, updated_at) VALUES (S.symbol, S.last_report_date, CURRENT_TIMESTAMP())
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[bigquery.ArrayQueryParameter("rows", "STRUCT", rows)])
+    client.query(query, job_config=job_config).result()
+    logger.info(f"Updated watermarks for {len(watermarks)} symbols in {table_ref}.")
+
+def get_checkpoints_bq(project_id, dataset_id, run_id):
+    """Return [(unit_type, unit)] recorded for run_id, empty if none."""
+    client = get_client(project_id)
+    table_ref = f"{project_id}.{dataset_id}.{CHECKPOINT_TABLE}"
+
+    try:
+        client.get_table(table_ref)
+    except Exception:
+        return []
+
+    job_config = bigquery.QueryJobConfig(query_parameters=[bigquery.ScalarQueryParameter("run_id", "STRING", run_id)])
+    query_job = client.query(f"SELECT DISTINCT unit_type, unit FROM `{table_ref}` WHERE run_id = @run_id", job_config=job_config)
+    return [(row.unit_type, row.unit) for row in query_job.result()]
+
+def record_checkpoints_bq(project_id, dataset_id, run_id, units):
+    """Append completed units ([(unit_type, unit)]) to run_id's checkpoint manifest."""
+    if not units:
+        return
+    client = get_client(project_id)
+    table_ref = f"{project_id}.{dataset_id}.{CHECKPOINT_TABLE}"
+    _create_table_if_not_exists(client, table_ref, CHECKPOINT_SCHEMA)
+
+    query = f"""
+    INSERT INTO `{table_ref}` (run_id, unit_type, unit, recorded_at)
+    SELECT @run_id, u.unit_type, u.unit, CURRENT_TIMESTAMP() FROM UNNEST(@units) u
+    """
+    units = [
+        bigquery.StructQueryParameter(
+            None,
+            bigquery.ScalarQueryParameter("unit_type", "STRING", unit_type),
+            bigquery.ScalarQueryParameter("unit", "STRING", unit),
+        )
+        for unit_type, unit in units
+    ]
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("run_id", "STRING", run_id),
+        bigquery.ArrayQueryParameter("units", "STRUCT", units),
+    ])
+    client.query(query, job_config=job_config).result()
+
+def delete_checkpoints_bq(project_id, dataset_id, run_id, retention_days):
+    """Delete run_id's checkpoint manifest and every unit recorded more than retention_days ago."""
+    client = get_client(project_id)
+    table_ref = f"{project_id}.{dataset_id}.{CHECKPOINT_TABLE}"
+
+    try:
+        client.get_table(table_ref)
+    except Exception:
+        return
+
+    query = f"""
+    DELETE FROM `{table_ref}`
+    WHERE run_id = @run_id
+       OR recorded_at < TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @retention_days DAY)
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("run_id", "STRING", run_id),
+        bigquery.ScalarQueryParameter("retention_days", "INT64", retention_days),
+    ])
+    client.query(query, job_config=job_config).result()
 
 def insert_metadata_bq(project_id, dataset_id, df):
     if df.empty:
         return
     client = get_client(project_id)
-    table_ref = f"{project_id}.{dataset_id}.earnings_call_transcript_metadata"
+    table_ref = f"{project_id}.{dataset_id}.{METADATA_TABLE}"
     _insert_rows_from_df(client, table_ref, df)
 
 def insert_content_bq(project_id, dataset_id, df):
     if df.empty:
         return
     client = get_client(project_id)
-    table_ref = f"{project_id}.{dataset_id}.earnings_call_transcript_content"
+    table_ref = f"{project_id}.{dataset_id}.{CONTENT_TABLE}"
     _insert_rows_from_df(client, table_ref, df)
 
 def _insert_rows_from_df(client, table_ref, df):
@@ -1,62 +1,492 @@
+import argparse
+import logging
 import sqlite3
-import pandas as pd
+import threading
 import os
+import content_store
+from dedup_index import DedupIndex
+
+logger = logging.getLogger(__name__)
 
 DB_NAME = 'transcripts.db'
 
+# Applied to every connection. WAL lets readers run during a write and makes each
+# commit a sequential append; synchronous=NORMAL only fsyncs at checkpoints, which
+# is still crash-safe in WAL mode (a crash can lose the last commits, never corrupt).
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -65536",  # 64 MiB page cache
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 30000",
+    "PRAGMA foreign_keys = OFF",
+)
+
+# content_fingerprint: '<paragraph count>-<md5 of the paragraphs>' (see flatten.content_fingerprints), NULL for older rows
+METADATA_COLUMNS = ['transcript_id', 'symbol', 'report_date', 'fiscal_year', 'fiscal_quarter', 'content_fingerprint']
+CONTENT_COLUMNS = ['transcript_id', 'paragraph_number', 'speaker', 'content']
+
+# Normalized content mode (see content_store): distinct texts and hash references.
+# transcript_content then becomes a view with the inline table's columns.
+CONTENT_VIEW_SQL = '''
+    CREATE VIEW IF NOT EXISTS transcript_content AS
+    SELECT p.transcript_id, p.paragraph_number, p.speaker, t.content
+    FROM transcript_paragraphs p
+    LEFT JOIN paragraph_text t ON t.content_hash = p.content_hash
+'''
+
+# Full-text index (FTS5) over paragraph texts, kept in sync by triggers once enabled.
+# Inline mode indexes transcript_content rows by id. Normalized mode indexes each
+# distinct text once, through an integer id per content_hash (paragraph_text has none).
+FTS_TABLE = 'transcript_fts'
+FTS_STATE_TABLE = 'transcript_fts_state'
+# Porter stemming over unicode61 tokens, so 'tariffs' also matches 'tariff'
+FTS_TOKENIZER = 'porter unicode61 remove_diacritics 2'
+# Rows indexed per transaction by sync_fts(), so other writers can interleave
+FTS_SYNC_CHUNK_ROWS = 50_000
+# Pages merged per step by optimize_fts(incremental=True)
+FTS_MERGE_PAGES = 500
+
+# (table or view holding the indexed text, integer id column) per content mode
+FTS_SOURCES = {
+    'inline': ('transcript_content', 'id'),
+    'normalized': ('paragraph_text_fts_source', 'id'),
+}
+FTS_NORMALIZED_SQL = (
+    '''
+    CREATE TABLE IF NOT EXISTS paragraph_text_ids (
+        id INTEGER PRIMARY KEY,
+        content_hash BLOB UNIQUE
+    )
+    ''',
+    '''
+    CREATE VIEW IF NOT EXISTS paragraph_text_fts_source AS
+    SELECT i.id, t.content
+    FROM paragraph_text_ids i
+    JOIN paragraph_text t ON t.content_hash = i.content_hash
+    ''',
+    # Search results map matching texts back to every paragraph using them
+    "CREATE INDEX IF NOT EXISTS idx_paragraphs_content_hash ON transcript_paragraphs (content_hash)",
+)
+# Revised calls (insert_batch(replace=...)) delete their inline paragraphs, and edits by
+# hand are followed too; in normalized mode only the references are replaced and texts
+# are never deleted
+FTS_TRIGGERS = {
+    'inline': (
+        '''
+        CREATE TRIGGER IF NOT EXISTS transcript_content_fts_insert AFTER INSERT ON transcript_content BEGIN
+            INSERT INTO transcript_fts (rowid, content) VALUES (new.id, new.content);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS transcript_content_fts_delete AFTER DELETE ON transcript_content BEGIN
+            INSERT INTO transcript_fts (transcript_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS transcript_content_fts_update AFTER UPDATE OF content ON transcript_content BEGIN
+            INSERT INTO transcript_fts (transcript_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO transcript_fts (rowid, content) VALUES (new.id, new.content);
+        END
+        ''',
+    ),
+    'normalized': (
+        '''
+        CREATE TRIGGER IF NOT EXISTS paragraph_text_fts_insert AFTER INSERT ON paragraph_text BEGIN
+            INSERT OR IGNORE INTO paragraph_text_ids (content_hash) VALUES (new.content_hash);
+            INSERT INTO transcript_fts (rowid, content)
+            SELECT id, new.content FROM paragraph_text_ids WHERE content_hash = new.content_hash;
+        END
+        ''',
+    ),
+}
+FTS_TRIGGER_NAMES = ('transcript_content_fts_insert', 'transcript_content_fts_delete', 'transcript_content_fts_update',
+                     'paragraph_text_fts_insert')
+
+# Bound parameters per statement (SQLite's default limit is 999 before 3.32)
+SQLITE_MAX_PARAMS = 900
+
+_connection = None
+_connection_name = None
+_content_mode = None
+_lock = threading.RLock()
+
 def get_connection():
-    return sqlite3.connect(DB_NAME)
-
-def initialize_db():
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Create metadata table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transcript_metadata (
-            transcript_id TEXT PRIMARY KEY,
-            symbol TEXT,
-            report_date TEXT,
-            fiscal_year INTEGER,
-            fiscal_quarter INTEGER
-        )
-    ''')
-    
-    # Create content table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transcript_content (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            transcript_id TEXT,
-            paragraph_number INTEGER,
-            speaker TEXT,
-            content TEXT,
-            FOREIGN KEY (transcript_id) REFERENCES transcript_metadata (transcript_id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    """Long-lived connection to DB_NAME, shared by the whole process."""
+    global _connection, _connection_name
+    with _lock:
+        if _connection is None or _connection_name != DB_NAME:
+            close_connection()
+            _connection = sqlite3.connect(DB_NAME, check_same_thread=False)
+            for pragma in PRAGMAS:
+                _connection.execute(pragma)
+            _connection_name = DB_NAME
+        return _connection
+
+def open_reader():
+    """
+    New read-only connection to DB_NAME (e.g. for searches). In WAL mode it reads
+    the last committed state while the shared connection keeps writing.
+    """
+    conn = sqlite3.connect(f"file:{DB_NAME}?mode=ro", uri=True, check_same_thread=False)
+    conn.execute("PRAGMA busy_timeout = 30000")
+    conn.execute("PRAGMA cache_size = -65536")
+    return conn
+
+def close_connection():
+    global _connection, _connection_name, _content_mode
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+        _connection = None
+        _connection_name = None
+        _content_mode = None
+
+def get_content_mode():
+    """'inline' or 'normalized' depending on what transcript_content is, None if it does not exist yet."""
+    global _content_mode
+    conn = get_connection()
+    with _lock:
+        if _content_mode is None:
+            _content_mode = detect_content_mode(conn)
+        return _content_mode
+
+def detect_content_mode(conn):
+    """Content mode of the database behind conn (see get_content_mode)."""
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'transcript_content'").fetchone()
+    if row:
+        return 'normalized' if row[0] == 'view' else 'inline'
+    return None
+
+def initialize_db(content_mode=None):
+    """
+    Create the tables. content_mode: 'inline' or 'normalized' (see content_store);
+    None keeps the mode of an existing database and creates new ones inline.
+    Asking for 'normalized' on an inline database migrates its content.
+    Returns the database's content mode.
+    """
+    if content_mode not in (None,) + content_store.CONTENT_MODES:
+        raise ValueError(f"Unknown content_mode '{content_mode}', expected one of {content_store.CONTENT_MODES}")
+    current_mode = get_content_mode()
+    if current_mode == 'normalized' and content_mode == 'inline':
+        raise ValueError(f"{DB_NAME} already stores normalized content; converting it back is not supported")
+    content_mode = content_mode or current_mode or 'inline'
+
+    conn = get_connection()
+    with _lock, conn:
+        # Create metadata table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS transcript_metadata (
+                transcript_id TEXT PRIMARY KEY,
+                symbol TEXT,
+                report_date TEXT,
+                fiscal_year INTEGER,
+                fiscal_quarter INTEGER,
+                content_fingerprint TEXT
+            )
+        ''')
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(transcript_metadata)")]
+        if 'content_fingerprint' not in columns:
+            conn.execute("ALTER TABLE transcript_metadata ADD COLUMN content_fingerprint TEXT")
+
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_metadata_symbol_date
+            ON transcript_metadata (symbol, report_date)
+        ''')
+
+    if content_mode == 'normalized':
+        _initialize_normalized_content(migrate=current_mode == 'inline')
+    else:
+        _initialize_inline_content()
+    # Indexes enabled before a trigger was added get it too
+    if fts_enabled(conn):
+        with _lock, conn:
+            for sql in FTS_TRIGGERS[get_content_mode()]:
+                conn.execute(sql)
+    return get_content_mode()
+
+def _initialize_inline_content():
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS transcript_content (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                transcript_id TEXT,
+                paragraph_number INTEGER,
+                speaker TEXT,
+                content TEXT,
+                FOREIGN KEY (transcript_id) REFERENCES transcript_metadata (transcript_id)
+            )
+        ''')
+
+        # Databases created before the unique index may hold repeated paragraphs; keep the first copy
+        has_paragraph_index = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_content_paragraph'"
+        ).fetchone()
+        if not has_paragraph_index:
+            conn.execute('''
+                DELETE FROM transcript_content
+                WHERE id NOT IN (
+                    SELECT MIN(id) FROM transcript_content GROUP BY transcript_id, paragraph_number
+                )
+            ''')
+        # Also serves transcript_id lookups (leftmost column)
+        conn.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_content_paragraph
+            ON transcript_content (transcript_id, paragraph_number)
+        ''')
+
+def _initialize_normalized_content(migrate):
+    """Create the normalized content tables and view, moving inline content into them if migrate."""
+    global _content_mode
+    conn = get_connection()
+    with _lock:
+        # The inline full-text index refers to the table being replaced; it is rebuilt below
+        had_fts = migrate and fts_enabled(conn)
+        if had_fts:
+            _drop_fts(conn)
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS paragraph_text (
+                    content_hash BLOB PRIMARY KEY,
+                    content TEXT
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS transcript_paragraphs (
+                    transcript_id TEXT,
+                    paragraph_number INTEGER,
+                    speaker TEXT,
+                    content_hash BLOB,
+                    PRIMARY KEY (transcript_id, paragraph_number)
+                ) WITHOUT ROWID
+            ''')
+            if migrate:
+                logger.info(f"Migrating {DB_NAME} content to normalized paragraph storage...")
+                conn.create_function('content_hash', 1, content_store.content_hash, deterministic=True)
+                conn.execute('''
+                    INSERT OR IGNORE INTO paragraph_text (content_hash, content)
+                    SELECT content_hash(content), content FROM transcript_content WHERE content IS NOT NULL
+                ''')
+                # Ordered by id so the first copy of a repeated paragraph wins, as in the inline table
+                conn.execute('''
+                    INSERT OR IGNORE INTO transcript_paragraphs (transcript_id, paragraph_number, speaker, content_hash)
+                    SELECT transcript_id, paragraph_number, speaker, content_hash(content)
+                    FROM transcript_content ORDER BY id
+                ''')
+                conn.execute("DROP TABLE transcript_content")
+            conn.execute(CONTENT_VIEW_SQL)
+        _content_mode = 'normalized'
+        if migrate:
+            # Give the dropped table's pages back to the filesystem
+            conn.execute("VACUUM")
+            logger.info("Migration complete.")
+        if had_fts:
+            enable_fts()
+            sync_fts()
+
+def fts_enabled(conn=None):
+    conn = conn or get_connection()
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)).fetchone() is not None
+
+def fts_state(conn):
+    """(rows indexed up to, rows to index up to): ids present before enable_fts() still to backfill."""
+    state = dict(conn.execute(f"SELECT key, value FROM {FTS_STATE_TABLE}").fetchall())
+    return state.get('indexed_to', 0), state.get('backfill_to', 0)
+
+def enable_fts():
+    """
+    Create the full-text index and the triggers indexing every paragraph inserted from
+    now on. Paragraphs already in the database are indexed by sync_fts().
+    Inline paragraphs that are replaced by insert_batch(replace=...), or updated or
+    deleted by hand, are re-indexed or removed by the triggers. Normalized texts deleted
+    by hand drop out of search results through the join and out of the index with
+    rebuild_fts().
+    """
+    content_mode = get_content_mode()
+    if content_mode is None:
+        raise ValueError(f"{DB_NAME} has no content tables yet; run initialize_db() first")
+    source, id_column = FTS_SOURCES[content_mode]
+
+    conn = get_connection()
+    with _lock, conn:
+        if fts_enabled(conn):
+            return
+        if content_mode == 'normalized':
+            for sql in FTS_NORMALIZED_SQL:
+                conn.execute(sql)
+            conn.execute('''
+                INSERT OR IGNORE INTO paragraph_text_ids (content_hash)
+                SELECT content_hash FROM paragraph_text
+            ''')
+        backfill_to = conn.execute(f"SELECT COALESCE(MAX({id_column}), 0) FROM {source}").fetchone()[0]
+        conn.execute(f'''
+            CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+                content, content='{source}', content_rowid='{id_column}', tokenize='{FTS_TOKENIZER}'
+            )
+        ''')
+        for sql in FTS_TRIGGERS[content_mode]:
+            conn.execute(sql)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {FTS_STATE_TABLE} (key TEXT PRIMARY KEY, value INTEGER)")
+        conn.executemany(f"INSERT OR REPLACE INTO {FTS_STATE_TABLE} (key, value) VALUES (?, ?)",
+                         [('indexed_to', 0), ('backfill_to', backfill_to)])
+    logger.info(f"Full-text index created; {backfill_to} existing rows to index with sync_fts().")
+
+def sync_fts(chunk_rows=FTS_SYNC_CHUNK_ROWS):
+    """
+    Enable the full-text index if needed and index the rows that existed before it,
+    chunk_rows per transaction. Resumable: an interrupted sync continues where it stopped.
+    Returns the number of rows indexed.
+    """
+    enable_fts()
+    source, id_column = FTS_SOURCES[get_content_mode()]
+    conn = get_connection()
+    indexed = 0
+    while True:
+        with _lock, conn:
+            indexed_to, backfill_to = fts_state(conn)
+            if indexed_to >= backfill_to:
+                break
+            upper = min(indexed_to + chunk_rows, backfill_to)
+            cursor = conn.execute(f'''
+                INSERT INTO {FTS_TABLE} (rowid, content)
+                SELECT {id_column}, content FROM {source}
+                WHERE {id_column} > ? AND {id_column} <= ? AND content IS NOT NULL
+            ''', (indexed_to, upper))
+            conn.execute(f"UPDATE {FTS_STATE_TABLE} SET value = ? WHERE key = 'indexed_to'", (upper,))
+        indexed += max(cursor.rowcount, 0)
+        logger.info(f"Full-text index: {upper} of {backfill_to} existing rows indexed.")
+    return indexed
+
+def rebuild_fts():
+    """Re-index every paragraph from scratch in one transaction."""
+    enable_fts()
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+        conn.execute(f"UPDATE {FTS_STATE_TABLE} SET value = (SELECT value FROM {FTS_STATE_TABLE} WHERE key = 'backfill_to') "
+                     f"WHERE key = 'indexed_to'")
+    logger.info("Full-text index rebuilt.")
+
+def optimize_fts(incremental=True, merge_pages=FTS_MERGE_PAGES):
+    """
+    Merge the index's segments so queries touch fewer b-trees. Incrementally, in
+    steps of merge_pages pages each committed on its own, or all at once.
+    """
+    conn = get_connection()
+    if not incremental:
+        with _lock, conn:
+            conn.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        return
+    while True:
+        with _lock, conn:
+            before = conn.total_changes
+            # A negative page count merges all segments (like 'optimize'), limited to that much work
+            conn.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) VALUES ('merge', ?)", (-merge_pages,))
+            # A merge step that found nothing to do writes nothing
+            if conn.total_changes - before <= 1:
+                break
+    logger.info("Full-text index optimized.")
+
+def _drop_fts(conn):
+    with conn:
+        for trigger in FTS_TRIGGER_NAMES:
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        conn.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        conn.execute(f"DROP TABLE IF EXISTS {FTS_STATE_TABLE}")
 
 def get_existing_ids():
     if not os.path.exists(DB_NAME):
         return set()
-    
+
     conn = get_connection()
-    query = "SELECT transcript_id FROM transcript_metadata"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return set(df['transcript_id'].tolist())
+    with _lock:
+        return {row[0] for row in conn.execute("SELECT transcript_id FROM transcript_metadata")}
+
+def get_existing_index():
+    """Existing transcript IDs as a DedupIndex (16 bytes per ID)."""
+    if not os.path.exists(DB_NAME):
+        return DedupIndex()
 
-def insert_metadata(df):
     conn = get_connection()
-    df.to_sql('transcript_metadata', conn, if_exists='append', index=False)
-    conn.close()
+    with _lock:
+        ids = [row[0] for row in conn.execute("SELECT transcript_id FROM transcript_metadata")]
+    return DedupIndex.from_hex(ids)
 
-def insert_content(df):
+def _rows(df, columns):
+    """DataFrame rows as tuples of plain Python values, with NaN/NA (and missing columns) as None."""
+    df = df.reindex(columns=columns).astype(object)
+    df = df.where(df.notna(), None)
+    if 'report_date' in columns:
+        df['report_date'] = df['report_date'].map(lambda d: None if d is None else str(d))
+    return df.itertuples(index=False, name=None)
+
+def insert_batch(metadata_df, content_df, replace=()):
+    """
+    Insert one batch of calls in a single transaction. Rows already present
+    (same transcript_id, or same transcript_id + paragraph_number) are skipped,
+    so re-inserting a batch is a no-op.
+    replace: transcript IDs of revised calls; their stored metadata and paragraphs
+    are deleted in the same transaction, so readers see either version, never a mix.
+    """
     conn = get_connection()
-    df.to_sql('transcript_content', conn, if_exists='append', index=False)
-    conn.close()
+    with _lock, conn:
+        if replace:
+            _delete_calls(conn, list(replace))
+        if metadata_df is not None and not metadata_df.empty:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO transcript_metadata ({', '.join(METADATA_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(METADATA_COLUMNS))})",
+                _rows(metadata_df, METADATA_COLUMNS),
+            )
+        if content_df is not None and not content_df.empty:
+            if get_content_mode() == 'normalized':
+                refs, texts = content_store.split_content(content_df)
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO paragraph_text ({', '.join(content_store.TEXT_COLUMNS)}) VALUES (?, ?)",
+                    _rows(texts, content_store.TEXT_COLUMNS),
+                )
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO transcript_paragraphs ({', '.join(content_store.REF_COLUMNS)}) VALUES (?, ?, ?, ?)",
+                    _rows(refs, content_store.REF_COLUMNS),
+                )
+            else:
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO transcript_content ({', '.join(CONTENT_COLUMNS)}) VALUES (?, ?, ?, ?)",
+                    _rows(content_df, CONTENT_COLUMNS),
+                )
+
+def _delete_calls(conn, transcript_ids):
+    # Normalized texts may be shared with other calls, so only the references go
+    content_table = 'transcript_paragraphs' if get_content_mode() == 'normalized' else 'transcript_content'
+    for start in range(0, len(transcript_ids), SQLITE_MAX_PARAMS):
+        chunk = transcript_ids[start:start + SQLITE_MAX_PARAMS]
+        placeholders = ', '.join('?' * len(chunk))
+        conn.execute(f"DELETE FROM {content_table} WHERE transcript_id IN ({placeholders})", chunk)
+        conn.execute(f"DELETE FROM transcript_metadata WHERE transcript_id IN ({placeholders})", chunk)
+
+def insert_metadata(df):
+    insert_batch(df, None)
+
+def insert_content(df):
+    insert_batch(None, df)
 
 if __name__ == "__main__":
-    initialize_db()
-    print(f"Database {DB_NAME} initialized.")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Initialize the local SQLite database.')
+    parser.add_argument('--content_mode', choices=content_store.CONTENT_MODES,
+                        help='Paragraph storage; normalized migrates an existing inline database')
+    parser.add_argument('--fts', choices=['sync', 'rebuild', 'optimize'],
+                        help='Full-text index: sync (enable and index existing rows, resumable), '
+                             'rebuild (re-index everything) or optimize (merge segments incrementally)')
+    args = parser.parse_args()
+
+    mode = initialize_db(args.content_mode)
+    print(f"Database {DB_NAME} initialized ({mode} content).")
+
+    if args.fts == 'sync':
+        print(f"Indexed {sync_fts()} existing rows.")
+    elif args.fts == 'rebuild':
+        rebuild_fts()
+    elif args.fts == 'optimize':
+        optimize_fts()
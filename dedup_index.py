@@ -0,0 +1,202 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+import numpy as np
+import pyarrow as pa
+import db_cloud_utils
+import warm_cache
+
+logger = logging.getLogger(__name__)
+
+DIGEST_DTYPE = np.dtype('S16')
+DEFAULT_INDEX_PATH = os.path.join('.dedup_index', 'bq_transcript_ids.npy')
+
+# ASCII hex character -> nibble value
+_HEX_LOOKUP = np.zeros(256, dtype=np.uint8)
+_HEX_LOOKUP[np.frombuffer(b'0123456789abcdef', dtype=np.uint8)] = np.arange(16, dtype=np.uint8)
+_HEX_LOOKUP[np.frombuffer(b'ABCDEF', dtype=np.uint8)] = np.arange(10, 16, dtype=np.uint8)
+
+# (index, state) per index path, kept in memory between runs of one process (warm=True)
+_warm_indexes = warm_cache.TTLCache()
+# Concurrent jobs of one process may save the same index; each installs its pair of files in one go
+_save_lock = threading.Lock()
+
+def hex_to_digests(hex_ids):
+    """Convert 32-char hex transcript IDs (list, Series or Arrow array) to an array of 16-byte digests."""
+    if isinstance(hex_ids, (pa.Array, pa.ChunkedArray)):
+        hex_ids = hex_ids.to_numpy(zero_copy_only=False)
+    chars = np.asarray(hex_ids, dtype='S32').view(np.uint8).reshape(-1, 32)
+    nibbles = _HEX_LOOKUP[chars]
+    digests = (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+    return np.ascontiguousarray(digests).view(DIGEST_DTYPE).ravel()
+
+class DedupIndex:
+    """
+    Set of transcript IDs stored as a sorted array of 16-byte MD5 digests
+    (16 bytes per ID instead of ~100 for a Python str in a set).
+    Membership is a vectorized binary search.
+    """
+
+    def __init__(self, digests=None):
+        if digests is None:
+            digests = np.empty(0, dtype=DIGEST_DTYPE)
+        self.digests = np.unique(np.asarray(digests, dtype=DIGEST_DTYPE))
+
+    @classmethod
+    def from_hex(cls, hex_ids):
+        return cls(hex_to_digests(hex_ids) if len(hex_ids) else None)
+
+    def __len__(self):
+        return len(self.digests)
+
+    @property
+    def nbytes(self):
+        return self.digests.nbytes
+
+    def contains(self, hex_ids):
+        """Boolean mask: which of hex_ids are in the index."""
+        if len(hex_ids) == 0 or len(self.digests) == 0:
+            return np.zeros(len(hex_ids), dtype=bool)
+        queries = hex_to_digests(hex_ids)
+        positions = np.searchsorted(self.digests, queries)
+        positions[positions == len(self.digests)] = 0
+        return self.digests[positions] == queries
+
+    def add(self, hex_ids):
+        if len(hex_ids) == 0:
+            return
+        merged = np.concatenate([self.digests, hex_to_digests(hex_ids)])
+        self.digests = np.unique(merged)
+
+    def copy(self):
+        """Independent index sharing the digest array (add() replaces it rather than mutating it)."""
+        index = DedupIndex.__new__(DedupIndex)
+        index.digests = self.digests
+        return index
+
+    def to_arrow(self):
+        """Single-column Arrow table (`digest`, fixed_size_binary(16)) sharing the NumPy buffer."""
+        digests = np.ascontiguousarray(self.digests)
+        array = pa.FixedSizeBinaryArray.from_buffers(pa.binary(16), len(digests), [None, pa.py_buffer(digests)])
+        return pa.table({'digest': array})
+
+    def save(self, path, state=None):
+        """
+        Write the digests as .npy (memory-mappable) plus a JSON sidecar holding state.
+        Both are written in full to temporary files unique to this call first, then
+        renamed into place.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp.npy"
+        try:
+            np.save(tmp, self.digests)
+            with open(tmp + '.json', 'w') as f:
+                json.dump({'count': len(self), 'state': state}, f)
+            with _save_lock:
+                os.replace(tmp, path)
+                os.replace(tmp + '.json', path + '.json')
+        finally:
+            for leftover in (tmp, tmp + '.json'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    @classmethod
+    def load(cls, path):
+        """Return (index, state) from a file written by save(), or (None, None) if absent."""
+        if not (os.path.exists(path) and os.path.exists(path + '.json')):
+            return None, None
+        with open(path + '.json') as f:
+            sidecar = json.load(f)
+        index = cls.__new__(cls)
+        index.digests = np.load(path, mmap_mode='r')
+        if len(index.digests) != sidecar['count']:
+            logger.warning(f"Dedup index {path} does not match its sidecar (interrupted save); ignoring it.")
+            return None, None
+        return index, sidecar['state']
+
+def _symbols_key(symbols):
+    return None if symbols is None else hashlib.md5("\n".join(sorted(set(symbols))).encode()).hexdigest()
+
+def _covers(saved_state, table, start_date, symbols_key=None):
+    """True if an index saved with saved_state is for table and symbols and its window starts no later than start_date."""
+    if saved_state is None or saved_state.get('table') != table or saved_state.get('symbols') != symbols_key:
+        return False
+    saved_start = saved_state.get('start_date')
+    return saved_start is None or (start_date is not None and saved_start <= start_date)
+
+def load_bq_index(project_id, dataset_id, path=DEFAULT_INDEX_PATH, start_date=None, warm=False, symbols=None):
+    """
+    Load the BigQuery transcript ID index from path if the saved index covers
+    start_date and the metadata table still holds exactly the number of rows
+    recorded with it; otherwise rebuild it from a scan of the table and save it.
+    The row count comes from a COUNT(*) query rather than the table's num_rows,
+    which lags behind rows committed through the Storage Write API.
+    start_date: only IDs of calls with report_date >= start_date are needed; the
+    rebuild then only reads the metadata partitions from that date on.
+    symbols: only index (and count) the calls of these tickers. Sharded runs give each
+    shard its own path and tickers, so shards writing concurrently never invalidate
+    each other's index.
+    warm: reuse the index an earlier run of this process left in memory, without
+    checking the table, if it is younger than the warm cache TTL. Rows written
+    elsewhere in the meantime are still caught by the writers' MERGE.
+    Returns (index, state) where state is the table, tickers, window and row count the index matches.
+    """
+    table = f"{project_id}.{dataset_id}"
+    if warm:
+        cached = _warm_indexes.get(path)
+        if cached is not None and _covers(cached[1], table, start_date, _symbols_key(symbols)):
+            index, state = cached
+            logger.info(f"Reusing in-memory dedup index ({len(index)} IDs).")
+            return index.copy(), state
+
+    index, state = _load_bq_index(project_id, dataset_id, path, start_date, symbols)
+    if warm and state is not None:
+        _warm_indexes.put(path, (index.copy(), state))
+    return index, state
+
+def _load_bq_index(project_id, dataset_id, path, start_date, symbols):
+    table = f"{project_id}.{dataset_id}"
+    symbols_key = _symbols_key(symbols)
+    index, saved_state = DedupIndex.load(path)
+    if index is not None and _covers(saved_state, table, start_date, symbols_key):
+        rows = db_cloud_utils.count_metadata_rows_bq(project_id, dataset_id, saved_state['start_date'], symbols)
+        if rows == saved_state['rows']:
+            logger.info(f"Loaded dedup index from {path} ({len(index)} IDs, {index.nbytes / 1024 ** 2:.1f} MiB).")
+            return index, saved_state
+        logger.info(f"Metadata table changed outside the runs of this index ({rows} rows, "
+                    f"{saved_state['rows']} recorded); rebuilding it.")
+
+    # Counted before the scan: rows landing in between can only make the next check fail, never pass
+    rows = db_cloud_utils.count_metadata_rows_bq(project_id, dataset_id, start_date, symbols)
+    ids = db_cloud_utils.get_existing_ids_table_bq(project_id, dataset_id, start_date, symbols)
+    index = DedupIndex.from_hex(ids.column('transcript_id'))
+    state = None
+    # An empty result for a non-empty window means the fetch failed; never cache that
+    if rows is not None and (len(index) > 0 or rows == 0):
+        state = {'table': table, 'symbols': symbols_key, 'start_date': start_date, 'rows': rows}
+        index.save(path, state)
+    logger.info(f"Rebuilt dedup index from BigQuery ({len(index)} IDs, {index.nbytes / 1024 ** 2:.1f} MiB).")
+    return index, state
+
+def save_bq_index(index, project_id, dataset_id, previous_state, rows_added, path=DEFAULT_INDEX_PATH, warm=False):
+    """
+    Persist the index after this run's own loads, recording the row count the
+    table has if this run's rows_added metadata rows were the only writes since
+    the index was loaded. If anyone else wrote too, the next load sees a different
+    count and rebuilds the index.
+    warm: also keep it in memory for the next run of this process (see load_bq_index).
+    Best effort: the rows are already in BigQuery, so a failed save is only logged
+    (the next run rebuilds the index).
+    """
+    if previous_state is None:
+        return
+    state = dict(previous_state, rows=previous_state['rows'] + rows_added)
+    if warm:
+        _warm_indexes.put(path, (index.copy(), state))
+    try:
+        index.save(path, state)
+    except Exception as e:
+        logger.warning(f"Could not save the dedup index to {path}: {e}")
@@ -1,5 +1,10 @@
 from google.cloud import bigquery
+import argparse
+import datetime
+import json
 import logging
+import db_cloud_utils
+from db_cloud_utils import METADATA_TABLE, CONTENT_TABLE, PARAGRAPHS_TABLE, PARAGRAPH_TEXT_TABLE
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -8,51 +13,163 @@ logger = logging.getLogger(__name__)
 PROJECT_ID = "sri-benchmarking-databases"
 DATASET_ID = "pressure_monitoring"
 
-def fix_duplicates():
-    client = bigquery.Client(project=PROJECT_ID)
+# Columns identifying one logical row, and which copy of a duplicate is kept
+TABLE_KEYS = {
+    METADATA_TABLE: (['transcript_id'], 'report_date'),
+    CONTENT_TABLE: (['transcript_id', 'paragraph_number'], 'transcript_id'),
+    PARAGRAPHS_TABLE: (['transcript_id', 'paragraph_number'], 'transcript_id'),
+    PARAGRAPH_TEXT_TABLE: (['content_hash'], 'content_hash'),
+}
+
+def fix_duplicates(start_date=None, end_date=None, dry_run=False):
+    """
+    Remove duplicate rows from the metadata and content tables, touching only the
+    duplicated keys: a grouped count over the key columns finds them, then one DML
+    transaction per table deletes every copy of those keys and re-inserts one.
+    start_date / end_date ('YYYY-MM-DD' or datetime.date): only calls with report_date
+    in the window (content through its metadata). paragraph_text is only repaired without
+    a window. Anything else raises ValueError before a query runs.
+    dry_run: only report what would be touched.
+    Returns {table: {duplicate_keys, rows_affected, rows_to_remove, ...}}; repaired
+    tables also have rows_removed, as counted by the repair's DML statements.
+    """
+    start_date, end_date = _parse_date(start_date), _parse_date(end_date)
+    client = db_cloud_utils.get_client(PROJECT_ID)
     dataset_ref = f"{PROJECT_ID}.{DATASET_ID}"
-    
-    metadata_table = f"{dataset_ref}.earnings_call_transcript_metadata"
-    content_table = f"{dataset_ref}.earnings_call_transcript_content"
-
-    # 1. Deduplicate Metadata
-    # Strategy: Keep one row per transcript_id
-    logger.info(f"Deduplicating {metadata_table}...")
-    query_meta = f"""
-    CREATE OR REPLACE TABLE `{metadata_table}` AS
-    SELECT * EXCEPT(rn)
-    FROM (
-      SELECT *, ROW_NUMBER() OVER(PARTITION BY transcript_id ORDER BY report_date) as rn
-      FROM `{metadata_table}`
+
+    if db_cloud_utils.get_content_mode_bq(PROJECT_ID, DATASET_ID) == 'normalized':
+        tables = [METADATA_TABLE, PARAGRAPHS_TABLE] + ([] if start_date or end_date else [PARAGRAPH_TEXT_TABLE])
+    else:
+        tables = [METADATA_TABLE, CONTENT_TABLE]
+
+    report = {}
+    for name in tables:
+        table_ref = f"{dataset_ref}.{name}"
+        keys, order_by = TABLE_KEYS[name]
+        window = _window_sql(name, dataset_ref, start_date, end_date)
+
+        stats = find_duplicates(client, table_ref, keys, window)
+        logger.info(f"{table_ref}: {stats['duplicate_keys']} duplicated keys, "
+                    f"{stats['rows_to_remove']} of {stats['rows_affected']} affected rows to remove.")
+        if stats['rows_to_remove'] and dry_run:
+            stats.update(_estimate_bytes(client, table_ref, keys, window, stats['rows_affected']))
+            logger.info(f"{table_ref}: would rewrite ~{stats['bytes_rewritten_estimate'] / 1024 ** 2:.1f} MiB, "
+                        f"scanning ~{stats['bytes_scanned_estimate'] / 1024 ** 2:.1f} MiB.")
+        elif stats['rows_to_remove']:
+            try:
+                job = client.query(repair_sql(table_ref, keys, window, order_by))
+                job.result()
+                # Rows may have changed since the count, so report what the repair itself did
+                stats['rows_removed'] = rows_removed(client, job)
+                logger.info(f"{table_ref}: removed {stats['rows_removed']} duplicate rows.")
+            except Exception as e:
+                logger.error(f"Error deduplicating {table_ref}: {e}")
+                stats['error'] = str(e)
+        report[name] = stats
+    return report
+
+def _parse_date(value):
+    """value as a datetime.date (None stays None); ValueError unless it is a date or 'YYYY-MM-DD'."""
+    if value is None or isinstance(value, datetime.date):
+        return value
+    if not isinstance(value, str):
+        raise ValueError(f"Expected a date (YYYY-MM-DD), got {value!r}")
+    return datetime.date.fromisoformat(value)
+
+def _window_sql(name, dataset_ref, start_date, end_date):
+    """Condition on alias t limiting a table to calls in the date window."""
+    conditions = []
+    # Only validated dates reach the SQL text
+    start_date, end_date = _parse_date(start_date), _parse_date(end_date)
+    if start_date:
+        conditions.append(f"report_date >= DATE '{start_date.isoformat()}'")
+    if end_date:
+        conditions.append(f"report_date <= DATE '{end_date.isoformat()}'")
+    if not conditions:
+        return "TRUE"
+    dates = " AND ".join(conditions)
+    if name == METADATA_TABLE:
+        # A constant filter on the partitioning column prunes partitions
+        return " AND ".join(f"t.{c}" for c in conditions)
+    return f"t.transcript_id IN (SELECT transcript_id FROM `{dataset_ref}.{METADATA_TABLE}` WHERE {dates})"
+
+def _dup_keys_sql(table_ref, keys, window):
+    key_cols = ", ".join(f"t.{k}" for k in keys)
+    return f"""
+    SELECT {key_cols}, COUNT(*) AS copies
+    FROM `{table_ref}` t
+    WHERE {window}
+    GROUP BY {key_cols}
+    HAVING COUNT(*) > 1
+    """
+
+def _match_sql(keys):
+    # NULL keys group together in GROUP BY / PARTITION BY, so match them the same way
+    return " AND ".join(f"d.{k} IS NOT DISTINCT FROM t.{k}" for k in keys)
+
+def find_duplicates(client, table_ref, keys, window="TRUE"):
+    """Count duplicated keys with a grouped count that only reads the key columns."""
+    query = f"""
+    SELECT COUNT(*) AS duplicate_keys, IFNULL(SUM(copies), 0) AS rows_affected, IFNULL(SUM(copies - 1), 0) AS rows_to_remove
+    FROM ({_dup_keys_sql(table_ref, keys, window)})
+    """
+    row = list(client.query(query).result())[0]
+    return {'duplicate_keys': row.duplicate_keys, 'rows_affected': row.rows_affected, 'rows_to_remove': row.rows_to_remove}
+
+def repair_sql(table_ref, keys, window, order_by):
+    """One transaction: snapshot one copy of each duplicated key, delete all copies, re-insert the snapshot."""
+    key_cols = ", ".join(f"t.{k}" for k in keys)
+    affected = f"{window} AND EXISTS (SELECT 1 FROM dup_keys d WHERE {_match_sql(keys)})"
+    return f"""
+    BEGIN TRANSACTION;
+
+    CREATE TEMP TABLE dup_keys AS {_dup_keys_sql(table_ref, keys, window)};
+
+    CREATE TEMP TABLE kept AS
+    SELECT * EXCEPT(rn) FROM (
+      SELECT t.*, ROW_NUMBER() OVER (PARTITION BY {key_cols} ORDER BY t.{order_by}) AS rn
+      FROM `{table_ref}` t
+      WHERE {affected}
     )
-    WHERE rn = 1
+    WHERE rn = 1;
+
+    DELETE FROM `{table_ref}` t WHERE {affected};
+
+    INSERT INTO `{table_ref}` SELECT * FROM kept;
+
+    COMMIT TRANSACTION;
     """
-    try:
-        job = client.query(query_meta)
-        job.result()
-        logger.info("Metadata table deduplicated.")
-    except Exception as e:
-        logger.error(f"Error deduplicating metadata: {e}")
-
-    # 2. Deduplicate Content
-    # Strategy: Keep one row per transcript_id + paragraph_number
-    # Note: If there are multiple identical rows, any is fine.
-    logger.info(f"Deduplicating {content_table}...")
-    query_content = f"""
-    CREATE OR REPLACE TABLE `{content_table}` AS
-    SELECT * EXCEPT(rn)
-    FROM (
-      SELECT *, ROW_NUMBER() OVER(PARTITION BY transcript_id, paragraph_number ORDER BY transcript_id) as rn
-      FROM `{content_table}`
+
+def rows_removed(client, job):
+    """Rows a finished repair_sql() job removed: rows its DELETE affected minus rows its INSERT put back."""
+    affected = {}
+    for child in client.list_jobs(parent_job=job):
+        if child.statement_type in ('DELETE', 'INSERT'):
+            affected[child.statement_type] = child.num_dml_affected_rows or 0
+    return affected.get('DELETE', 0) - affected.get('INSERT', 0)
+
+def _estimate_bytes(client, table_ref, keys, window, rows_affected):
+    """Bytes a repair would scan (dry run of its DELETE) and rewrite (affected rows x average row size)."""
+    delete_sql = f"""
+    DELETE FROM `{table_ref}` t
+    WHERE {window} AND EXISTS (
+      SELECT 1 FROM ({_dup_keys_sql(table_ref, keys, window)}) d WHERE {_match_sql(keys)}
     )
-    WHERE rn = 1
     """
-    try:
-        job = client.query(query_content)
-        job.result()
-        logger.info("Content table deduplicated.")
-    except Exception as e:
-        logger.error(f"Error deduplicating content: {e}")
+    job = client.query(delete_sql, job_config=bigquery.QueryJobConfig(dry_run=True, use_query_cache=False))
+    table = client.get_table(table_ref)
+    average_row_bytes = table.num_bytes / table.num_rows if table.num_rows else 0
+    return {
+        'bytes_scanned_estimate': job.total_bytes_processed,
+        'bytes_rewritten_estimate': int(rows_affected * average_row_bytes),
+    }
 
 if __name__ == "__main__":
-    fix_duplicates()
+    parser = argparse.ArgumentParser(description='Remove duplicate rows from the BigQuery tables, touching only duplicated keys.')
+    parser.add_argument('--start_date', type=datetime.date.fromisoformat, help='Only calls on or after this date (YYYY-MM-DD)')
+    parser.add_argument('--end_date', type=datetime.date.fromisoformat, help='Only calls on or before this date (YYYY-MM-DD)')
+    parser.add_argument('--dry_run', action='store_true', help='Report affected rows and bytes without changing anything')
+    args = parser.parse_args()
+
+    report = fix_duplicates(args.start_date, args.end_date, args.dry_run)
+    print(json.dumps(report, indent=2))
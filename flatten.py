@@ -0,0 +1,156 @@
+import ast
+import hashlib
+import logging
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+logger = logging.getLogger(__name__)
+
+PARAGRAPH_TYPE = pa.struct([
+    ('paragraph_number', pa.int64()),
+    ('speaker', pa.string()),
+    ('content', pa.string()),
+])
+
+def compute_transcript_ids(symbols, report_dates):
+    """
+    Deterministic transcript IDs for a whole column of calls: MD5(symbol + report_date).
+    Hashing happens once per call, never per paragraph.
+    """
+    report_dates = pc.cast(report_dates, pa.string())
+    return pa.array(
+        [hashlib.md5(f"{s}{d}".encode()).hexdigest() for s, d in zip(symbols.to_pylist(), report_dates.to_pylist())],
+        type=pa.string()
+    )
+
+def flatten_batch(batch, existing_ids=(), arrow_content=False):
+    """
+    Flatten a record batch of raw transcripts (one row per call, nested
+    `transcripts` list) into metadata and content DataFrames.
+    Calls whose transcript_id is in existing_ids, and repeats of a call
+    within the batch, are dropped before the paragraphs are exploded.
+    Metadata includes each call's content_fingerprint (see content_fingerprints).
+    arrow_content: return content as a pyarrow Table instead of a DataFrame.
+    """
+    table = pa.Table.from_batches([batch]) if isinstance(batch, pa.RecordBatch) else batch
+
+    if 'transcript_id' in table.column_names:
+        ids = table.column('transcript_id').combine_chunks()
+    else:
+        ids = compute_transcript_ids(table.column('symbol').combine_chunks(), table.column('report_date').combine_chunks())
+
+    transcripts = _as_paragraph_lists(table)
+
+    # 1. Deduplication: known calls, calls seen earlier in this batch, calls without content
+    seen_ids = set()
+    keep = []
+    for transcript_id, valid in zip(ids.to_pylist(), pc.is_valid(transcripts).to_pylist()):
+        if transcript_id in existing_ids or transcript_id in seen_ids or not valid:
+            keep.append(False)
+            continue
+        seen_ids.add(transcript_id)
+        keep.append(True)
+
+    if transcripts.null_count:
+        logger.warning(f"Skipped {transcripts.null_count} calls with missing or unparseable transcripts.")
+
+    mask = pa.array(keep, type=pa.bool_())
+    ids = ids.filter(mask)
+    table = table.filter(mask)
+    transcripts = transcripts.filter(mask)
+
+    paragraphs = pc.list_flatten(transcripts)
+    texts = _struct_column(paragraphs, 'content', pa.string())
+
+    # 2. Metadata: one row per call
+    metadata = pa.table({
+        'transcript_id': ids,
+        'symbol': table.column('symbol'),
+        'report_date': table.column('report_date'),
+        'fiscal_year': pc.cast(table.column('fiscal_year'), pa.int64()),
+        'fiscal_quarter': pc.cast(table.column('fiscal_quarter'), pa.int64()),
+        'content_fingerprint': content_fingerprints(transcripts, texts),
+    })
+
+    # 3. Content: explode the paragraph lists, repeating each call's ID per paragraph
+    parents = pc.list_parent_indices(transcripts)
+    content = pa.table({
+        'transcript_id': pc.take(ids, parents),
+        'paragraph_number': _struct_column(paragraphs, 'paragraph_number', pa.int64()),
+        'speaker': _struct_column(paragraphs, 'speaker', pa.string()),
+        'content': texts,
+    })
+
+    return metadata.to_pandas(), content if arrow_content else content.to_pandas()
+
+def content_fingerprints(transcripts, texts):
+    """
+    Content fingerprint per call: '<paragraph count>-<md5 of its paragraph texts, concatenated>'
+    (missing texts count as empty). The same value as sql_get.fingerprint_sql computes in DuckDB.
+    transcripts: list<struct> array of the calls; texts: their flattened paragraph texts.
+    Each call's texts are one contiguous slice of the Arrow data buffer, hashed without copying.
+    """
+    if texts.null_count:
+        texts = pc.fill_null(texts, '')
+    counts = pc.fill_null(pc.list_value_length(transcripts), 0).to_numpy(zero_copy_only=False)
+    ends = np.cumsum(counts)
+    offsets = np.frombuffer(texts.buffers()[1], dtype=np.int32)[texts.offset:texts.offset + len(texts) + 1]
+    data = memoryview(texts.buffers()[2] or b'')
+    return pa.array(
+        [f"{count}-{hashlib.md5(data[offsets[end - count]:offsets[end]]).hexdigest()}" for count, end in zip(counts, ends)],
+        type=pa.string()
+    )
+
+def _as_paragraph_lists(table):
+    """Return the `transcripts` column as a list<struct> array, decoding string-encoded rows."""
+    column = table.column('transcripts').combine_chunks()
+    if pa.types.is_list(column.type) or pa.types.is_large_list(column.type):
+        return column
+
+    # Some snapshots store the paragraph list as its Python repr
+    symbols = table.column('symbol').to_pylist()
+    report_dates = table.column('report_date').to_pylist()
+    parsed = []
+    for symbol, report_date, raw in zip(symbols, report_dates, column.to_pylist()):
+        if not isinstance(raw, str):
+            logger.warning(f"Unexpected type for transcripts: {symbol} {report_date} {type(raw)}")
+            parsed.append(None)
+            continue
+        try:
+            parsed.append(ast.literal_eval(raw))
+        except (ValueError, SyntaxError) as e:
+            logger.error(f"Error parsing transcript for {symbol} on {report_date}: {e}")
+            parsed.append(None)
+    try:
+        return pa.array(parsed, type=pa.list_(PARAGRAPH_TYPE))
+    except (ValueError, TypeError):
+        pass
+
+    # Some row has unexpected field types: coerce rows one by one, dropping the ones that cannot be
+    for i, (symbol, report_date, paragraphs) in enumerate(zip(symbols, report_dates, parsed)):
+        if paragraphs is None:
+            continue
+        try:
+            parsed[i] = _coerce_paragraphs(paragraphs)
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.error(f"Error parsing transcript for {symbol} on {report_date}: {e}")
+            parsed[i] = None
+    return pa.array(parsed, type=pa.list_(PARAGRAPH_TYPE))
+
+def _coerce_paragraphs(paragraphs):
+    """Cast one parsed transcript (a list of dicts) to PARAGRAPH_TYPE values; raises if it cannot be."""
+    coerced = []
+    for p in paragraphs:
+        number, speaker, content = p.get('paragraph_number'), p.get('speaker'), p.get('content')
+        coerced.append({
+            'paragraph_number': None if number is None else int(number),
+            'speaker': None if speaker is None else str(speaker),
+            'content': None if content is None else str(content),
+        })
+    return coerced
+
+def _struct_column(paragraphs, name, type_):
+    if name not in [field.name for field in paragraphs.type]:
+        return pa.nulls(len(paragraphs), type=type_)
+    return pc.cast(pc.struct_field(paragraphs, name), type_)
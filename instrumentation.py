@@ -0,0 +1,334 @@
+import contextlib
+import cProfile
+import datetime
+import io
+import json
+import logging
+import math
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ('cprofile', 'pyinstrument')
+PROFILE_DIR = 'profiles'
+# How often the resident set size is sampled while stages run
+RSS_SAMPLE_SECONDS = 0.05
+
+def current_rss_bytes():
+    """Resident set size of this process right now (Linux), else the peak so far."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+def peak_rss_bytes():
+    """Highest resident set size over the whole life of the process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def nbytes(obj):
+    """In-memory size of an Arrow table/batch or a DataFrame (0 if unknown)."""
+    if obj is None:
+        return 0
+    if hasattr(obj, 'nbytes'):
+        return int(obj.nbytes)
+    if hasattr(obj, 'memory_usage'):
+        return int(obj.memory_usage(index=False, deep=True).sum())
+    return 0
+
+def percentile_ms(durations, q):
+    """q-th percentile (0-100, nearest rank) of durations in seconds, in milliseconds."""
+    if not durations:
+        return None
+    ordered = sorted(durations)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return round(ordered[rank - 1] * 1000, 3)
+
+class StageStats:
+    """Accumulated measurements of one pipeline stage across all its invocations."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.rss_delta_bytes = 0
+        # Highest RSS sampled while the stage ran (not the process-lifetime peak)
+        self.max_rss_bytes = 0
+        self.tracemalloc_peak_bytes = None
+        # Ran alongside another stage: the tracemalloc peak is process-wide, so it is not reported
+        self.overlapped = False
+        self.durations = []
+
+    def add(self, rows=0, bytes=0):
+        self.rows += int(rows)
+        self.bytes += int(bytes)
+
+    def percentile_ms(self, q):
+        """q-th percentile (0-100) of the per-call durations, in milliseconds."""
+        return percentile_ms(self.durations, q)
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'wall_seconds': round(self.wall_seconds, 4),
+            'p50_ms': self.percentile_ms(50),
+            'p95_ms': self.percentile_ms(95),
+            'max_ms': self.percentile_ms(100),
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'rows_per_second': round(self.rows / self.wall_seconds, 1) if self.wall_seconds > 0 else None,
+            'rss_delta_mb': round(self.rss_delta_bytes / 1024 ** 2, 1),
+            'max_rss_mb': round(self.max_rss_bytes / 1024 ** 2, 1),
+            'tracemalloc_peak_mb': (round(self.tracemalloc_peak_bytes / 1024 ** 2, 1)
+                                    if self.tracemalloc_peak_bytes is not None and not self.overlapped else None),
+        }
+
+class _ActiveStage:
+    __slots__ = ('name', 'overlapped', 'max_rss')
+
+    def __init__(self, name, overlapped, rss):
+        self.name = name
+        self.overlapped = overlapped
+        self.max_rss = rss
+
+class _RssSampler:
+    """Samples the current RSS on a background thread while any stage runs, keeping each stage's maximum."""
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self._stages = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, active):
+        with self._lock:
+            self._stages.add(active)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+                self._thread.start()
+
+    def remove(self, active):
+        with self._lock:
+            self._stages.discard(active)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            rss = current_rss_bytes()
+            with self._lock:
+                if not self._stages:
+                    self._thread = None
+                    return
+                for active in self._stages:
+                    active.max_rss = max(active.max_rss, rss)
+
+_rss_sampler = _RssSampler()
+
+# tracemalloc is process-wide: it runs while any report with trace_memory is open
+_tracing_lock = threading.Lock()
+_tracing_reports = 0
+_started_tracing = False
+
+def _acquire_tracing():
+    global _tracing_reports, _started_tracing
+    with _tracing_lock:
+        if _tracing_reports == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _tracing_reports += 1
+
+def _release_tracing():
+    global _tracing_reports, _started_tracing
+    with _tracing_lock:
+        _tracing_reports -= 1
+        # Only stop tracing this module started (not, say, a caller's own tracemalloc session)
+        if _tracing_reports == 0 and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+class RunReport:
+    """
+    Per-stage wall time, memory and throughput of one collect_transcripts run.
+
+    with report.stage('flatten') as stage:
+        ...
+        stage.add(rows=len(content), bytes=batch.nbytes)
+
+    trace_memory: also track Python allocations with tracemalloc (the peak per
+    stage). Slows allocation-heavy code down noticeably, so it is off by default;
+    the highest RSS sampled during each stage is always recorded. Tracing stays on
+    until every report that asked for it has finished.
+
+    Stages may run on several threads at once (the sink writer threads run while
+    the main thread flattens). The tracemalloc peak is process-wide, so it is only
+    reported for stages that never overlapped another one.
+    """
+
+    def __init__(self, run_id=None, trace_memory=False):
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self._start = time.perf_counter()
+        self.wall_seconds = None
+        self.stages = {}
+        self.counters = {}
+        # Stages currently executing (any thread), for progress reporting while the run is in flight
+        self._active = []
+        self._lock = threading.Lock()
+        self.trace_memory = trace_memory
+        self._tracing = trace_memory
+        if trace_memory:
+            _acquire_tracing()
+
+    @property
+    def current_stage(self):
+        """The most recently entered stage that is still running, or None."""
+        with self._lock:
+            return self._active[-1].name if self._active else None
+
+    @property
+    def active_stages(self):
+        """Names of the stages running right now, in the order they were entered."""
+        with self._lock:
+            return list(dict.fromkeys(active.name for active in self._active))
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        rss_start = current_rss_bytes()
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats(name)
+            active = _ActiveStage(name, bool(self._active), rss_start)
+            for other in self._active:
+                other.overlapped = True
+            self._active.append(active)
+            # reset_peak() is process-wide: only a stage running alone may reset and read it
+            tracing = tracemalloc.is_tracing() and not active.overlapped
+            if tracing:
+                tracemalloc.reset_peak()
+                traced_start = tracemalloc.get_traced_memory()[0]
+        _rss_sampler.add(active)
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            elapsed = time.perf_counter() - start
+            _rss_sampler.remove(active)
+            rss_end = current_rss_bytes()
+            with self._lock:
+                self._active.remove(active)
+                stats.calls += 1
+                stats.wall_seconds += elapsed
+                stats.durations.append(elapsed)
+                stats.rss_delta_bytes += rss_end - rss_start
+                stats.max_rss_bytes = max(stats.max_rss_bytes, active.max_rss, rss_end)
+                if active.overlapped:
+                    stats.overlapped = True
+                elif tracing:
+                    peak = tracemalloc.get_traced_memory()[1] - traced_start
+                    stats.tracemalloc_peak_bytes = max(stats.tracemalloc_peak_bytes or 0, peak)
+
+    def iter_stage(self, name, iterable):
+        """Yield from iterable, timing each next() as stage `name` (rows/bytes from each item)."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name) as stats:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                stats.add(rows=getattr(item, 'num_rows', 1), bytes=nbytes(item))
+            yield item
+
+    def set(self, **counters):
+        with self._lock:
+            self.counters.update(counters)
+
+    def finish(self):
+        self.wall_seconds = time.perf_counter() - self._start
+        if self._tracing:
+            self._tracing = False
+            _release_tracing()
+
+    def to_dict(self):
+        wall_seconds = self.wall_seconds if self.wall_seconds is not None else time.perf_counter() - self._start
+        with self._lock:
+            counters = dict(self.counters)
+            stages = {name: stats.to_dict() for name, stats in self.stages.items()}
+        return {
+            'run_id': self.run_id,
+            'started_at': self.started_at.isoformat(),
+            'wall_seconds': round(wall_seconds, 4),
+            'peak_rss_mb': round(peak_rss_bytes() / 1024 ** 2, 1),
+            'counters': counters,
+            'stages': stages,
+        }
+
+def log_report(report):
+    """
+    Emit the report as one structured log entry. Cloud Run / Cloud Logging parses
+    a JSON line on stdout into jsonPayload, so the stages stay queryable fields.
+    """
+    entry = {
+        'severity': 'INFO',
+        'message': f"collect_transcripts run report {report.run_id}",
+        'run_report': report.to_dict(),
+    }
+    print(json.dumps(entry, default=str), flush=True)
+
+@contextlib.contextmanager
+def profiled(mode, name='collect_transcripts', output_dir=PROFILE_DIR):
+    """
+    Profile the enclosed block. mode: None (off), 'cprofile' or 'pyinstrument'
+    (optional dependency). Results are written to output_dir and the top
+    entries are logged.
+    """
+    if not mode:
+        yield
+        return
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode '{mode}', expected one of {PROFILE_MODES}")
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+
+    if mode == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.error("pyinstrument is not installed; running without profiling.")
+            yield
+            return
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            path = os.path.join(output_dir, f"{name}-{stamp}.html")
+            with open(path, 'w') as f:
+                f.write(profiler.output_html())
+            logger.info(f"pyinstrument profile written to {path}\n{profiler.output_text()}")
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = os.path.join(output_dir, f"{name}-{stamp}.prof")
+        profiler.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(25)
+        logger.info(f"cProfile stats written to {path}\n{summary.getvalue()}")
@@ -0,0 +1,153 @@
+import contextlib
+import datetime
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+DEFAULT_QUEUE_LIMIT = int(os.environ.get('JOB_QUEUE_LIMIT', 8))
+# Finished jobs kept for polling before the oldest are forgotten
+DEFAULT_HISTORY = 100
+
+ACTIVE_STATES = ('queued', 'waiting', 'running')
+
+class JobQueueFull(Exception):
+    pass
+
+class TickerLocks:
+    """
+    In-process locks on ticker symbols. A job claims all of its tickers at once,
+    waiting until no other job holds any of them, so overlapping runs on this
+    instance never deduplicate against the same snapshot (and never deadlock).
+    They do not span instances: jobs on two instances can still collect the same
+    tickers, and only the writers' MERGE keeps those from storing a call twice.
+    """
+
+    def __init__(self):
+        self._held = set()
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def hold(self, tickers, on_wait=None):
+        tickers = set(tickers)
+        with self._condition:
+            if self._held & tickers and on_wait:
+                on_wait()
+            self._condition.wait_for(lambda: not (self._held & tickers))
+            self._held |= tickers
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._held -= tickers
+                self._condition.notify_all()
+
+class Job:
+    def __init__(self, params, tickers):
+        self.id = uuid.uuid4().hex[:12]
+        self.params = params
+        self.tickers = tickers
+        self.status = 'queued'
+        self.error = None
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.started_at = None
+        self.finished_at = None
+        self.report = instrumentation.RunReport(run_id=self.id, trace_memory=params.get('trace_memory', False))
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        """Block until the job has finished (or timeout seconds passed); returns whether it finished."""
+        return self._done.wait(timeout)
+
+    def to_dict(self, include_report=True):
+        counters = self.report.counters
+        result = {
+            'job_id': self.id,
+            'status': self.status,
+            'params': dict(self.params),
+            'tickers': len(self.tickers),
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'progress': {
+                'stage': self.report.current_stage,
+                'active_stages': self.report.active_stages,
+                'tickers_total': counters.get('tickers_with_new_calls'),
+                'tickers_done': counters.get('tickers_done', 0),
+                'calls_written': counters.get('bq_calls_written', 0),
+                'rows_written': counters.get('bq_rows_written', 0),
+            },
+            'error': self.error,
+        }
+        if include_report:
+            result['report'] = self.report.to_dict()
+        return result
+
+class JobManager:
+    """
+    Runs collection jobs on a bounded thread pool and keeps their state for polling.
+    run_fn(job) does the work; it runs while the job holds the locks on its tickers.
+    At most workers + queue_limit jobs are active; submit() raises JobQueueFull beyond that.
+    """
+
+    def __init__(self, run_fn, workers=DEFAULT_WORKERS, queue_limit=DEFAULT_QUEUE_LIMIT, history=DEFAULT_HISTORY):
+        self.run_fn = run_fn
+        self.capacity = workers + queue_limit
+        self.history = history
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='collect-job')
+        self.locks = TickerLocks()
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, params, tickers):
+        with self._lock:
+            active = sum(1 for j in self.jobs.values() if j.status in ACTIVE_STATES)
+            if active >= self.capacity:
+                raise JobQueueFull(f"{active} jobs already queued or running")
+            job = Job(params, tickers)
+            self.jobs[job.id] = job
+            self._forget_finished()
+        self.executor.submit(self._run, job)
+        logger.info(f"Queued job {job.id} for {len(tickers)} tickers.")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def _run(self, job):
+        def on_wait():
+            job.status = 'waiting'
+            logger.info(f"Job {job.id} waiting for tickers held by another job.")
+
+        try:
+            with self.locks.hold(job.tickers, on_wait=on_wait):
+                job.status = 'running'
+                job.started_at = datetime.datetime.now(datetime.timezone.utc)
+                self.run_fn(job)
+            status = 'failed' if job.report.counters.get('status') == 'aborted' else 'succeeded'
+            job.error = job.report.counters.get('error')
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed: {e}")
+            status = 'failed'
+            job.error = str(e)
+        # Set last so pollers never see a finished job without its end time
+        job.finished_at = datetime.datetime.now(datetime.timezone.utc)
+        job.status = status
+        job._done.set()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, j in self.jobs.items() if j.status not in ACTIVE_STATES]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job_id]
@@ -0,0 +1,169 @@
+import argparse
+import contextlib
+import fcntl
+import glob
+import logging
+import os
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = 'transcripts_parquet'
+PARTITION_COLUMNS = ['symbol', 'fiscal_year']
+COMPRESSION = 'zstd'
+COMPRESSION_LEVEL = 6
+# Serializes writers and compaction of the export across processes (sinks.ParquetSink holds it too)
+LOCK_FILE = '.transcripts_parquet.lock'
+
+# Unique key of each table; compaction keeps the first row per key
+TABLE_KEYS = {
+    'metadata': ['transcript_id'],
+    'content': ['transcript_id', 'paragraph_number'],
+}
+
+PARTITIONING = ds.partitioning(
+    pa.schema([('symbol', pa.string()), ('fiscal_year', pa.int64())]), flavor='hive'
+)
+
+def write_batch(metadata_df, content_df, export_dir=EXPORT_DIR, replace=()):
+    """
+    Append one batch of calls to the local Parquet export:
+    <export_dir>/{metadata,content}/symbol=<SYMBOL>/fiscal_year=<YEAR>/part-<id>-<n>.parquet
+    Every call adds new files, so appends never rewrite existing data; run
+    compact() to merge the small files.
+    replace: transcript IDs of revised calls whose stored rows are removed first.
+    """
+    if metadata_df.empty:
+        return
+    metadata = _prepare_metadata(metadata_df)
+    if replace:
+        remove_calls(metadata[metadata['transcript_id'].isin(replace)], export_dir)
+    batch_id = uuid.uuid4().hex[:12]
+    _write(pa.Table.from_pandas(metadata, preserve_index=False), os.path.join(export_dir, 'metadata'), batch_id)
+    _write_content(content_df, metadata, export_dir, batch_id)
+
+def _prepare_metadata(metadata_df):
+    return metadata_df.assign(
+        report_date=metadata_df['report_date'].astype(str),
+        fiscal_year=metadata_df['fiscal_year'].astype('int64'),
+    )
+
+def _write_content(content_df, metadata, export_dir, batch_id):
+    # Content rows carry the partition keys of their call
+    content = content_df.merge(metadata[['transcript_id'] + PARTITION_COLUMNS], on='transcript_id', how='inner')
+    if not content.empty:
+        _write(pa.Table.from_pandas(content, preserve_index=False), os.path.join(export_dir, 'content'), batch_id)
+
+def _write(table, base_dir, batch_id):
+    file_format = ds.ParquetFileFormat()
+    options = file_format.make_write_options(
+        compression=COMPRESSION,
+        compression_level=COMPRESSION_LEVEL,
+        use_dictionary=[c for c in ('symbol', 'speaker') if c in table.column_names],
+    )
+    ds.write_dataset(
+        table,
+        base_dir,
+        format=file_format,
+        file_options=options,
+        partitioning=PARTITIONING,
+        basename_template=f"part-{batch_id}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+    )
+
+def remove_calls(metadata, export_dir=EXPORT_DIR):
+    """
+    Delete the rows of the calls in metadata (transcript_id, symbol) from the export.
+    Only files of their symbols' partitions that hold one of them are rewritten
+    (every fiscal year, in case a revision moved the call to another one).
+    """
+    for symbol, calls in metadata.groupby('symbol'):
+        ids = pa.array(calls['transcript_id'].unique(), type=pa.string())
+        for name in TABLE_KEYS:
+            pattern = os.path.join(export_dir, name, f"symbol={symbol}", 'fiscal_year=*', '*.parquet')
+            for path in sorted(glob.glob(pattern)):
+                table = pq.read_table(path, partitioning=None)
+                stale = pc.is_in(table['transcript_id'], value_set=ids)
+                if not pc.any(stale).as_py():
+                    continue
+                kept = table.filter(pc.invert(stale))
+                if kept.num_rows:
+                    _write_file(kept, path)
+                else:
+                    os.remove(path)
+
+def _write_file(table, path):
+    pq.write_table(
+        table, path + '.tmp', compression=COMPRESSION, compression_level=COMPRESSION_LEVEL,
+        use_dictionary=[c for c in ('symbol', 'speaker') if c in table.column_names],
+    )
+    os.replace(path + '.tmp', path)
+
+@contextlib.contextmanager
+def locked(lock_file=LOCK_FILE):
+    """Hold the export's writer lock."""
+    with open(lock_file, 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+def compact(export_dir=EXPORT_DIR, min_files=2, lock_file=LOCK_FILE):
+    """
+    Merge each partition's files into one, dropping repeated rows.
+    Only partitions with at least min_files files are rewritten. Each partition is
+    compacted under the writer lock, so a concurrent write_batch() never has files
+    removed or rewritten underneath it.
+    Returns the number of partitions compacted.
+    """
+    compacted = 0
+    for name, keys in TABLE_KEYS.items():
+        base_dir = os.path.join(export_dir, name)
+        for partition in sorted(glob.glob(os.path.join(base_dir, 'symbol=*', 'fiscal_year=*'))):
+            with locked(lock_file):
+                files = sorted(glob.glob(os.path.join(partition, '*.parquet')))
+                if len(files) < min_files:
+                    continue
+                # Files written before a column was added lack it; read them with the newest schema
+                schema = pa.unify_schemas([pq.read_schema(f) for f in files])
+                table = pq.read_table(files, partitioning=None, schema=schema)
+                frame = table.to_pandas().drop_duplicates(subset=keys, keep='first')
+                if name == 'content':
+                    frame = frame.sort_values(keys)
+                merged = pa.Table.from_pandas(frame, preserve_index=False)
+
+                target = os.path.join(partition, f"part-{uuid.uuid4().hex[:12]}-compacted.parquet")
+                _write_file(merged, target)
+                for f in files:
+                    os.remove(f)
+            compacted += 1
+            logger.info(f"Compacted {len(files)} files in {partition} ({merged.num_rows} rows).")
+    return compacted
+
+def import_csv(metadata_csv, content_csv, export_dir=EXPORT_DIR, chunk_rows=200_000):
+    """One-off migration of the legacy append-mode CSV outputs into the Parquet export."""
+    metadata = _prepare_metadata(pd.read_csv(metadata_csv, dtype={'transcript_id': str, 'symbol': str, 'report_date': str}))
+    batch_id = uuid.uuid4().hex[:12]
+    _write(pa.Table.from_pandas(metadata, preserve_index=False), os.path.join(export_dir, 'metadata'), batch_id)
+    if not os.path.exists(content_csv):
+        return
+    for i, chunk in enumerate(pd.read_csv(content_csv, dtype={'transcript_id': str, 'speaker': str, 'content': str}, chunksize=chunk_rows)):
+        _write_content(chunk, metadata, export_dir, f"{batch_id}{i}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Maintain the local Parquet export of transcripts.')
+    parser.add_argument('command', choices=['compact', 'import_csv'], help='compact: merge small files; import_csv: migrate legacy CSV outputs')
+    parser.add_argument('--export_dir', type=str, default=EXPORT_DIR, help='Export directory')
+    parser.add_argument('--metadata_csv', type=str, default='transcripts_metadata.csv', help='Legacy metadata CSV (import_csv)')
+    parser.add_argument('--content_csv', type=str, default='transcripts_content.csv', help='Legacy content CSV (import_csv)')
+    args = parser.parse_args()
+
+    if args.command == 'import_csv':
+        import_csv(args.metadata_csv, args.content_csv, args.export_dir)
+    compacted = compact(args.export_dir)
+    print(f"Compacted {compacted} partitions in {args.export_dir}.")
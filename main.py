@@ -1,26 +1,93 @@
 import functions_framework
-from sql_get import collect_transcripts
+import instrumentation
+import jobs
+import tuning
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# sql_get (defeatbeta_api, DuckDB, pandas, BigQuery) is imported on the first
+# collection request rather than at startup, so the instance starts serving sooner
+# and job polling never pays for it.
+
 @functions_framework.http
 def entry_point(request):
     """HTTP Cloud Function.
     Args:
         request (flask.Request): The request object.
     Returns:
-        The response text, or any set of values that can be turned into a
-        Response object using `make_response`.
+        POST / (or GET with query params): 202 with the ID of the queued
+        collection job, or the JSON run report when `wait` is set (the job
+        still runs through the job manager and its ticker locks).
+        GET /jobs/<id>: status, progress and run report of a job.
+        GET /jobs: all known jobs.
     """
+    path = request.path.rstrip('/')
+    if path == '/jobs':
+        return {'jobs': [job.to_dict(include_report=False) for job in job_manager.list()]}, 200
+    if path.startswith('/jobs/'):
+        job = job_manager.get(path[len('/jobs/'):])
+        if job is None:
+            return {'error': 'Unknown job ID'}, 404
+        return job.to_dict(), 200
+
+    try:
+        params = parse_params(request)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    logger.info(f"Triggered Cloud Function. Tickers source: {params['tickers_source']}, Months: {params['months']}, Start Date: {params['start_date']}, Batch Size: {params['batch_size']}, Incremental: {params['incremental']}, BQ Sink: {params['bq_sink']}, Wait: {params['wait']}, Resume: {params['resume']}, Refresh: {params['refresh']}")
+
+    from sql_get import read_tickers
+    tickers = read_tickers(params['tickers_source'])
+    if tickers is None:
+        return {'error': f"Could not read tickers from {params['tickers_source']}"}, 400
+    try:
+        job = job_manager.submit(params, tickers)
+    except jobs.JobQueueFull as e:
+        return {'error': f"Too many jobs: {e}"}, 429
+
+    if params['wait']:
+        # Same queue and ticker locks as background jobs, so the two never overlap on a ticker
+        job.wait()
+        if job.status == 'failed':
+            return {'error': job.error, 'report': job.report.to_dict()}, 500
+        return job.report.to_dict(), 200
+    return {'job_id': job.id, 'status': job.status, 'status_url': f"/jobs/{job.id}"}, 202
+
+def parse_bool(value, name):
+    """A JSON boolean, or 'true'/'false', '1'/'0', 'yes'/'no'; anything else is rejected."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in _TRUE + _FALSE:
+        return value.strip().lower() in _TRUE
+    raise ValueError(f"'{name}' must be a boolean, got {value!r}")
+
+_TRUE = ('1', 'true', 'yes')
+_FALSE = ('0', 'false', 'no')
+
+def parse_params(request):
+    """Collection parameters from the JSON body or the query string. Raises ValueError on bad values."""
+    from sql_get import DEFAULT_LOOKBACK_DAYS
     request_json = request.get_json(silent=True, force=True)
     request_args = request.args
 
     tickers_source = 'tickers.csv' # Default to included file
     months = 1 # Default to 1 month
     start_date = None
+    batch_size = None # Sized to the instance's memory
+    incremental = False
+    lookback_days = DEFAULT_LOOKBACK_DAYS
+    bq_sink = 'load'
+    profile = None
+    trace_memory = False
+    wait = False
+    checkpoint_every = None
+    resume = None
+    refresh = False
 
     if request_json and 'tickers' in request_json:
         tickers_source = request_json['tickers']
@@ -37,11 +104,81 @@ def entry_point(request):
     elif request_args and 'start_date' in request_args:
         start_date = request_args['start_date']
 
-    logger.info(f"Triggered Cloud Function. Tickers source: {tickers_source}, Months: {months}, Start Date: {start_date}")
-    
-    try:
-        collect_transcripts(tickers_source, months, start_date)
-        return 'Earnings call collection completed successfully.', 200
-    except Exception as e:
-        logger.exception(f"Error during execution: {e}")
-        return f'Error: {str(e)}', 500
+    if request_json and 'batch_size' in request_json:
+        batch_size = int(request_json['batch_size'])
+    elif request_args and 'batch_size' in request_args:
+        batch_size = int(request_args['batch_size'])
+
+    if request_json and 'incremental' in request_json:
+        incremental = parse_bool(request_json['incremental'], 'incremental')
+    elif request_args and 'incremental' in request_args:
+        incremental = parse_bool(request_args['incremental'], 'incremental')
+
+    if request_json and 'lookback_days' in request_json:
+        lookback_days = int(request_json['lookback_days'])
+    elif request_args and 'lookback_days' in request_args:
+        lookback_days = int(request_args['lookback_days'])
+
+    if request_json and 'bq_sink' in request_json:
+        bq_sink = request_json['bq_sink']
+    elif request_args and 'bq_sink' in request_args:
+        bq_sink = request_args['bq_sink']
+
+    if request_json and 'profile' in request_json:
+        profile = request_json['profile']
+    elif request_args and 'profile' in request_args:
+        profile = request_args['profile']
+
+    if request_json and 'trace_memory' in request_json:
+        trace_memory = parse_bool(request_json['trace_memory'], 'trace_memory')
+    elif request_args and 'trace_memory' in request_args:
+        trace_memory = parse_bool(request_args['trace_memory'], 'trace_memory')
+
+    if request_json and 'wait' in request_json:
+        wait = parse_bool(request_json['wait'], 'wait')
+    elif request_args and 'wait' in request_args:
+        wait = parse_bool(request_args['wait'], 'wait')
+
+    if request_json and 'checkpoint' in request_json:
+        checkpoint_every = request_json['checkpoint']
+    elif request_args and 'checkpoint' in request_args:
+        checkpoint_every = request_args['checkpoint']
+
+    if request_json and 'resume' in request_json:
+        resume = request_json['resume']
+    elif request_args and 'resume' in request_args:
+        resume = request_args['resume']
+
+    if request_json and 'refresh' in request_json:
+        refresh = parse_bool(request_json['refresh'], 'refresh')
+    elif request_args and 'refresh' in request_args:
+        refresh = parse_bool(request_args['refresh'], 'refresh')
+
+    return {
+        'tickers_source': tickers_source, 'months': months, 'start_date': start_date,
+        'batch_size': batch_size, 'incremental': incremental, 'lookback_days': lookback_days,
+        'bq_sink': bq_sink, 'profile': profile, 'trace_memory': trace_memory, 'wait': wait,
+        'checkpoint': checkpoint_every, 'resume': resume, 'refresh': refresh,
+    }
+
+def run_collection(params, report, tickers=None):
+    """
+    Run collect_transcripts for parsed request params, recording into report.
+    Jobs run side by side, so each gets a JOB_WORKERS share of the instance's CPUs and memory.
+    Clients, the dataset URL and the dedup index are reused across requests (warm cache).
+    """
+    from sql_get import collect_transcripts
+    settings = tuning.auto_tune(batch_size=params['batch_size'], is_cloud_run=tuning.is_cloud_run(),
+                                workers=jobs.DEFAULT_WORKERS)
+    with instrumentation.profiled(params['profile']):
+        collect_transcripts(tickers if tickers is not None else params['tickers_source'],
+                            params['months'], params['start_date'],
+                            incremental=params['incremental'], lookback_days=params['lookback_days'],
+                            settings=settings, bq_sink=params['bq_sink'], warm=True, checkpoint_every=params['checkpoint'],
+                            resume=params['resume'], refresh=params['refresh'], report=report)
+
+def run_job(job):
+    run_collection(job.params, job.report, job.tickers)
+
+# Background jobs of this instance (JOB_WORKERS run concurrently, JOB_QUEUE_LIMIT more can wait)
+job_manager = jobs.JobManager(run_job)
@@ -0,0 +1,97 @@
+import argparse
+import contextlib
+import logging
+import db_utils
+from db_utils import FTS_TABLE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 20
+# Markers around matched terms in snippets, and the snippet length in tokens
+HIGHLIGHT = ('[', ']')
+SNIPPET_TOKENS = 16
+
+# Index rows -> paragraphs for each content mode (normalized: one indexed text, many paragraphs)
+_PARAGRAPH_JOINS = {
+    'inline': f"JOIN transcript_content c ON c.id = {FTS_TABLE}.rowid",
+    'normalized': f"""JOIN paragraph_text_ids i ON i.id = {FTS_TABLE}.rowid
+        JOIN transcript_paragraphs c ON c.content_hash = i.content_hash""",
+}
+
+def phrase_query(text):
+    """FTS5 query matching text as one phrase (quotes and operators in it lose their meaning)."""
+    return '"' + text.replace('"', '""') + '"'
+
+def search(query, symbol=None, since=None, until=None, speaker=None, limit=DEFAULT_LIMIT, raw=False, highlight=HIGHLIGHT):
+    """
+    Ranked paragraphs of the local database matching query, best first.
+    query: searched as a phrase, or as FTS5 syntax with raw ('tariff* NOT china', 'NEAR(guidance cut, 3)').
+    Terms are stemmed, so 'guidance cut' also finds 'guidance cuts'.
+    symbol: ticker or list of tickers. since / until: report_date bounds (YYYY-MM-DD, inclusive).
+    speaker: case-insensitive substring of the speaker.
+    Returns dicts with symbol, report_date, transcript_id, paragraph_number, speaker,
+    snippet (matches wrapped in highlight) and score (higher is better).
+    """
+    conditions = [f"{FTS_TABLE} MATCH ?"]
+    params = [query if raw else phrase_query(query)]
+    if symbol:
+        symbols = [symbol] if isinstance(symbol, str) else list(symbol)
+        conditions.append(f"m.symbol IN ({', '.join('?' * len(symbols))})")
+        params += symbols
+    if since:
+        conditions.append("m.report_date >= ?")
+        params.append(since)
+    if until:
+        # report_date may carry a time part, so compare against the next day
+        conditions.append("m.report_date < date(?, '+1 day')")
+        params.append(until)
+    if speaker:
+        conditions.append("c.speaker LIKE '%' || ? || '%'")
+        params.append(speaker)
+
+    with contextlib.closing(db_utils.open_reader()) as conn:
+        content_mode = db_utils.detect_content_mode(conn)
+        if not db_utils.fts_enabled(conn):
+            raise RuntimeError(f"{db_utils.DB_NAME} has no full-text index yet; run: python3 db_utils.py --fts sync")
+        _warn_if_incomplete(conn)
+
+        sql = f"""
+            SELECT m.symbol, m.report_date, c.transcript_id, c.paragraph_number, c.speaker,
+                   snippet({FTS_TABLE}, 0, ?, ?, '…', {SNIPPET_TOKENS}) AS snippet,
+                   bm25({FTS_TABLE}) AS bm25_score
+            FROM {FTS_TABLE}
+            {_PARAGRAPH_JOINS[content_mode]}
+            JOIN transcript_metadata m ON m.transcript_id = c.transcript_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY bm25_score, m.report_date DESC, c.transcript_id, c.paragraph_number
+            LIMIT ?
+        """
+        rows = conn.execute(sql, [highlight[0], highlight[1]] + params + [limit]).fetchall()
+
+    columns = ['symbol', 'report_date', 'transcript_id', 'paragraph_number', 'speaker', 'snippet']
+    return [dict(zip(columns, row[:-1]), score=round(-row[-1], 3)) for row in rows]
+
+def _warn_if_incomplete(conn):
+    indexed_to, backfill_to = db_utils.fts_state(conn)
+    if indexed_to < backfill_to:
+        logger.warning(f"Full-text index is still missing older rows ({indexed_to} of {backfill_to} indexed); "
+                       "run: python3 db_utils.py --fts sync")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Full-text search over the local transcripts database.')
+    parser.add_argument('query', type=str, help='Phrase to search for (FTS5 syntax with --raw)')
+    parser.add_argument('--symbol', type=str, action='append', help='Only these tickers (repeatable)')
+    parser.add_argument('--since', type=str, help='Only calls on or after this date (YYYY-MM-DD)')
+    parser.add_argument('--until', type=str, help='Only calls on or before this date (YYYY-MM-DD)')
+    parser.add_argument('--speaker', type=str, help='Only paragraphs whose speaker contains this text')
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT, help='Maximum number of paragraphs')
+    parser.add_argument('--raw', action='store_true', help='Pass the query to FTS5 as is (AND/OR/NOT, NEAR, prefix*)')
+    args = parser.parse_args()
+
+    results = search(args.query, symbol=args.symbol, since=args.since, until=args.until,
+                     speaker=args.speaker, limit=args.limit, raw=args.raw)
+    for r in results:
+        print(f"{r['symbol']} {str(r['report_date'])[:10]} #{r['paragraph_number']} {r['speaker']} ({r['score']:.2f})")
+        print(f"    {r['snippet']}")
+    print(f"{len(results)} paragraphs")
@@ -1,4 +1,5 @@
-from db_cloud_utils import initialize_bq
+from db_cloud_utils import initialize_bq, migrate_layout_bq
+import argparse
 import logging
 
 # Configure logging
@@ -8,9 +9,19 @@ PROJECT_ID = "sri-benchmarking-databases"
 DATASET_ID = "pressure_monitoring"
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Create the BigQuery tables.')
+    parser.add_argument('--content_mode', choices=['inline', 'normalized'],
+                        help='Paragraph storage; normalized migrates an existing inline content table')
+    parser.add_argument('--migrate_layout', action='store_true',
+                        help='Rewrite existing tables in place with the current partitioning/clustering (stop ingestion first)')
+    args = parser.parse_args()
+
     print(f"Initializing BigQuery tables in {PROJECT_ID}.{DATASET_ID}...")
     try:
-        initialize_bq(PROJECT_ID, DATASET_ID)
-        print("Initialization complete.")
+        mode = initialize_bq(PROJECT_ID, DATASET_ID, content_mode=args.content_mode)
+        print(f"Initialization complete ({mode} content).")
+        if args.migrate_layout:
+            migrated = migrate_layout_bq(PROJECT_ID, DATASET_ID)
+            print(f"Rewrote {len(migrated)} tables: {', '.join(migrated) or 'none needed'}.")
     except Exception as e:
         print(f"Initialization failed: {e}")
@@ -0,0 +1,124 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from sql_get import collect_transcripts, read_tickers
+import dedup_index
+import tuning
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def split_shards(tickers, shard_count):
+    """
+    Split tickers into shard_count disjoint shards (round-robin over the sorted,
+    de-duplicated list). Transcript IDs include the symbol, so disjoint ticker
+    shards can never produce the same transcript twice.
+    """
+    unique_tickers = sorted(set(tickers))
+    return [unique_tickers[i::shard_count] for i in range(shard_count)]
+
+def shard_index_path(shard_index, shard_count):
+    """Dedup index file of one shard (holding only its tickers' IDs)."""
+    root, ext = os.path.splitext(dedup_index.DEFAULT_INDEX_PATH)
+    return f"{root}.shard{shard_index + 1}of{shard_count}{ext}"
+
+def run_shard(shard_index, shard_count, tickers_source, **kwargs):
+    """
+    Collect transcripts for one shard. kwargs are passed to collect_transcripts.
+    Each shard keeps its own dedup index, scoped to its tickers, so shards writing
+    at the same time never invalidate each other's cached index.
+    """
+    tickers = read_tickers(tickers_source)
+    if tickers is None:
+        raise ValueError(f"Could not read tickers from {tickers_source}")
+
+    shard = split_shards(tickers, shard_count)[shard_index]
+    logger.info(f"Shard {shard_index + 1}/{shard_count}: {len(shard)} tickers.")
+    if not shard:
+        return 0
+
+    kwargs.setdefault('index_path', shard_index_path(shard_index, shard_count))
+    new_calls = collect_transcripts(shard, index_symbols=True, **kwargs)
+    if new_calls is None:
+        raise RuntimeError(f"Shard {shard_index + 1}/{shard_count} aborted.")
+    return new_calls
+
+def collect_sharded(tickers_source, workers, memory_limit=None, **kwargs):
+    """
+    Process the ticker universe in `workers` shards on a local process pool.
+    Each worker gets its own DuckDB client with an even share of the container's
+    CPUs and memory (memory_limit overrides the per-worker DuckDB limit).
+    A failing shard is logged and reported but does not stop the others.
+    Returns {shard_index: new calls ingested or the exception raised}.
+    """
+    settings = tuning.auto_tune(memory_limit=memory_limit, batch_size=kwargs.pop('batch_size', None),
+                                is_cloud_run=tuning.is_cloud_run(), workers=workers)
+    results = {}
+
+    # Spawn rather than fork: DuckDB and the Google client libraries are not fork-safe
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = {
+            executor.submit(run_shard, index, workers, tickers_source, settings=settings, **kwargs): index
+            for index in range(workers)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+                logger.info(f"Shard {index + 1}/{workers} finished: {results[index]} new calls.")
+            except Exception as e:
+                results[index] = e
+                logger.error(f"Shard {index + 1}/{workers} failed: {e}")
+
+    failed = [i for i, r in results.items() if isinstance(r, Exception)]
+    total = sum(r for r in results.values() if not isinstance(r, Exception))
+    logger.info(f"Sharded run complete: {total} new calls, {len(failed)} of {workers} shards failed.")
+    return results
+
+def shard_from_env():
+    """(task index, task count) when running as a Cloud Run job task, else None."""
+    if os.environ.get('CLOUD_RUN_TASK_INDEX') is None:
+        return None
+    return int(os.environ['CLOUD_RUN_TASK_INDEX']), int(os.environ.get('CLOUD_RUN_TASK_COUNT', 1))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Retrieve earning call transcripts in parallel ticker shards.')
+    parser.add_argument('--tickers', type=str, default='tickers.csv', help='Path to CSV file containing tickers')
+    parser.add_argument('--months', type=int, help='Number of months back to retrieve data for')
+    parser.add_argument('--start_date', type=str, help='Start date in YYYY-MM-DD format')
+    parser.add_argument('--batch_size', type=int, help='Transcripts processed per streamed batch (default: sized to available memory)')
+    parser.add_argument('--incremental', action='store_true', help='Only scan report dates after each ticker\'s stored watermark')
+    parser.add_argument('--workers', type=int, default=4, help='Number of local worker processes / shards')
+    parser.add_argument('--memory_limit', type=str, help='DuckDB memory limit per worker, e.g. 512MB (default: share of the memory limit)')
+    parser.add_argument('--run_local', action='store_true', help='Explicitly enable local execution')
+    args = parser.parse_args()
+
+    collect_kwargs = dict(months=args.months, start_date=args.start_date,
+                          batch_size=args.batch_size, incremental=args.incremental)
+
+    # Cloud Run job: each task processes the shard matching its task index
+    task = shard_from_env()
+    if task is not None:
+        task_index, task_count = task
+        try:
+            run_shard(task_index, task_count, args.tickers, memory_limit=args.memory_limit, **collect_kwargs)
+        except Exception as e:
+            logger.exception(f"Task {task_index + 1}/{task_count} failed: {e}")
+            sys.exit(1)
+        sys.exit(0)
+
+    if not args.run_local:
+        print("⚠️  Security/Safety Check: Local execution disabled by default.")
+        print("To run this script locally, you must provide the --run_local flag.")
+        print("Example: python3 shards.py --run_local --workers 4 --start_date 2020-01-01")
+        sys.exit(1)
+
+    results = collect_sharded(args.tickers, args.workers, memory_limit=args.memory_limit, **collect_kwargs)
+    sys.exit(1 if any(isinstance(r, Exception) for r in results.values()) else 0)
@@ -0,0 +1,274 @@
+import contextlib
+import fcntl
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+
+import db_utils
+import instrumentation
+import local_export
+from dedup_index import DedupIndex
+
+logger = logging.getLogger(__name__)
+
+# Batches queued between flattening and writing. With one batch being flattened and
+# one being written, at most DEFAULT_QUEUE_DEPTH + 2 batches are in memory at once.
+DEFAULT_QUEUE_DEPTH = 1
+
+# Serialize local writes across processes (shards.py runs several writers on the same files)
+SQLITE_LOCK = '.transcripts.lock'
+PARQUET_LOCK = local_export.LOCK_FILE
+
+@contextlib.contextmanager
+def _file_lock(path):
+    with open(path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+class SinkBatch:
+    """
+    One batch of new calls handed to every sink.
+    revised: transcript IDs in the batch whose stored versions it replaces (refresh runs).
+    """
+
+    def __init__(self, number, metadata_df, content, revised=()):
+        self.number = number
+        self.metadata_df = metadata_df
+        self.revised = frozenset(revised)
+        self._content = content
+        self._content_df = None if isinstance(content, pa.Table) else content
+        self._lock = threading.Lock()
+
+    def content(self, arrow=False):
+        """Content as a pyarrow Table if arrow and it was flattened as one, else as a DataFrame (converted once)."""
+        if arrow and isinstance(self._content, pa.Table):
+            return self._content
+        with self._lock:
+            if self._content_df is None:
+                self._content_df = self._content.to_pandas()
+        return self._content_df
+
+    def __len__(self):
+        return len(self._content)
+
+class Sink:
+    """
+    Destination for batches of new calls. write(batch) returns True once the batch
+    is stored and False if it was skipped; exceptions abort the run.
+    stage: RunReport stage the write is timed as.
+    accepts_arrow: the sink takes content as a pyarrow Table (see SinkBatch.content).
+    """
+
+    name = 'sink'
+    stage = 'sink_write'
+    accepts_arrow = False
+
+    def write(self, batch):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class _LocalSink(Sink):
+    """
+    Skips calls already in the local database (known_ids), so local runs can still backfill
+    BigQuery. Revised calls are always written, replacing the stored version.
+    """
+
+    def __init__(self, known_ids=None):
+        self.known_ids = known_ids if known_ids is not None else DedupIndex()
+
+    def new_rows(self, batch):
+        metadata_df = batch.metadata_df
+        content_df = batch.content()
+        metadata_df = metadata_df[self._wanted(metadata_df['transcript_id'], batch.revised)]
+        content_df = content_df[self._wanted(content_df['transcript_id'], batch.revised)]
+        return metadata_df, content_df
+
+    def _wanted(self, transcript_ids, revised):
+        wanted = ~self.known_ids.contains(transcript_ids)
+        if revised:
+            wanted |= transcript_ids.isin(revised).to_numpy()
+        return wanted
+
+class SQLiteSink(_LocalSink):
+    name = 'sqlite'
+    stage = 'sqlite_write'
+
+    def write(self, batch):
+        metadata_df, content_df = self.new_rows(batch)
+        if metadata_df.empty:
+            logger.info("All processed calls already exist in local DB (skipping SQLite write).")
+            return False
+        logger.info(f"Saving {len(metadata_df)} new calls to SQLite...")
+        with _file_lock(SQLITE_LOCK):
+            db_utils.insert_batch(metadata_df, content_df, replace=batch.revised)
+        return True
+
+class ParquetSink(_LocalSink):
+    name = 'parquet'
+    stage = 'parquet_write'
+
+    def __init__(self, known_ids=None, export_dir=local_export.EXPORT_DIR):
+        super().__init__(known_ids)
+        self.export_dir = export_dir
+
+    def write(self, batch):
+        metadata_df, content_df = self.new_rows(batch)
+        if metadata_df.empty:
+            return False
+        logger.info(f"Saving {len(metadata_df)} new calls to the Parquet export...")
+        with _file_lock(PARQUET_LOCK):
+            local_export.write_batch(metadata_df, content_df, self.export_dir, replace=batch.revised)
+        return True
+
+class BigQuerySink(Sink):
+    """
+    Wraps a BigQuery writer (bq_writer.BigQueryWriter, bq_storage_sink.StorageWriteSink
+    or any object with write(metadata_df, content)). A failed write is logged and
+    reported as False instead of aborting, so the other sinks still get the batch.
+    Batches with revised calls are written with write(..., replace=True).
+    """
+
+    name = 'bigquery'
+    stage = 'bq_load'
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.accepts_arrow = getattr(writer, 'accepts_arrow', False)
+
+    def write(self, batch):
+        metadata_df = batch.metadata_df
+        logger.info(f"Saving {len(metadata_df)} new calls to BigQuery...")
+        try:
+            # Since the batch was filtered against the BigQuery IDs, everything in metadata_df
+            # is expected to be NEW; the writer's MERGE still guards against concurrent runs.
+            if batch.revised:
+                self.writer.write(metadata_df, batch.content(self.accepts_arrow), replace=True)
+            else:
+                self.writer.write(metadata_df, batch.content(self.accepts_arrow))
+            logger.info(f"Saved {len(metadata_df)} calls to BigQuery.")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save to BigQuery: {e}")
+            return False
+
+class MemorySink(Sink):
+    """Keeps every batch in memory (tests, dry runs)."""
+
+    name = 'memory'
+    stage = 'memory_write'
+
+    def __init__(self, accepts_arrow=False):
+        self.accepts_arrow = accepts_arrow
+        self.metadata = []
+        self.content = []
+        self._lock = threading.Lock()
+
+    def write(self, batch):
+        with self._lock:
+            self.metadata.append(batch.metadata_df)
+            self.content.append(batch.content(self.accepts_arrow))
+        return True
+
+_DONE = object()
+
+class SinkPipeline:
+    """
+    Writes batches to all sinks on a background thread while the caller prepares
+    the next ones. submit() blocks while `depth` batches are already waiting
+    (backpressure); the sinks of one batch are written concurrently, batches in order.
+    on_written(batch, results) runs on the writer thread after each batch, with
+    results = {sink.name: write() result}.
+    A sink error stops further writes and is raised from the next submit() or close().
+
+    with SinkPipeline(sinks, on_written=record, report=report) as pipeline:
+        for batch in batches:
+            pipeline.submit(batch)
+    """
+
+    def __init__(self, sinks, on_written=None, report=None, depth=DEFAULT_QUEUE_DEPTH):
+        self.sinks = list(sinks)
+        self.on_written = on_written
+        self.report = report
+        self.queue = queue.Queue(maxsize=max(1, depth))
+        self.error = None
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(self.sinks)), thread_name_prefix='sink')
+        self.thread = threading.Thread(target=self._run, name='sink-pipeline', daemon=True)
+        self.thread.start()
+
+    @property
+    def accepts_arrow(self):
+        """Flatten content to Arrow if any sink can take it (others get a DataFrame, converted once)."""
+        return any(sink.accepts_arrow for sink in self.sinks)
+
+    def submit(self, batch):
+        self._raise_error()
+        with self._stage('sink_wait'):
+            self.queue.put(batch)
+
+    def close(self):
+        """Wait for every submitted batch to be written, then close the sinks."""
+        if self.thread.is_alive():
+            self.queue.put(_DONE)
+            self.thread.join()
+        self.executor.shutdown()
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                logger.warning(f"Could not close sink {sink.name}: {e}")
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        # The caller failed: stop writing, but report its exception rather than ours
+        self.error = self.error or exc
+        try:
+            self.close()
+        except BaseException:
+            pass
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is _DONE:
+                return
+            if self.error is not None:
+                # Keep draining so a blocked submit() wakes up and sees the error
+                continue
+            try:
+                results = self._write(batch)
+                if self.on_written:
+                    self.on_written(batch, results)
+            except BaseException as e:
+                logger.error(f"Sink pipeline failed on batch {batch.number}: {e}")
+                self.error = e
+
+    def _write(self, batch):
+        if len(self.sinks) == 1:
+            return {self.sinks[0].name: self._write_one(self.sinks[0], batch)}
+        futures = {sink.name: self.executor.submit(self._write_one, sink, batch) for sink in self.sinks}
+        return {name: future.result() for name, future in futures.items()}
+
+    def _write_one(self, sink, batch):
+        with self._stage(sink.stage) as stage:
+            result = sink.write(batch)
+            if stage is not None:
+                content = batch.content(sink.accepts_arrow)
+                stage.add(rows=len(content), bytes=instrumentation.nbytes(content))
+        return result
+
+    def _stage(self, name):
+        return self.report.stage(name) if self.report is not None else contextlib.nullcontext()
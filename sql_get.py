@@ -1,6 +1,7 @@
 import defeatbeta_api
 import logging
 import pandas as pd
+import pyarrow as pa
 from defeatbeta_api.client.duckdb_client import DuckDBClient
 from defeatbeta_api.client.duckdb_client import Configuration
 from defeatbeta_api.client.hugging_face_client import HuggingFaceClient
@@ -8,11 +9,20 @@ from defeatbeta_api.utils.const import stock_earning_call_transcripts
 
 import argparse
 import datetime
-import ast
-import hashlib
 import os
+import threading
 import db_utils
 import db_cloud_utils
+import dataset_cache
+import dedup_index
+import instrumentation
+import tuning
+import checkpoint
+import warm_cache
+from bq_writer import BigQueryWriter
+from bq_storage_sink import StorageWriteSink
+from flatten import flatten_batch
+from sinks import SinkBatch, SinkPipeline, BigQuerySink, SQLiteSink, ParquetSink
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,43 +32,95 @@ logger = logging.getLogger(__name__)
 PROJECT_ID = "sri-benchmarking-databases"
 DATASET_ID = "pressure_monitoring"
 
-def collect_transcripts(tickers_source, months=None, start_date=None):
+# Number of transcripts pulled from DuckDB per Arrow record batch.
+# Peak memory scales with this value rather than with the size of the query.
+DEFAULT_BATCH_SIZE = 100
+
+# DuckDB tables used to deduplicate inside the query
+KNOWN_IDS_TABLE = 'known_transcript_ids'
+NEW_CALLS_TABLE = 'new_calls'
+CUTOFFS_TABLE = 'symbol_cutoffs'
+# Content fingerprints of the stored calls, compared with upstream in refresh runs
+STORED_FINGERPRINTS_TABLE = 'stored_fingerprints'
+
+# Incremental mode re-scans this many days before each symbol's watermark
+# to pick up transcripts that were published late.
+DEFAULT_LOOKBACK_DAYS = 30
+
+# BigQuery sinks selectable with bq_sink=
+BQ_SINKS = ('load', 'storage')
+
+# Reused by later runs on a warm instance (warm=True): idle DuckDB clients per
+# thread count and the resolved dataset URL
+_duckdb_clients = warm_cache.ClientPool(close=lambda client: client.close())
+_dataset_urls = warm_cache.TTLCache()
+
+def collect_transcripts(tickers_source, months=None, start_date=None, batch_size=None,
+                        cache_dir=None, offline=None, incremental=False, lookback_days=DEFAULT_LOOKBACK_DAYS,
+                        threads=None, memory_limit=None, index_path=dedup_index.DEFAULT_INDEX_PATH,
+                        bq_sink='load', sinks=None, warm=False, checkpoint_every=checkpoint.DEFAULT_GRANULARITY,
+                        resume=None, refresh=False, index_symbols=False, settings=None, report=None):
     """
     Main logic to collect transcripts.
     tickers_source: Path to CSV or list of tickers.
     months: Number of months back to retrieve.
     start_date: Specific start date (YYYY-MM-DD). Overrides months.
+    batch_size: Number of transcripts processed and written per batch (default: sized to the container's memory).
+    cache_dir: Local dataset mirror directory (default: TRANSCRIPT_CACHE_DIR, unset = read upstream directly).
+    offline: Use only the local mirror/fixture, never the network.
+    incremental: Scan each symbol only from its stored watermark (minus lookback_days).
+                 Symbols without a watermark use the regular cutoff.
+    lookback_days: Days re-scanned before each watermark in incremental mode.
+    threads: DuckDB thread count (default: the container's CPU quota).
+    memory_limit: DuckDB memory limit, e.g. '512MB' (default: derived from the container's memory limit).
+    index_path: Local file caching the BigQuery transcript ID index between runs.
+    bq_sink: 'load' (Parquet load jobs, bq_writer.py), 'storage' (Arrow over the
+             Storage Write API, bq_storage_sink.py) or a writer object with write(metadata_df, content).
+    sinks: list of sinks.Sink to write every batch to (default: make_sinks, i.e. BigQuery via
+           bq_sink plus SQLite and Parquet for local runs). Writes run on a background thread.
+    warm: reuse the DuckDB client, resolved dataset URL and in-memory dedup index of
+          earlier runs in this process (up to WARM_CACHE_TTL_SECONDS old), as the HTTP entry point does.
+    checkpoint_every: 'ticker' to record each ticker in the run's checkpoint manifest once all its
+                      new calls are committed, a number N to also record committed calls every N
+                      transcripts, or None (default) to disable (see checkpoint.py). The manifest
+                      is deleted once the run completes.
+    resume: run ID of an interrupted run to continue: its completed tickers are skipped without
+            scanning and progress keeps being recorded under that ID.
+    refresh: also re-ingest stored calls whose transcript changed upstream. Content fingerprints
+             are compared with the stored ones in DuckDB, and only revised calls are rewritten,
+             replacing their paragraphs atomically in every sink. Stored calls without a
+             fingerprint yet get the current one recorded instead.
+    index_symbols: index_path only holds the IDs of these tickers (shards.py gives each shard
+                   its own index, so concurrent shards do not invalidate each other's).
+    settings: tuning.auto_tune() result computed by the caller for its share of the container
+              (main.py, shards.py); threads, memory_limit and batch_size are then ignored.
+    report: instrumentation.RunReport receiving per-stage timings and counters
+            (a new one is created if omitted). It is logged as one structured entry at the end.
+    Returns the number of new (and revised) calls ingested, or None if the run was aborted.
     """
 
-    # Check if running in Cloud Run (K_SERVICE is set automatically)
-    is_cloud_run = os.environ.get('K_SERVICE') is not None
+    if report is None:
+        report = instrumentation.RunReport()
 
-    # Initialize clients with appropriate thread count based on environment
-    if is_cloud_run:
-        duckdb_client = DuckDBClient(log_level=logging.INFO, config=Configuration(threads=1))
-    else:
-        duckdb_client = DuckDBClient(log_level=logging.INFO, config=Configuration(threads=8))
+    is_cloud_run = tuning.is_cloud_run()
 
-    huggingface_client = HuggingFaceClient()
+    # Size DuckDB and the batches to the container's cgroup CPU/memory limits
+    if settings is None:
+        settings = tuning.auto_tune(threads=threads, memory_limit=memory_limit, batch_size=batch_size,
+                                    is_cloud_run=is_cloud_run)
+    batch_size = settings['batch_size']
+    with report.stage('client_setup'):
+        new_client = lambda: DuckDBClient(log_level=logging.INFO, config=Configuration(threads=settings['threads']))
+        if warm:
+            duckdb_client, reused = _duckdb_clients.acquire(settings['threads'], new_client)
+        else:
+            duckdb_client, reused = new_client(), False
+    report.set(status='running', threads=settings['threads'], memory_limit=settings['memory_limit'],
+               batch_size=batch_size, is_cloud_run=is_cloud_run, warm_client=reused, new_calls=0)
 
+    cache = None
     try:
-        # Always load BigQuery IDs as the primary deduplication source
-        try:
-            existing_ids_bq = db_cloud_utils.get_existing_ids_bq(PROJECT_ID, DATASET_ID)
-            logger.info(f"Loaded {len(existing_ids_bq)} existing transcript IDs from BigQuery.")
-        except Exception as e:
-            logger.error(f"Critical Error: Could not load BQ IDs: {e}")
-            logger.error("Aborting to prevent duplicate data insertion.")
-            return
-
-        # Only initialize local DB for local execution
-        existing_ids_local = set()
-        if not is_cloud_run:
-            db_utils.initialize_db()
-            existing_ids_local = db_utils.get_existing_ids()
-            logger.info(f"Loaded {len(existing_ids_local)} existing transcript IDs from local database.")
-        else:
-            logger.info("Running in Cloud Run: Skipping local database operations.")
+        tuning.apply(duckdb_client.connection, settings)
 
         # Date logic
         if start_date:
@@ -72,180 +134,478 @@ def collect_transcripts(tickers_source, months=None, start_date=None):
             logger.info(f"Retrieving data since {cutoff_date}")
 
         # Read tickers
-        tickers = []
-        if isinstance(tickers_source, list):
-            tickers = tickers_source
-        elif isinstance(tickers_source, str):
-            try:
-                tickers_df = pd.read_csv(tickers_source)
-                if 'symbol' in tickers_df.columns:
-                    tickers = tickers_df['symbol'].tolist()
-                elif 'ticker' in tickers_df.columns:
-                    tickers = tickers_df['ticker'].tolist()
-                else:
-                    tickers = tickers_df.iloc[:, 0].tolist()
-            except Exception as e:
-                logger.error(f"Error reading tickers file: {e}")
-                return
+        tickers = read_tickers(tickers_source)
+        if tickers is None:
+            report.set(status='aborted', error='could not read tickers')
+            return
 
         if not tickers:
             logger.warning("No tickers found to process.")
-            return
+            return 0
+
+        # The index covers all tickers of the run, including those a resume skips
+        index_tickers = list(tickers) if index_symbols else None
+
+        # Checkpoint manifest: a resumed run continues the interrupted run's manifest
+        manifest = None
+        checkpoint_every = checkpoint.parse_granularity(checkpoint_every)
+        if checkpoint_every or resume:
+            run_id = resume or report.run_id
+            manifest = checkpoint.open_manifest(run_id, checkpoint_every or checkpoint.TICKER,
+                                                is_cloud_run, PROJECT_ID, DATASET_ID, resume=bool(resume))
+            report.set(checkpoint_run_id=run_id)
+            if resume:
+                if not manifest.tickers and not manifest.calls:
+                    logger.warning(f"No checkpoints recorded for run {resume} (completed runs are deleted); "
+                                   "processing all tickers.")
+                skipped = [t for t in tickers if t in manifest.tickers]
+                tickers = [t for t in tickers if t not in manifest.tickers]
+                report.set(resumed_from=resume, tickers_skipped=len(skipped))
+                logger.info(f"Resuming run {resume}: skipping {len(skipped)} completed tickers, "
+                            f"{len(manifest.calls)} calls already recorded.")
+                if not tickers:
+                    logger.info("All tickers of this run are already complete.")
+                    manifest.discard()
+                    return 0
+            else:
+                logger.info(f"Checkpointing run {run_id} (granularity: {checkpoint_every}); "
+                            f"an interrupted run can be continued with resume={run_id}")
 
-        tickers_str = ", ".join([f"'{t}'" for t in tickers])
         logger.info(f"Querying for {len(tickers)} tickers. First 5: {tickers[:5]}, Last 5: {tickers[-5:]}")
 
-        # Get data URL
-        url = huggingface_client.get_url_path(stock_earning_call_transcripts)
-
-        # Construct SQL query
-        sql = f"SELECT * FROM '{url}' WHERE symbol IN ({tickers_str}) AND CAST(report_date AS DATE) >= '{cutoff_date}'"
-
-        logger.info("Executing DuckDB query...")
-        result = duckdb_client.query(sql)
-
-        if result.empty:
-            logger.info("No transcripts found for the specified criteria.")
+        # Per-symbol start dates: the global cutoff, or the watermark in incremental mode
+        cutoffs = {t: cutoff_date for t in tickers}
+        if incremental:
+            try:
+                watermarks = db_cloud_utils.get_watermarks_bq(PROJECT_ID, DATASET_ID)
+            except Exception as e:
+                logger.warning(f"Could not load watermarks, scanning all tickers since {cutoff_date}: {e}")
+                watermarks = {}
+            for t in tickers:
+                if t in watermarks:
+                    watermark = datetime.date.fromisoformat(watermarks[t])
+                    cutoffs[t] = (watermark - datetime.timedelta(days=lookback_days)).strftime('%Y-%m-%d')
+            logger.info(f"Incremental mode: {sum(t in watermarks for t in tickers)} of {len(tickers)} tickers "
+                        f"have a watermark (lookback {lookback_days} days).")
+        scan_start = min(cutoffs.values())
+
+        # Always load BigQuery IDs as the primary deduplication source. Calls before
+        # scan_start can never match, so only the metadata partitions from then on are read.
+        try:
+            with report.stage('bq_id_load') as stage:
+                known_index, known_state = dedup_index.load_bq_index(PROJECT_ID, DATASET_ID, index_path, scan_start,
+                                                                     warm=warm, symbols=index_tickers)
+                stage.add(rows=len(known_index), bytes=known_index.nbytes)
+            logger.info(f"Loaded {len(known_index)} existing transcript IDs from BigQuery.")
+            if manifest is not None and manifest.calls:
+                known_index.add(list(manifest.calls))
+        except Exception as e:
+            logger.error(f"Critical Error: Could not load BQ IDs: {e}")
+            logger.error("Aborting to prevent duplicate data insertion.")
+            report.set(status='aborted', error=str(e))
             return
 
-        logger.info(f"Retrieved {len(result)} potential matches. Processing for new calls...")
-
-        metadata_rows = []
-        content_rows = []
-        new_calls_count = 0
+        # Only initialize local DB for local execution
+        existing_ids_local = dedup_index.DedupIndex()
+        if not is_cloud_run:
+            db_utils.initialize_db()
+            existing_ids_local = db_utils.get_existing_index()
+            logger.info(f"Loaded {len(existing_ids_local)} existing transcript IDs from local database.")
+        else:
+            logger.info("Running in Cloud Run: Skipping local database operations.")
 
-        for index, row in result.iterrows():
-            try:
-                # 1. Identity and Deduplication
-                id_str = f"{row['symbol']}{row['report_date']}"
-                transcript_id = hashlib.md5(id_str.encode()).hexdigest()
+        # Get data URL
+        with report.stage('hf_url_resolve'):
+            url = resolve_dataset_url(warm)
+
+        # Read from the local mirror when one is configured
+        cache = dataset_cache.from_env(cache_dir, offline)
+        if cache:
+            with report.stage('dataset_cache'):
+                source = cache.source_sql(url, tickers, scan_start)
+            if source is None:
+                logger.info("No transcripts found for the specified criteria.")
+                return 0
+        else:
+            source = f"'{url}'"
 
-                # BigQuery is the authoritative source for deduplication (both Cloud Run and local)
-                if transcript_id in existing_ids_bq:
-                    continue
+        # Deduplicate in DuckDB: anti-join the key columns against the known IDs
+        # so the large transcripts column is only read for new calls.
+        with report.stage('dedup_query') as stage:
+            candidate_count, new_symbols = find_new_calls(duckdb_client, source, cutoffs, known_index.to_arrow())
+            stage.add(rows=candidate_count)
 
+        # Refresh: stored calls whose fingerprint differs upstream are queued with the new ones
+        revised_ids = set()
+        if refresh:
+            try:
+                with report.stage('fingerprint_compare') as stage:
+                    stored = db_cloud_utils.get_fingerprints_bq(PROJECT_ID, DATASET_ID, list(cutoffs), scan_start)
+                    revised, unfingerprinted = find_revised_calls(duckdb_client, source, cutoffs, stored)
+                    stage.add(rows=stored.num_rows)
+                revised_ids = set(revised)
+                new_symbols = sorted(set(new_symbols) | set(revised.values()))
+                logger.info(f"Refresh: {len(revised_ids)} of {stored.num_rows} stored calls were revised upstream.")
+                if not unfingerprinted.empty:
+                    db_cloud_utils.record_fingerprints_bq(PROJECT_ID, DATASET_ID, unfingerprinted)
+            except Exception as e:
+                logger.error(f"Could not compare content fingerprints, only new calls are ingested: {e}")
+                report.set(refresh_error=str(e))
+            report.set(revised_calls=len(revised_ids))
+        report.set(candidate_calls=candidate_count, tickers_with_new_calls=len(new_symbols))
+
+        # Tickers without new calls are complete already; they are recorded with the first batch
+        if manifest is not None:
+            manifest.mark_tickers(sorted(set(tickers) - set(new_symbols)))
+            if not new_symbols:
+                manifest.discard()
+
+        if candidate_count == 0:
+            logger.info("No transcripts found for the specified criteria.")
+            return 0
+        if not new_symbols:
+            logger.info(f"Retrieved {candidate_count} potential matches. No new calls found to process.")
+            return 0
+
+        logger.info(f"Retrieved {candidate_count} potential matches, {len(new_symbols)} tickers with new calls.")
+
+        new_symbols_str = ", ".join([f"'{t}'" for t in new_symbols])
+        sql = f"""
+            SELECT n.transcript_id, t.*
+            FROM {source} t
+            JOIN {NEW_CALLS_TABLE} n ON t.symbol = n.symbol AND CAST(t.report_date AS VARCHAR) = n.report_date
+            WHERE t.symbol IN ({new_symbols_str}) AND CAST(t.report_date AS DATE) >= '{scan_start}'
+        """
+
+        logger.info(f"Executing DuckDB query (streaming in batches of {batch_size} transcripts)...")
+
+        # Revised calls are re-ingested calls, counted apart from the calls new to BigQuery
+        new_count = 0
+        revised_count = 0
+        if sinks is None:
+            sinks = make_sinks(is_cloud_run, bq_sink, existing_ids_local)
+            if is_cloud_run:
+                logger.info("Running in Cloud Run: Skipping local DB/Parquet writes (ephemeral storage).")
+        ingested_ids = set()
+        watermarks = {}
+        bq_rows_added = 0
+        bq_content_rows = 0
+        # New calls still to process per ticker, for progress reporting
+        pending_calls = dict(duckdb_client.connection.execute(
+            f"SELECT symbol, count(*) FROM {NEW_CALLS_TABLE} GROUP BY symbol"
+        ).fetchall())
+        # New calls per ticker not yet committed to every sink; a ticker is checkpointed at 0
+        uncommitted_calls = dict(pending_calls)
+        # Both counts are settled from the writer thread and, for dropped calls, the main thread
+        progress_lock = threading.Lock()
+
+        def settle(symbol_counts, transcript_ids=(), committed=True):
+            """Count calls as done per symbol; committed ones also bring their tickers closer to a checkpoint."""
+            with progress_lock:
+                for symbol, calls in symbol_counts.items():
+                    pending_calls[symbol] = max(0, pending_calls.get(symbol, 0) - calls)
+
+                # A failed BigQuery write leaves its tickers incomplete, so a resume redoes them
+                if manifest is not None and committed:
+                    completed = []
+                    for symbol, calls in symbol_counts.items():
+                        uncommitted_calls[symbol] = max(0, uncommitted_calls.get(symbol, 0) - calls)
+                        if uncommitted_calls[symbol] == 0:
+                            completed.append(symbol)
+                    manifest.mark_calls(list(transcript_ids))
+                    manifest.mark_tickers(completed)
+                    manifest.flush()
+                report.set(tickers_done=sum(1 for calls in pending_calls.values() if calls == 0))
+
+        def on_written(written, results):
+            # Runs on the writer thread once every sink has handled the batch
+            nonlocal bq_rows_added, bq_content_rows
+            metadata_df = written.metadata_df
+            if results.get(BigQuerySink.name):
+                # Revised calls replace rows, so only new calls grow the metadata table
+                bq_rows_added += len(metadata_df) - len(written.revised)
+                bq_content_rows += len(written)
+                known_index.add(metadata_df['transcript_id'])
+                for symbol, report_date in metadata_df.groupby('symbol')['report_date'].max().items():
+                    watermarks[symbol] = max(watermarks.get(symbol, report_date), report_date)
+
+            settle(metadata_df['symbol'].value_counts(), metadata_df['transcript_id'].tolist(),
+                   committed=results.get(BigQuerySink.name, True) is not False)
+            report.set(bq_calls_written=bq_rows_added, bq_rows_written=bq_content_rows)
+
+        # Stream the result instead of materializing it: each batch is deduplicated and
+        # flattened here while the writer thread stores the previous one in every sink.
+        # The bounded queue keeps at most a few batches in memory.
+        with SinkPipeline(sinks, on_written=on_written, report=report) as pipeline:
+            # Arrow-native sinks receive content as a pyarrow Table and never build a DataFrame for it
+            arrow_content = pipeline.accepts_arrow
+            batches = report.iter_stage('duckdb_query', stream_query(duckdb_client, sql, batch_size))
+            for batch_number, batch in enumerate(batches, start=1):
+                # BigQuery IDs were already excluded in SQL; only upstream repeats remain to drop.
                 # Note: Local DB IDs are NOT checked for skipping - this allows backfilling BQ from local runs
+                with report.stage('flatten') as stage:
+                    metadata_df, content = flatten_batch(batch, ingested_ids, arrow_content=arrow_content)
+                    stage.add(rows=len(content), bytes=batch.nbytes)
 
+                # Calls flatten_batch dropped (no transcript, upstream repeats) are done as well
+                dropped = dropped_calls(batch, metadata_df)
+                if not dropped.empty:
+                    settle(dropped)
 
-                new_calls_count += 1
-
-                # 2. Extract Metadata
-                metadata_rows.append({
-                    'transcript_id': transcript_id,
-                    'symbol': row['symbol'],
-                    'report_date': row['report_date'],
-                    'fiscal_year': row['fiscal_year'],
-                    'fiscal_quarter': row['fiscal_quarter']
-                })
-
-                # BQ Doc Init
-                bq_doc = {
-                    'transcript_id': transcript_id,
-                    'symbol': row['symbol'],
-                    'report_date': str(row['report_date']), # Ensure string for BQ DATE
-                    'fiscal_year': row['fiscal_year'],
-                    'fiscal_quarter': row['fiscal_quarter'],
-                    'content': []
-                }
-
-                # 3. Extract Content
-                transcript_raw = row['transcripts']
-
-                if isinstance(transcript_raw, str):
-                    paragraphs = ast.literal_eval(transcript_raw)
-                elif isinstance(transcript_raw, list):
-                    paragraphs = transcript_raw
-                elif hasattr(transcript_raw, 'tolist'):
-                    paragraphs = transcript_raw.tolist()
-                else:
-                    logger.warning(f"Unexpected type for transcripts: {row['symbol']} {row['report_date']} {type(transcript_raw)}")
+                if metadata_df.empty:
+                    logger.info(f"Batch {batch_number}: {batch.num_rows} rows, no new calls.")
                     continue
 
-                for p in paragraphs:
-                    p_num = p.get('paragraph_number')
-                    speaker = p.get('speaker')
-                    content_text = p.get('content')
-
-                    content_rows.append({
-                        'transcript_id': transcript_id,
-                        'paragraph_number': p_num,
-                        'speaker': speaker,
-                        'content': content_text
-                    })
+                revised = revised_ids.intersection(metadata_df['transcript_id']) if revised_ids else ()
+                new_count += len(metadata_df) - len(revised)
+                revised_count += len(revised)
+                logger.info(f"Batch {batch_number}: {batch.num_rows} rows, {len(metadata_df) - len(revised)} new calls"
+                            + (f", {len(revised)} revised calls." if refresh else "."))
+
+                # Later batches must not re-ingest a call that appears twice upstream
+                ingested_ids.update(metadata_df['transcript_id'])
+
+                pipeline.submit(SinkBatch(batch_number, metadata_df, content, revised))
+
+        logger.info(f"Processed {new_count} new calls" +
+                    (f" and {revised_count} revised calls." if refresh else "."))
+        report.set(new_calls=new_count, bq_calls_written=bq_rows_added)
+        if refresh:
+            report.set(revised_calls=revised_count)
+        if manifest is not None:
+            if any(uncommitted_calls.values()):
+                manifest.flush(force=True)
+            else:
+                manifest.discard()
 
-            except (ValueError, SyntaxError) as e:
-                logger.error(f"Error parsing transcript for {row['symbol']} on {row['report_date']}: {e}")
-                continue
+        if bq_rows_added:
+            dedup_index.save_bq_index(known_index, PROJECT_ID, DATASET_ID, known_state, bq_rows_added, index_path, warm=warm)
 
-        if new_calls_count == 0:
-            logger.info("No new calls found to process.")
-            return
+        # Advance watermarks only for calls that actually landed in BigQuery
+        try:
+            db_cloud_utils.update_watermarks_bq(PROJECT_ID, DATASET_ID, watermarks)
+        except Exception as e:
+            logger.error(f"Failed to update watermarks: {e}")
 
-        # SAVE TO LOCAL
-        # We must only write to local if it doesn't exist locally (to avoid UNIQUE constraint fail)
-        # even though we processed it for the sake of BQ.
+        return new_count + revised_count
 
-        # Check if running in Cloud Run (K_SERVICE is set automatically)
-        # is_cloud_run is already defined at top of function
+    except Exception as e:
+        report.set(status='failed', error=str(e))
+        raise
 
-        # Filter for local
-        local_metadata_rows = [r for r in metadata_rows if r['transcript_id'] not in existing_ids_local]
-        local_content_rows = [r for r in content_rows if r['transcript_id'] not in existing_ids_local]
+    finally:
+        if cache:
+            # Its partitions may be evicted once no query reads them
+            cache.release()
+        if warm:
+            release_client(settings['threads'], duckdb_client, reuse=report.counters.get('status') != 'failed')
+        else:
+            try:
+                duckdb_client.close()
+            except Exception:
+                pass
+        if report.counters.get('status') == 'running':
+            report.set(status='ok')
+        report.finish()
+        instrumentation.log_report(report)
 
-        if not is_cloud_run and local_metadata_rows:
-            logger.info(f"Saving {len(local_metadata_rows)} new calls to SQLite and CSV...")
-            metadata_df = pd.DataFrame(local_metadata_rows).drop_duplicates()
-            content_df = pd.DataFrame(local_content_rows)
 
-            db_utils.insert_metadata(metadata_df)
-            db_utils.insert_content(content_df)
+def read_tickers(tickers_source):
+    """
+    Resolve tickers_source (path to CSV or list of tickers) to a list of symbols.
+    Returns None if the CSV cannot be read.
+    """
+    if isinstance(tickers_source, list):
+        return tickers_source
+    if isinstance(tickers_source, str):
+        try:
+            tickers_df = pd.read_csv(tickers_source)
+            if 'symbol' in tickers_df.columns:
+                return tickers_df['symbol'].tolist()
+            elif 'ticker' in tickers_df.columns:
+                return tickers_df['ticker'].tolist()
+            else:
+                return tickers_df.iloc[:, 0].tolist()
+        except Exception as e:
+            logger.error(f"Error reading tickers file: {e}")
+            return None
+    return []
 
-            # Save to CSVs (Append mode)
-            metadata_file = 'transcripts_metadata.csv'
-            content_file = 'transcripts_content.csv'
+def resolve_dataset_url(warm=False):
+    """URL of the transcripts dataset; with warm, resolved once per warm cache TTL."""
+    resolve = lambda: HuggingFaceClient().get_url_path(stock_earning_call_transcripts)
+    return _dataset_urls.get_or_create(stock_earning_call_transcripts, resolve) if warm else resolve()
 
-            if os.path.exists(metadata_file):
-                metadata_df.to_csv(metadata_file, mode='a', header=False, index=False)
-            else:
-                metadata_df.to_csv(metadata_file, index=False)
+def release_client(threads, duckdb_client, reuse=True):
+    """Return a DuckDB client to the warm pool, dropping this run's temp tables first."""
+    try:
+        duckdb_client.connection.execute(f"DROP TABLE IF EXISTS {NEW_CALLS_TABLE}")
+    except Exception:
+        reuse = False
+    _duckdb_clients.release(threads, duckdb_client, reuse=reuse)
+
+def make_bq_writer(bq_sink='load'):
+    """Return the BigQuery writer for bq_sink ('load', 'storage' or an existing writer object)."""
+    if bq_sink == 'load':
+        return BigQueryWriter(PROJECT_ID, DATASET_ID)
+    if bq_sink == 'storage':
+        return StorageWriteSink(PROJECT_ID, DATASET_ID)
+    if isinstance(bq_sink, str):
+        raise ValueError(f"Unknown bq_sink '{bq_sink}', expected one of {BQ_SINKS}")
+    return bq_sink
+
+def make_sinks(is_cloud_run, bq_sink='load', existing_ids_local=None):
+    """
+    Sinks a run writes to: BigQuery always, plus SQLite and the Parquet export
+    for local runs (skipping calls already in the local database).
+    """
+    sink_list = [BigQuerySink(make_bq_writer(bq_sink))]
+    if not is_cloud_run:
+        sink_list += [SQLiteSink(existing_ids_local), ParquetSink(existing_ids_local)]
+    return sink_list
 
-            if os.path.exists(content_file):
-                content_df.to_csv(content_file, mode='a', header=False, index=False)
-            else:
-                content_df.to_csv(content_file, index=False)
-        elif is_cloud_run:
-            logger.info("Running in Cloud Run: Skipping local DB/CSV writes (ephemeral storage).")
-        else:
-            logger.info("All processed calls already exist in local DB (skipping local write).")
+def find_new_calls(duckdb_client, source, cutoffs, known_ids):
+    """
+    Scan only the key columns of source (a DuckDB table expression), compute
+    transcript IDs in SQL and anti-join them against known_ids (a pyarrow
+    Table of 16-byte MD5 digests, see DedupIndex.to_arrow).
+    cutoffs: {symbol: 'YYYY-MM-DD'}, the first report_date to consider per symbol.
+    The surviving calls are left in the NEW_CALLS_TABLE temp table.
+    Returns (number of candidate calls, sorted list of symbols with new calls).
+    """
+    connection = duckdb_client.connection
+    tickers_str = ", ".join([f"'{t}'" for t in cutoffs])
+    scan_start = min(cutoffs.values())
+    cutoffs_table = pa.table({
+        'symbol': pa.array(list(cutoffs.keys()), type=pa.string()),
+        'cutoff_date': pa.array([datetime.date.fromisoformat(d) for d in cutoffs.values()], type=pa.date32()),
+    })
+
+    connection.register(KNOWN_IDS_TABLE, known_ids)
+    connection.register(CUTOFFS_TABLE, cutoffs_table)
+    try:
+        connection.execute(f"""
+            CREATE OR REPLACE TEMP TABLE candidate_calls AS
+            SELECT DISTINCT
+                md5(t.symbol || CAST(t.report_date AS VARCHAR)) AS transcript_id,
+                t.symbol,
+                CAST(t.report_date AS VARCHAR) AS report_date
+            FROM {source} t
+            JOIN {CUTOFFS_TABLE} c ON t.symbol = c.symbol
+            WHERE t.symbol IN ({tickers_str})
+              AND CAST(t.report_date AS DATE) >= '{scan_start}'
+              AND CAST(t.report_date AS DATE) >= c.cutoff_date
+        """)
+        connection.execute(f"""
+            CREATE OR REPLACE TEMP TABLE {NEW_CALLS_TABLE} AS
+            SELECT c.*
+            FROM candidate_calls c
+            ANTI JOIN {KNOWN_IDS_TABLE} k ON unhex(c.transcript_id) = k.digest
+        """)
+        candidate_count = connection.execute("SELECT count(*) FROM candidate_calls").fetchone()[0]
+        new_symbols = [r[0] for r in connection.execute(f"SELECT DISTINCT symbol FROM {NEW_CALLS_TABLE} ORDER BY symbol").fetchall()]
+        connection.execute("DROP TABLE candidate_calls")
+    finally:
+        connection.unregister(KNOWN_IDS_TABLE)
+        connection.unregister(CUTOFFS_TABLE)
 
-        # SAVE TO BQ
-        if metadata_rows:
-            logger.info(f"Saving {len(metadata_rows)} new calls to BigQuery...")
-            try:
-                 # Since we controlled the loop using existing_ids_bq, everything in metadata_rows
-                 # is strictly NEW for BigQuery. We can write it all.
+    return candidate_count, new_symbols
 
-                 bq_metadata_df = pd.DataFrame(metadata_rows).drop_duplicates()
-                 # Ensure report_date is proper datetime for BigQuery/PyArrow
-                 if not bq_metadata_df.empty:
-                     bq_metadata_df['report_date'] = pd.to_datetime(bq_metadata_df['report_date'])
+def fingerprint_sql(duckdb_client, source, alias='t'):
+    """
+    SQL expression for the content fingerprint of a call (row `alias` of source), the
+    same value flatten.content_fingerprints stores: '<paragraph count>-<md5 of the texts>'.
+    Any edited, added or removed paragraph changes it. MD5 rather than DuckDB's hash()
+    because fingerprints are stored and hash() may change between versions.
+    Raises ValueError for snapshots storing the paragraph list as a string.
+    """
+    column_type = duckdb_client.connection.execute(f"DESCRIBE SELECT transcripts FROM {source}").fetchone()[1]
+    if not column_type.endswith('[]'):
+        raise ValueError(f"Cannot fingerprint transcripts stored as {column_type} in DuckDB")
+    return (f"len({alias}.transcripts) || '-' || "
+            f"md5(array_to_string(list_transform({alias}.transcripts, p -> coalesce(p.content, '')), ''))")
 
-                 bq_content_df = pd.DataFrame(content_rows)
+def find_revised_calls(duckdb_client, source, cutoffs, stored):
+    """
+    Compare the content fingerprints of source's calls with stored, a pyarrow Table
+    (transcript_id, content_fingerprint) of the stored calls. Only the fingerprints
+    leave DuckDB. Revised calls are added to the NEW_CALLS_TABLE temp table (see find_new_calls).
+    Returns ({transcript_id: symbol} of revised calls, DataFrame (transcript_id,
+    report_date, content_fingerprint) of stored calls without a fingerprint yet).
+    """
+    connection = duckdb_client.connection
+    fingerprint = fingerprint_sql(duckdb_client, source)
+    tickers_str = ", ".join([f"'{t}'" for t in cutoffs])
+    scan_start = min(cutoffs.values())
+    cutoffs_table = pa.table({
+        'symbol': pa.array(list(cutoffs.keys()), type=pa.string()),
+        'cutoff_date': pa.array([datetime.date.fromisoformat(d) for d in cutoffs.values()], type=pa.date32()),
+    })
+
+    connection.register(STORED_FINGERPRINTS_TABLE, stored)
+    connection.register(CUTOFFS_TABLE, cutoffs_table)
+    try:
+        # A call repeated upstream keeps one fingerprint, so the comparison is stable
+        connection.execute(f"""
+            CREATE OR REPLACE TEMP TABLE changed_calls AS
+            SELECT u.*, s.content_fingerprint IS NULL AS unfingerprinted
+            FROM (
+                SELECT
+                    md5(t.symbol || CAST(t.report_date AS VARCHAR)) AS transcript_id,
+                    t.symbol,
+                    CAST(t.report_date AS VARCHAR) AS report_date,
+                    min({fingerprint}) AS content_fingerprint
+                FROM {source} t
+                JOIN {CUTOFFS_TABLE} c ON t.symbol = c.symbol
+                WHERE t.symbol IN ({tickers_str})
+                  AND CAST(t.report_date AS DATE) >= '{scan_start}'
+                  AND CAST(t.report_date AS DATE) >= c.cutoff_date
+                  AND t.transcripts IS NOT NULL
+                GROUP BY ALL
+            ) u
+            JOIN {STORED_FINGERPRINTS_TABLE} s ON s.transcript_id = u.transcript_id
+            WHERE s.content_fingerprint IS DISTINCT FROM u.content_fingerprint
+        """)
+        connection.execute(f"""
+            INSERT INTO {NEW_CALLS_TABLE}
+            SELECT transcript_id, symbol, report_date FROM changed_calls WHERE NOT unfingerprinted
+        """)
+        revised = dict(connection.execute(
+            "SELECT transcript_id, symbol FROM changed_calls WHERE NOT unfingerprinted"
+        ).fetchall())
+        unfingerprinted = connection.execute(
+            "SELECT transcript_id, report_date, content_fingerprint FROM changed_calls WHERE unfingerprinted"
+        ).df()
+        connection.execute("DROP TABLE changed_calls")
+    finally:
+        connection.unregister(STORED_FINGERPRINTS_TABLE)
+        connection.unregister(CUTOFFS_TABLE)
 
-                 if not bq_metadata_df.empty:
-                     db_cloud_utils.insert_metadata_bq(PROJECT_ID, DATASET_ID, bq_metadata_df)
-                     db_cloud_utils.insert_content_bq(PROJECT_ID, DATASET_ID, bq_content_df)
-                     logger.info(f"Saved {len(bq_metadata_df)} calls to BigQuery.")
+    return revised, unfingerprinted
 
-            except Exception as e:
-                logger.error(f"Failed to save to BigQuery: {e}")
+def dropped_calls(batch, metadata_df):
+    """Calls per symbol in a streamed batch that flatten_batch did not keep."""
+    streamed = batch.column('symbol').to_pandas().value_counts()
+    dropped = streamed.sub(metadata_df['symbol'].value_counts(), fill_value=0)
+    return dropped[dropped > 0].astype(int)
 
-    finally:
-        try:
-            duckdb_client.close()
-        except Exception:
-            pass
+def stream_query(duckdb_client, sql, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Execute sql on the client's DuckDB connection and yield the result as
+    pyarrow RecordBatches of at most batch_size rows.
+    """
+    connection = duckdb_client.connection
+    # Row order is irrelevant for ingestion and keeping it forces DuckDB to buffer
+    connection.execute("SET preserve_insertion_order = false")
+    result = connection.execute(sql)
+    if hasattr(result, 'to_arrow_reader'):
+        reader = result.to_arrow_reader(batch_size)
+    else:
+        reader = result.fetch_record_batch(batch_size)
 
+    for batch in reader:
+        if batch.num_rows:
+            yield batch
 
 if __name__ == "__main__":
     # Argument parsing
@@ -253,6 +613,20 @@ if __name__ == "__main__":
     parser.add_argument('--tickers', type=str, default='tickers.csv', help='Path to CSV file containing tickers')
     parser.add_argument('--months', type=int, help='Number of months back to retrieve data for')
     parser.add_argument('--start_date', type=str, help='Start date in YYYY-MM-DD format')
+    parser.add_argument('--batch_size', type=int, help='Transcripts processed per streamed batch (default: sized to available memory)')
+    parser.add_argument('--threads', type=int, help='DuckDB threads (default: CPU quota)')
+    parser.add_argument('--memory_limit', type=str, help='DuckDB memory limit, e.g. 2GB (default: derived from the memory limit)')
+    parser.add_argument('--cache_dir', type=str, help='Directory for the local mirror of the transcripts dataset')
+    parser.add_argument('--offline', action='store_true', help='Only read the local mirror / TRANSCRIPT_CACHE_FIXTURE, never the network')
+    parser.add_argument('--incremental', action='store_true', help='Only scan report dates after each ticker\'s stored watermark')
+    parser.add_argument('--lookback_days', type=int, default=DEFAULT_LOOKBACK_DAYS, help='Days re-scanned before each watermark in incremental mode')
+    parser.add_argument('--bq_sink', choices=BQ_SINKS, default='load', help='BigQuery sink: Parquet load jobs or the Storage Write API')
+    parser.add_argument('--profile', choices=instrumentation.PROFILE_MODES, help='Profile the run (writes to profiles/)')
+    parser.add_argument('--trace_memory', action='store_true', help='Record per-stage Python allocation peaks with tracemalloc (slower)')
+    parser.add_argument('--checkpoint', type=str, default=checkpoint.DEFAULT_GRANULARITY, help="Checkpoint granularity: 'ticker', a number of transcripts, or 'off' (default)")
+    parser.add_argument('--resume', type=str, help='Run ID of an interrupted run to continue (skips its completed tickers)')
+    parser.add_argument('--refresh', action='store_true', help='Also re-ingest stored calls whose transcript changed upstream')
+    parser.add_argument('--report_path', type=str, help='Also write the JSON run report to this file')
     parser.add_argument('--run_local', action='store_true', help='Explicitly enable local execution')
     args = parser.parse_args()
 
@@ -263,4 +637,16 @@ if __name__ == "__main__":
         import sys
         sys.exit(1)
 
-    collect_transcripts(args.tickers, args.months, args.start_date)
+    run_report = instrumentation.RunReport(trace_memory=args.trace_memory)
+    with instrumentation.profiled(args.profile):
+        collect_transcripts(args.tickers, args.months, args.start_date, args.batch_size,
+                            cache_dir=args.cache_dir, offline=args.offline or None,
+                            incremental=args.incremental, lookback_days=args.lookback_days, bq_sink=args.bq_sink,
+                            threads=args.threads, memory_limit=args.memory_limit,
+                            checkpoint_every=args.checkpoint, resume=args.resume, refresh=args.refresh,
+                            report=run_report)
+
+    if args.report_path:
+        import json
+        with open(args.report_path, 'w') as f:
+            json.dump(run_report.to_dict(), f, indent=2)
@@ -0,0 +1,15 @@
+import os
+import sys
+import pytest
+
+# The modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def local_db(tmp_path, monkeypatch):
+    """db_utils pointed at a fresh database file; yields its initialize_db()."""
+    import db_utils
+    monkeypatch.setattr(db_utils, 'DB_NAME', str(tmp_path / 'transcripts.db'))
+    db_utils.close_connection()
+    yield db_utils.initialize_db
+    db_utils.close_connection()
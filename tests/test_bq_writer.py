@@ -0,0 +1,101 @@
+import pandas as pd
+import pytest
+from google.api_core import exceptions as gexc
+from google.cloud import bigquery
+import bq_writer
+import db_cloud_utils
+
+class FakeJob:
+    def __init__(self, job_id, error=None):
+        self.job_id = job_id
+        self.error = error
+        self.error_result = {'reason': 'backendError'} if error else None
+
+    def result(self):
+        if self.error:
+            raise self.error
+        return self
+
+class FakeClient:
+    """Load jobs fail once per scripted outcome: 'failed' (the job ran and failed) or 'timeout' (unknown)."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.jobs = {}
+        self.requests = []
+
+    def load_table_from_file(self, buffer, table_id, job_id=None, job_config=None):
+        self.requests.append(job_id)
+        if job_id in self.jobs:
+            raise gexc.Conflict(f"Already Exists: Job {job_id}")
+        outcome = self.outcomes.pop(0) if self.outcomes else 'ok'
+        if outcome == 'failed':
+            self.jobs[job_id] = FakeJob(job_id, gexc.InternalServerError("backendError"))
+            return self.jobs[job_id]
+        self.jobs[job_id] = FakeJob(job_id)
+        if outcome == 'timeout':
+            # The job was created, but the response never arrived
+            raise TimeoutError("read timed out")
+        return self.jobs[job_id]
+
+    def get_job(self, job_id):
+        return self.jobs[job_id]
+
+@pytest.fixture
+def writer(monkeypatch):
+    monkeypatch.setattr(bq_writer.time, 'sleep', lambda seconds: None)
+    def make(outcomes):
+        client = FakeClient(outcomes)
+        monkeypatch.setattr(db_cloud_utils, 'get_client', lambda project_id: client)
+        return bq_writer.BigQueryWriter('p', 'd'), client
+    return make
+
+CHUNK = pd.DataFrame({'transcript_id': ['a', 'b']})
+
+def test_failed_load_job_is_retried_under_a_new_id(writer):
+    w, client = writer(['failed', 'failed'])
+    w._load_chunk('p.d.staging', CHUNK, 'load_x')
+    assert client.requests == ['load_x', 'load_x_a1', 'load_x_a2']
+
+def test_ambiguous_load_waits_for_the_same_job(writer):
+    w, client = writer(['timeout'])
+    w._load_chunk('p.d.staging', CHUNK, 'load_x')
+    # The retry finds the job the timed-out request created and does not load again
+    assert client.requests == ['load_x', 'load_x']
+    assert list(client.jobs) == ['load_x']
+
+class FakeTable:
+    schema = [bigquery.SchemaField('transcript_id', 'STRING', mode='REQUIRED')]
+
+class CommitClient(FakeClient):
+    def __init__(self):
+        super().__init__([])
+        self.queries, self.dropped = [], []
+
+    def get_table(self, table_id):
+        return FakeTable()
+
+    def create_table(self, table, exists_ok=False):
+        return table
+
+    def query(self, sql):
+        self.queries.append(sql)
+        return FakeJob(None)
+
+    def delete_table(self, table_id, not_found_ok=False):
+        self.dropped.append(table_id)
+
+def test_staged_content_is_committed_with_the_metadata(monkeypatch):
+    client = CommitClient()
+    monkeypatch.setattr(db_cloud_utils, 'get_client', lambda project_id: client)
+    w = bq_writer.BigQueryWriter('p', 'd')
+    w._content_mode, w._metadata_columns = 'inline', ['transcript_id', 'report_date']
+    metadata_df = pd.DataFrame({'transcript_id': ['a'], 'report_date': ['2024-01-02']})
+
+    w.write(metadata_df, None, staged_content=('p.d._staging_streamed', ['transcript_id', 'content']))
+
+    [commit] = client.queries
+    assert 'FROM `p.d._staging_streamed`' in commit and 'NOT IN' in commit
+    assert commit.index('BEGIN TRANSACTION') < commit.index('_staging_streamed') < commit.index('COMMIT TRANSACTION')
+    # The caller's staging table is left to the caller; the metadata staging table is dropped
+    assert 'p.d._staging_streamed' not in client.dropped and len(client.dropped) == 1
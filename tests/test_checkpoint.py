@@ -0,0 +1,58 @@
+import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+import benchmark
+import instrumentation
+import sql_get
+
+TICKERS = ['SYM0000', 'SYM0001', 'SYM0002']
+
+def write_dataset(path):
+    rows = []
+    for symbol in TICKERS:
+        for q in range(2):
+            report_date = datetime.date.today() - datetime.timedelta(days=91 * (q + 1))
+            rows.append({
+                'symbol': symbol, 'fiscal_year': report_date.year, 'fiscal_quarter': (report_date.month - 1) // 3 + 1,
+                'report_date': report_date.isoformat(),
+                'transcripts': [{'paragraph_number': 1, 'speaker': 'Operator', 'content': f"{symbol} call {q}"}],
+            })
+    # A call upstream without a transcript: flatten_batch drops it
+    rows[0]['transcripts'] = None
+    pq.write_table(pa.Table.from_pylist(rows, schema=benchmark.DATASET_SCHEMA), path)
+    return path
+
+class FlakyBigQuery(benchmark.InMemoryBigQuery):
+    def __init__(self, failing=()):
+        super().__init__()
+        self.failing = set(failing)
+
+    def write(self, metadata_df, content_df, replace=False):
+        if self.failing.intersection(metadata_df['symbol']):
+            raise RuntimeError("load job failed")
+        super().write(metadata_df, content_df, replace=replace)
+
+def collect(dataset, bigquery, **kwargs):
+    report = instrumentation.RunReport()
+    with benchmark.stand_ins(dataset, bigquery):
+        sql_get.collect_transcripts(list(TICKERS), start_date='1900-01-01', batch_size=1, threads=1,
+                                    bq_sink=bigquery, checkpoint_every='ticker', report=report, **kwargs)
+    return report
+
+def test_resume_after_failed_write_and_cleanup(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('K_SERVICE', 'test')
+    dataset = write_dataset(str(tmp_path / 'transcripts.parquet'))
+
+    bigquery = FlakyBigQuery(failing=['SYM0002'])
+    report = collect(dataset, bigquery)
+    run_id = report.counters['checkpoint_run_id']
+    # SYM0000 is complete although one of its calls was dropped; SYM0002's write failed
+    assert sorted(bigquery.get_checkpoints(None, None, run_id)) == [('ticker', 'SYM0000'), ('ticker', 'SYM0001')]
+
+    bigquery.failing.clear()
+    report = collect(dataset, bigquery, resume=run_id)
+    assert report.counters['tickers_skipped'] == 2
+    assert report.counters['new_calls'] == 2
+    # The completed run's manifest is deleted
+    assert bigquery.checkpoints == []
@@ -0,0 +1,39 @@
+import pandas as pd
+import pyarrow as pa
+import content_store
+import db_utils
+
+CONTENT = pd.DataFrame({
+    'transcript_id': ['a', 'a', 'a', 'b', 'b'],
+    'paragraph_number': [1, 2, 3, 1, 2],
+    'speaker': ['Operator', 'CEO', 'CFO', 'Operator', 'CEO'],
+    'content': ['Welcome to the call.', 'Revenue grew.', None, 'Welcome to the call.', 'Margins fell.'],
+})
+
+def test_split_content_uses_content_hash():
+    refs, texts = content_store.split_content(CONTENT)
+    assert refs['content_hash'].tolist() == [content_store.content_hash(t) for t in CONTENT['content']]
+    # Repeated texts are stored once, missing text not at all
+    assert texts['content'].tolist() == ['Welcome to the call.', 'Revenue grew.', 'Margins fell.']
+
+    arrow_refs, arrow_texts = content_store.split_content(pa.Table.from_pandas(CONTENT))
+    assert arrow_refs.column('content_hash').to_pylist() == refs['content_hash'].tolist()
+    assert arrow_texts.to_pandas().equals(texts)
+
+def test_split_content_leaves_out_known_hashes():
+    known = {content_store.content_hash('Welcome to the call.')}
+    refs, texts = content_store.split_content(CONTENT, known)
+    assert len(refs) == len(CONTENT)
+    assert texts['content'].tolist() == ['Revenue grew.', 'Margins fell.']
+
+def test_normalized_content_round_trips_through_the_view(local_db):
+    assert local_db('normalized') == 'normalized'
+    metadata_df = pd.DataFrame({'transcript_id': ['a', 'b'], 'symbol': 'AAPL', 'report_date': '2024-01-30',
+                                'fiscal_year': 2024, 'fiscal_quarter': 1})
+    db_utils.insert_batch(metadata_df, CONTENT)
+
+    conn = db_utils.get_connection()
+    stored = pd.read_sql("SELECT transcript_id, paragraph_number, speaker, content FROM transcript_content "
+                         "ORDER BY transcript_id, paragraph_number", conn)
+    pd.testing.assert_frame_equal(stored, CONTENT, check_dtype=False)
+    assert conn.execute("SELECT COUNT(*) FROM paragraph_text").fetchone()[0] == 3
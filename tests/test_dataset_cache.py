@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+import threading
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+import dataset_cache
+
+def write_fixture(path, symbols, years):
+    rows = [(s, f"{y}-0{q}-15", y, q) for s in symbols for y in years for q in (1, 2)]
+    pq.write_table(pa.table({
+        'symbol': [r[0] for r in rows],
+        'report_date': [r[1] for r in rows],
+        'fiscal_year': [r[2] for r in rows],
+        'fiscal_quarter': [r[3] for r in rows],
+        'transcripts': [f"transcript {r}" for r in rows],
+    }), path)
+
+def test_shards_share_one_cache_dir(tmp_path, caplog):
+    fixture = str(tmp_path / 'upstream.parquet')
+    write_fixture(fixture, ['AAPL', 'MSFT', 'NVDA', 'GOOG'], [2023, 2024])
+    cache_dir = str(tmp_path / 'cache')
+    shards = [['AAPL', 'NVDA'], ['MSFT', 'GOOG']]
+    results, errors = {}, []
+
+    # Each shard process builds its own DatasetCache on the shared directory
+    def run(i):
+        try:
+            cache = dataset_cache.DatasetCache(cache_dir, fixture=fixture)
+            results[i] = cache.source_sql(None, shards[i], '2023-01-01')
+        except Exception as e:
+            errors.append(e)
+
+    with caplog.at_level(logging.INFO, logger='dataset_cache'):
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(shards))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert errors == []
+    with open(os.path.join(cache_dir, dataset_cache.MANIFEST_FILE)) as f:
+        partitions = json.load(f)['partitions']
+    # Neither shard's partitions were lost from the manifest
+    assert sorted(k for k, p in partitions.items() if p['present']) == \
+        sorted(f"{s}/{y}" for s in ['AAPL', 'MSFT', 'NVDA', 'GOOG'] for y in (2023, 2024))
+    for i, shard in enumerate(shards):
+        for symbol in shard:
+            assert f"symbol={symbol}" in results[i]
+    assert not os.path.exists(os.path.join(cache_dir, '.staging'))
+
+def test_eviction_keeps_partitions_in_use(tmp_path):
+    fixture = str(tmp_path / 'upstream.parquet')
+    write_fixture(fixture, ['AAPL', 'MSFT'], [2024])
+    cache_dir = str(tmp_path / 'cache')
+    reader = dataset_cache.DatasetCache(cache_dir, fixture=fixture)
+    reader.source_sql(None, ['AAPL'], '2024-01-01')
+
+    # Another process, with a tiny cap, reads MSFT while AAPL is still being read
+    cache = dataset_cache.DatasetCache(cache_dir, max_bytes=1, fixture=fixture)
+    cache.source_sql(None, ['MSFT'], '2024-01-01')
+    assert cache.manifest['partitions']['AAPL/2024']['present']
+
+    # Once the reader is done, AAPL is the least recently used and goes
+    reader.release()
+    cache.source_sql(None, ['MSFT'], '2024-01-01')
+    assert not cache.manifest['partitions']['AAPL/2024']['present']
+    assert cache.manifest['partitions']['MSFT/2024']['present']
+
+def test_evicted_partitions_are_fetched_without_a_full_refresh(tmp_path, monkeypatch):
+    fixture = str(tmp_path / 'upstream.parquet')
+    write_fixture(fixture, ['AAPL', 'MSFT'], [2023, 2024])
+    cache_dir = str(tmp_path / 'cache')
+    cache = dataset_cache.DatasetCache(cache_dir, max_bytes=1, fixture=fixture)
+    cache.source_sql(None, ['AAPL'], '2023-01-01')
+    cache.release()
+    cache.source_sql(None, ['MSFT'], '2023-01-01')
+    cache.release()
+    assert not cache.manifest['partitions']['AAPL/2024']['present']
+
+    def full_refresh(*args, **kwargs):
+        raise AssertionError("upstream is unchanged; only the missing partitions should be read")
+    monkeypatch.setattr(dataset_cache.DatasetCache, 'refresh', full_refresh)
+    source = cache.source_sql(None, ['AAPL'], '2023-01-01')
+    assert cache.manifest['partitions']['AAPL/2024']['present']
+    assert duckdb.sql(f"SELECT count(*) FROM {source}").fetchone()[0] == 4
+
+def test_leases_of_dead_readers_are_dropped(tmp_path):
+    fixture = str(tmp_path / 'upstream.parquet')
+    write_fixture(fixture, ['AAPL', 'MSFT'], [2024])
+    cache_dir = str(tmp_path / 'cache')
+    readers = os.path.join(cache_dir, dataset_cache.READERS_DIR)
+    os.makedirs(readers)
+    # Left behind by a process that died mid-run: nobody holds its lock
+    with open(os.path.join(readers, 'dead.json'), 'w') as f:
+        json.dump(['AAPL/2024'], f)
+
+    cache = dataset_cache.DatasetCache(cache_dir, max_bytes=1, fixture=fixture)
+    cache.source_sql(None, ['AAPL'], '2024-01-01')
+    cache.release()
+    cache.source_sql(None, ['MSFT'], '2024-01-01')
+    assert not cache.manifest['partitions']['AAPL/2024']['present']
+    assert not os.path.exists(os.path.join(readers, 'dead.json'))
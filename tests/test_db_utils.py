@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+import db_utils
+
+def calls(ids, text='Revenue grew.'):
+    metadata_df = pd.DataFrame({'transcript_id': ids, 'symbol': 'AAPL', 'report_date': '2024-01-30',
+                                'fiscal_year': 2024, 'fiscal_quarter': 1, 'content_fingerprint': None})
+    content_df = pd.DataFrame({
+        'transcript_id': [t for t in ids for _ in range(2)],
+        'paragraph_number': [1, 2] * len(ids),
+        'speaker': 'CEO',
+        'content': [f"{t}: {text}" if p == 1 else None for t in ids for p in (1, 2)],
+    })
+    return metadata_df, content_df
+
+def stored(conn):
+    metadata = conn.execute("SELECT transcript_id, report_date FROM transcript_metadata ORDER BY 1").fetchall()
+    content = conn.execute("SELECT transcript_id, paragraph_number, content FROM transcript_content ORDER BY 1, 2").fetchall()
+    return metadata, content
+
+@pytest.mark.parametrize('content_mode', ['inline', 'normalized'])
+def test_reinserting_a_batch_is_a_no_op(local_db, content_mode):
+    local_db(content_mode)
+    db_utils.insert_batch(*calls(['a', 'b']))
+    conn = db_utils.get_connection()
+    first = stored(conn)
+
+    db_utils.insert_batch(*calls(['a', 'b'], text='Changed upstream.'))
+    assert stored(conn) == first
+    assert first[0] == [('a', '2024-01-30'), ('b', '2024-01-30')]
+    assert first[1] == [('a', 1, 'a: Revenue grew.'), ('a', 2, None), ('b', 1, 'b: Revenue grew.'), ('b', 2, None)]
+    assert db_utils.get_existing_ids() == {'a', 'b'}
+
+@pytest.mark.parametrize('content_mode', ['inline', 'normalized'])
+def test_replace_swaps_a_call_in_one_transaction(local_db, content_mode):
+    local_db(content_mode)
+    db_utils.insert_batch(*calls(['a', 'b']))
+    db_utils.insert_batch(*calls(['a'], text='Revised.'), replace=['a'])
+
+    _, content = stored(db_utils.get_connection())
+    assert [row for row in content if row[0] == 'a'] == [('a', 1, 'a: Revised.'), ('a', 2, None)]
+    assert [row for row in content if row[0] == 'b'] == [('b', 1, 'b: Revenue grew.'), ('b', 2, None)]
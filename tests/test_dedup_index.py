@@ -0,0 +1,121 @@
+import hashlib
+import os
+import threading
+import numpy as np
+import pyarrow as pa
+import pytest
+import db_cloud_utils
+import dedup_index
+
+def tid(n):
+    return hashlib.md5(f"SYM{n}".encode()).hexdigest()
+
+class FakeMetadataTable:
+    def __init__(self, ids):
+        self.ids = list(ids)
+        self.scans = 0
+
+    def count(self, project_id, dataset_id, start_date=None, symbols=None):
+        return len(self._select(symbols))
+
+    def ids_table(self, project_id, dataset_id, start_date=None, symbols=None):
+        self.scans += 1
+        return pa.table({'transcript_id': pa.array(self._select(symbols), type=pa.string())})
+
+    def _select(self, symbols):
+        return [i for i in self.ids if symbols is None or self.symbols[i] in symbols]
+
+    @property
+    def symbols(self):
+        return {i: f"S{int(i, 16) % 2}" for i in self.ids}
+
+@pytest.fixture
+def table(monkeypatch):
+    table = FakeMetadataTable(tid(n) for n in range(100))
+    monkeypatch.setattr(db_cloud_utils, 'count_metadata_rows_bq', table.count)
+    monkeypatch.setattr(db_cloud_utils, 'get_existing_ids_table_bq', table.ids_table)
+    return table
+
+def test_index_survives_own_writes(table, tmp_path):
+    path = str(tmp_path / 'index.npy')
+    index, state = dedup_index.load_bq_index('p', 'd', path, '2024-01-01')
+    assert len(index) == 100 and table.scans == 1
+
+    # This run's writes (e.g. through the Storage Write API) are recorded with the index
+    new_ids = [tid(n) for n in range(100, 110)]
+    table.ids += new_ids
+    index.add(new_ids)
+    dedup_index.save_bq_index(index, 'p', 'd', state, len(new_ids), path)
+
+    index, state = dedup_index.load_bq_index('p', 'd', path, '2024-06-01')
+    assert table.scans == 1
+    assert len(index) == 110 and state['rows'] == 110
+
+def test_outside_writes_and_wider_windows_rebuild(table, tmp_path):
+    path = str(tmp_path / 'index.npy')
+    dedup_index.load_bq_index('p', 'd', path, '2024-01-01')
+    table.ids.append(tid(500))
+    index, _ = dedup_index.load_bq_index('p', 'd', path, '2024-01-01')
+    assert table.scans == 2 and index.contains([tid(500)]).all()
+
+    dedup_index.load_bq_index('p', 'd', path, '2023-01-01')
+    dedup_index.load_bq_index('p', 'other', path, '2024-01-01')
+    assert table.scans == 4
+
+def test_shards_keep_separate_indexes(table, tmp_path):
+    paths = {s: str(tmp_path / f"index.{s}.npy") for s in ('S0', 'S1')}
+    loaded = {s: dedup_index.load_bq_index('p', 'd', paths[s], None, symbols=[s]) for s in paths}
+    assert table.scans == 2
+    assert sum(len(index) for index, _ in loaded.values()) == 100
+
+    # Both shards write, each saving only its own rows
+    for s, (index, state) in loaded.items():
+        new_ids = [i for i in (tid(n) for n in range(100, 120)) if f"S{int(i, 16) % 2}" == s]
+        table.ids += new_ids
+        index.add(new_ids)
+        dedup_index.save_bq_index(index, 'p', 'd', state, len(new_ids), paths[s])
+
+    for s in paths:
+        dedup_index.load_bq_index('p', 'd', paths[s], None, symbols=[s])
+    assert table.scans == 2
+
+def test_torn_save_is_detected(table, tmp_path, caplog):
+    path = str(tmp_path / 'index.npy')
+    dedup_index.load_bq_index('p', 'd', path, '2024-01-01')
+    np.save(path, np.empty(0, dtype=dedup_index.DIGEST_DTYPE))
+
+    index, _ = dedup_index.load_bq_index('p', 'd', path, '2024-01-01')
+    assert table.scans == 2 and len(index) == 100
+    assert 'interrupted save' in caplog.text
+
+def test_concurrent_saves_in_one_process(table, tmp_path):
+    path = str(tmp_path / 'index.npy')
+    index, state = dedup_index.load_bq_index('p', 'd', path, '2024-01-01')
+    errors = []
+
+    def save():
+        try:
+            for _ in range(20):
+                dedup_index.save_bq_index(index, 'p', 'd', state, 0, path)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(os.listdir(tmp_path)) == ['index.npy', 'index.npy.json']
+    loaded, _ = dedup_index.DedupIndex.load(path)
+    assert len(loaded) == 100
+
+def test_failed_save_does_not_fail_the_run(table, tmp_path, monkeypatch, caplog):
+    path = str(tmp_path / 'index.npy')
+    index, state = dedup_index.load_bq_index('p', 'd', path, '2024-01-01')
+    def disk_full(*args):
+        raise OSError("No space left on device")
+    monkeypatch.setattr(dedup_index.np, 'save', disk_full)
+    dedup_index.save_bq_index(index, 'p', 'd', state, 0, path)
+    assert 'Could not save the dedup index' in caplog.text
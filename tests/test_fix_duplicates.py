@@ -0,0 +1,73 @@
+import datetime
+import duckdb
+import pytest
+import fix_duplicates
+from db_cloud_utils import METADATA_TABLE, CONTENT_TABLE
+
+DATASET = 'p.d'
+
+def duckdb_sql(sql):
+    # The generated SQL is BigQuery's; these are the only differences DuckDB needs
+    return sql.replace('`', '"').replace('* EXCEPT(', '* EXCLUDE(')
+
+@pytest.fixture
+def tables():
+    conn = duckdb.connect()
+    conn.execute(f'CREATE TABLE "{DATASET}.{METADATA_TABLE}" (transcript_id VARCHAR, report_date DATE)')
+    conn.execute(f'CREATE TABLE "{DATASET}.{CONTENT_TABLE}" (transcript_id VARCHAR, paragraph_number INTEGER, content VARCHAR)')
+    conn.execute(f'''INSERT INTO "{DATASET}.{METADATA_TABLE}" VALUES
+        ('a', DATE '2024-01-10'), ('a', DATE '2024-01-10'), ('a', DATE '2024-01-10'),
+        ('b', DATE '2024-03-10'), ('b', DATE '2024-03-10'), ('c', DATE '2024-01-20')''')
+    conn.execute(f'''INSERT INTO "{DATASET}.{CONTENT_TABLE}" VALUES
+        ('a', 1, 'x'), ('a', 1, 'x'), ('a', 2, 'y'), ('b', 1, 'z'), ('b', 1, 'z'), ('c', 1, NULL), ('c', 1, NULL)''')
+    return conn
+
+def repair(conn, name, start_date=None, end_date=None):
+    keys, order_by = fix_duplicates.TABLE_KEYS[name]
+    window = fix_duplicates._window_sql(name, DATASET, start_date, end_date)
+    conn.execute(duckdb_sql(fix_duplicates.repair_sql(f"{DATASET}.{name}", keys, window, order_by)))
+    # BigQuery drops a script's temp tables when it ends
+    conn.execute("DROP TABLE dup_keys; DROP TABLE kept")
+    return conn.execute(f'SELECT * FROM "{DATASET}.{name}" ORDER BY ALL').fetchall()
+
+def test_repair_keeps_one_copy_per_key(tables):
+    assert [row[0] for row in repair(tables, METADATA_TABLE)] == ['a', 'b', 'c']
+    assert repair(tables, CONTENT_TABLE) == [('a', 1, 'x'), ('a', 2, 'y'), ('b', 1, 'z'), ('c', 1, None)]
+
+def test_window_limits_the_keys_repaired(tables):
+    # Content is windowed through its call's metadata; calls dated outside keep their duplicates
+    assert [row[0] for row in repair(tables, CONTENT_TABLE, '2024-01-01', datetime.date(2024, 1, 31))] == ['a', 'a', 'b', 'b', 'c']
+    assert [row[0] for row in repair(tables, METADATA_TABLE, start_date='2024-02-01')] == ['a', 'a', 'a', 'b', 'c']
+
+@pytest.mark.parametrize('date', ["2024-01-01' OR TRUE --", '2024-13-01', 20240101])
+def test_invalid_dates_never_reach_the_sql(date):
+    with pytest.raises(ValueError):
+        fix_duplicates._window_sql(METADATA_TABLE, DATASET, date, None)
+    with pytest.raises(ValueError):
+        fix_duplicates.fix_duplicates(end_date=date)
+
+class FakeJob:
+    def __init__(self, rows=None, statement_type=None, num_dml_affected_rows=None):
+        self.rows, self.statement_type, self.num_dml_affected_rows = rows, statement_type, num_dml_affected_rows
+
+    def result(self):
+        return self.rows
+
+class FakeClient:
+    """Counts 2 rows to remove, but the repair's DELETE finds one more copy written since."""
+
+    def query(self, sql, job_config=None):
+        if 'BEGIN TRANSACTION' in sql:
+            return FakeJob()
+        return FakeJob([type('Row', (), {'duplicate_keys': 1, 'rows_affected': 3, 'rows_to_remove': 2})])
+
+    def list_jobs(self, parent_job=None):
+        return [FakeJob(statement_type='CREATE_TABLE'), FakeJob(statement_type='DELETE', num_dml_affected_rows=4),
+                FakeJob(statement_type='INSERT', num_dml_affected_rows=1)]
+
+def test_report_counts_rows_the_repair_removed(monkeypatch):
+    monkeypatch.setattr(fix_duplicates.db_cloud_utils, 'get_client', lambda project_id: FakeClient())
+    monkeypatch.setattr(fix_duplicates.db_cloud_utils, 'get_content_mode_bq', lambda project_id, dataset_id: 'inline')
+    report = fix_duplicates.fix_duplicates()
+    assert report[METADATA_TABLE]['rows_to_remove'] == 2
+    assert report[METADATA_TABLE]['rows_removed'] == 3
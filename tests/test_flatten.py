@@ -0,0 +1,122 @@
+import ast
+import hashlib
+import json
+import logging
+import pandas as pd
+import pyarrow as pa
+import flatten
+
+METADATA_COLUMNS = ['transcript_id', 'symbol', 'report_date', 'fiscal_year', 'fiscal_quarter']
+
+def reference_flatten(df, existing_ids):
+    """The iterrows loop flatten_batch replaced (collect_transcripts before vectorization)."""
+    metadata_rows, content_rows = [], []
+    for _, row in df.iterrows():
+        try:
+            transcript_id = hashlib.md5(f"{row['symbol']}{row['report_date']}".encode()).hexdigest()
+            if transcript_id in existing_ids:
+                continue
+            metadata_rows.append({
+                'transcript_id': transcript_id,
+                'symbol': row['symbol'],
+                'report_date': row['report_date'],
+                'fiscal_year': row['fiscal_year'],
+                'fiscal_quarter': row['fiscal_quarter'],
+            })
+            transcript_raw = row['transcripts']
+            if isinstance(transcript_raw, str):
+                paragraphs = ast.literal_eval(transcript_raw)
+            elif isinstance(transcript_raw, list):
+                paragraphs = transcript_raw
+            elif hasattr(transcript_raw, 'tolist'):
+                paragraphs = transcript_raw.tolist()
+            else:
+                continue
+            for p in paragraphs:
+                content_rows.append({
+                    'transcript_id': transcript_id,
+                    'paragraph_number': p.get('paragraph_number'),
+                    'speaker': p.get('speaker'),
+                    'content': p.get('content'),
+                })
+        except (ValueError, SyntaxError):
+            continue
+    return (pd.DataFrame(metadata_rows, columns=METADATA_COLUMNS),
+            pd.DataFrame(content_rows, columns=['transcript_id', 'paragraph_number', 'speaker', 'content']))
+
+def transcript_id(symbol, report_date):
+    return hashlib.md5(f"{symbol}{report_date}".encode()).hexdigest()
+
+def paragraphs(n, prefix):
+    return [{'paragraph_number': i, 'speaker': f"Speaker {i % 2}", 'content': f"{prefix} paragraph {i} – €"}
+            for i in range(1, n + 1)]
+
+CALLS = [
+    ('AAPL', '2024-01-25', paragraphs(3, 'aapl')),
+    ('MSFT', '2024-01-30', paragraphs(2, 'msft')),   # already known
+    ('NVDA', '2024-02-21', None),                     # no transcript
+    ('AMZN', '2024-02-01', []),                       # empty transcript
+    ('GOOG', '2024-01-30', paragraphs(4, 'goog')),
+]
+KNOWN = {transcript_id('MSFT', '2024-01-30')}
+
+def make_batch(transcripts, type_):
+    return pa.RecordBatch.from_pydict({
+        'symbol': [c[0] for c in CALLS],
+        'report_date': [c[1] for c in CALLS],
+        'fiscal_year': [2024] * len(CALLS),
+        'fiscal_quarter': [1] * len(CALLS),
+        'transcripts': pa.array(transcripts, type=type_),
+    })
+
+def assert_parity(batch):
+    metadata, content = flatten.flatten_batch(batch, KNOWN)
+    expected_metadata, expected_content = reference_flatten(batch.to_pandas(), KNOWN)
+
+    # Calls without a transcript are dropped; the old loop wrote their metadata without content
+    missing = {transcript_id(symbol, date) for symbol, date, p in CALLS if p is None}
+    expected_metadata = expected_metadata[~expected_metadata['transcript_id'].isin(missing)]
+
+    pd.testing.assert_frame_equal(metadata[METADATA_COLUMNS].reset_index(drop=True),
+                                  expected_metadata.reset_index(drop=True), check_dtype=False)
+    pd.testing.assert_frame_equal(content.reset_index(drop=True),
+                                  expected_content.reset_index(drop=True), check_dtype=False)
+    assert metadata['content_fingerprint'].notna().all()
+    return metadata, content
+
+def test_parity_list_transcripts():
+    metadata, content = assert_parity(make_batch([c[2] for c in CALLS], pa.list_(flatten.PARAGRAPH_TYPE)))
+    assert list(metadata['symbol']) == ['AAPL', 'AMZN', 'GOOG']
+    assert len(content) == 7
+
+def test_parity_json_string_transcripts():
+    encoded = [None if c[2] is None else json.dumps(c[2]) for c in CALLS]
+    metadata, content = assert_parity(make_batch(encoded, pa.string()))
+    assert list(metadata['symbol']) == ['AAPL', 'AMZN', 'GOOG']
+    assert content['content'].iloc[0] == 'aapl paragraph 1 – €'
+
+def test_parity_repr_string_transcripts():
+    assert_parity(make_batch([None if c[2] is None else repr(c[2]) for c in CALLS], pa.string()))
+
+def test_fingerprints_match_sql_definition():
+    batch = make_batch([c[2] for c in CALLS], pa.list_(flatten.PARAGRAPH_TYPE))
+    metadata, _ = flatten.flatten_batch(batch)
+    for (symbol, _, p), fingerprint in zip([c for c in CALLS if c[2] is not None], metadata['content_fingerprint']):
+        texts = ''.join(paragraph['content'] for paragraph in p)
+        assert fingerprint == f"{len(p)}-{hashlib.md5(texts.encode()).hexdigest()}", symbol
+
+def test_bad_string_row_does_not_lose_batch(caplog):
+    encoded = [
+        repr([{'paragraph_number': '1', 'speaker': 7, 'content': 'coercible'}]),
+        repr([{'paragraph_number': 'one', 'speaker': 'x', 'content': 'not coercible'}]),
+        "[{'paragraph_number': 1, 'speaker': 'A', 'content': 'unparseable'",
+        None,
+        repr(paragraphs(2, 'goog')),
+    ]
+    with caplog.at_level(logging.ERROR, logger='flatten'):
+        metadata, content = flatten.flatten_batch(make_batch(encoded, pa.string()))
+
+    assert list(metadata['symbol']) == ['AAPL', 'GOOG']
+    assert content[['paragraph_number', 'speaker', 'content']].iloc[0].tolist() == [1, '7', 'coercible']
+    assert len(content) == 3
+    assert sum('Error parsing transcript' in r.getMessage() for r in caplog.records) == 2
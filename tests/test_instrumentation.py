@@ -0,0 +1,76 @@
+import threading
+import time
+import tracemalloc
+import instrumentation
+
+def test_concurrent_stages_are_tracked_per_stage():
+    report = instrumentation.RunReport(trace_memory=True)
+    writer_entered, writer_done = threading.Event(), threading.Event()
+
+    def writer():
+        with report.stage('sqlite_write'):
+            writer_entered.set()
+            writer_done.wait(5)
+
+    try:
+        with report.stage('flatten'):
+            thread = threading.Thread(target=writer)
+            thread.start()
+            assert writer_entered.wait(5)
+            assert report.active_stages == ['flatten', 'sqlite_write']
+            writer_done.set()
+            thread.join(5)
+            # The writer finishing must not clear the main thread's stage
+            assert report.current_stage == 'flatten'
+        assert report.current_stage is None
+
+        with report.stage('dedup_query'):
+            bytearray(1024 ** 2)
+    finally:
+        report.finish()
+
+    stages = report.to_dict()['stages']
+    assert stages['flatten']['calls'] == stages['sqlite_write']['calls'] == 1
+    assert stages['flatten']['tracemalloc_peak_mb'] is None
+    assert stages['sqlite_write']['tracemalloc_peak_mb'] is None
+    assert stages['dedup_query']['tracemalloc_peak_mb'] >= 1.0
+
+def test_stage_updates_from_many_threads():
+    report = instrumentation.RunReport()
+
+    def work():
+        for _ in range(200):
+            with report.stage('bq_load') as stage:
+                stage.add(rows=1)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = report.stages['bq_load']
+    assert stats.calls == len(stats.durations) == 1600
+    assert report.active_stages == []
+
+def test_stage_reports_its_own_rss_not_the_process_peak():
+    report = instrumentation.RunReport()
+    with report.stage('flatten'):
+        # Touch the pages so they count as resident, then free them before the next stage
+        buffer = bytearray(b'x' * (200 * 1024 ** 2))
+        time.sleep(3 * instrumentation.RSS_SAMPLE_SECONDS)
+        del buffer
+    with report.stage('sink_wait'):
+        pass
+
+    stages = report.to_dict()['stages']
+    assert stages['flatten']['max_rss_mb'] >= stages['sink_wait']['max_rss_mb'] + 100
+
+def test_tracing_outlives_the_first_finished_report():
+    assert not tracemalloc.is_tracing()
+    first = instrumentation.RunReport(trace_memory=True)
+    second = instrumentation.RunReport(trace_memory=True)
+    first.finish()
+    assert tracemalloc.is_tracing()
+    second.finish()
+    assert not tracemalloc.is_tracing()
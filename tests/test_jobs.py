@@ -0,0 +1,34 @@
+import threading
+import jobs
+
+def test_waited_job_never_overlaps_running_job_on_a_ticker():
+    active, overlaps = set(), []
+    first_running, release_first = threading.Event(), threading.Event()
+
+    def run(job):
+        overlaps.extend(set(job.tickers) & active)
+        active.update(job.tickers)
+        if job.params.get('first'):
+            first_running.set()
+            release_first.wait(5)
+        active.difference_update(job.tickers)
+
+    manager = jobs.JobManager(run, workers=2)
+    first = manager.submit({'first': True}, ['AAPL', 'MSFT'])
+    assert first_running.wait(5)
+    waited = manager.submit({}, ['MSFT'])
+    assert not waited.wait(0.2)
+    assert waited.status == 'waiting'
+
+    release_first.set()
+    assert waited.wait(5) and first.wait(5)
+    assert waited.status == first.status == 'succeeded'
+    assert overlaps == []
+
+def test_wait_reports_failure():
+    def run(job):
+        raise RuntimeError('boom')
+
+    job = jobs.JobManager(run, workers=1).submit({}, ['AAPL'])
+    assert job.wait(5)
+    assert job.status == 'failed' and job.error == 'boom'
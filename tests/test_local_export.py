@@ -0,0 +1,52 @@
+import glob
+import os
+import threading
+import pandas as pd
+import pyarrow.dataset as ds
+import local_export
+
+def batch(ids, symbol='AAPL', paragraphs=2):
+    metadata_df = pd.DataFrame({
+        'transcript_id': ids, 'symbol': symbol, 'fiscal_year': 2024, 'fiscal_quarter': 1, 'report_date': '2024-01-30',
+    })
+    content_df = pd.DataFrame({
+        'transcript_id': [t for t in ids for _ in range(paragraphs)],
+        'paragraph_number': [p for _ in ids for p in range(paragraphs)],
+        'speaker': 'Operator',
+        'content': [f"{t} paragraph {p}" for t in ids for p in range(paragraphs)],
+    })
+    return metadata_df, content_df
+
+def read(export_dir, name):
+    return ds.dataset(os.path.join(export_dir, name), format='parquet', partitioning=local_export.PARTITIONING).to_table()
+
+def test_compact_preserves_rows_and_drops_repeats(tmp_path):
+    export_dir, lock_file = str(tmp_path / 'export'), str(tmp_path / 'export.lock')
+    for ids in (['a', 'b'], ['c'], ['a']):
+        local_export.write_batch(*batch(ids), export_dir=export_dir)
+
+    assert local_export.compact(export_dir, lock_file=lock_file) == 2
+    assert len(glob.glob(os.path.join(export_dir, '*', 'symbol=AAPL', 'fiscal_year=2024', '*.parquet'))) == 2
+    assert sorted(read(export_dir, 'metadata')['transcript_id'].to_pylist()) == ['a', 'b', 'c']
+    assert read(export_dir, 'content').num_rows == 6
+    # A second pass has nothing left to merge
+    assert local_export.compact(export_dir, lock_file=lock_file) == 0
+
+def test_compact_waits_for_a_writer_holding_the_lock(tmp_path):
+    export_dir, lock_file = str(tmp_path / 'export'), str(tmp_path / 'export.lock')
+    local_export.write_batch(*batch(['a']), export_dir=export_dir)
+    local_export.write_batch(*batch(['b']), export_dir=export_dir)
+
+    compacted = []
+    with local_export.locked(lock_file):
+        thread = threading.Thread(target=lambda: compacted.append(local_export.compact(export_dir, lock_file=lock_file)))
+        thread.start()
+        thread.join(timeout=0.2)
+        assert thread.is_alive()
+        # Written while compaction is blocked: the new files must survive it
+        local_export.write_batch(*batch(['c']), export_dir=export_dir)
+    thread.join()
+
+    assert compacted == [2]
+    assert sorted(read(export_dir, 'metadata')['transcript_id'].to_pylist()) == ['a', 'b', 'c']
+    assert read(export_dir, 'content').num_rows == 6
@@ -0,0 +1,24 @@
+import pytest
+import main
+
+class FakeRequest:
+    def __init__(self, json=None, args=None, path='/'):
+        self.json = json
+        self.args = args or {}
+        self.path = path
+
+    def get_json(self, silent=False, force=False):
+        return self.json
+
+@pytest.mark.parametrize('value, expected', [
+    (True, True), (False, False), ('false', False), ('0', False), ('no', False), ('TRUE', True), (1, True),
+])
+def test_boolean_params(value, expected):
+    params = main.parse_params(FakeRequest(json={'wait': value, 'refresh': value, 'incremental': value, 'trace_memory': value}))
+    assert params['wait'] is params['refresh'] is params['incremental'] is params['trace_memory'] is expected
+    assert main.parse_params(FakeRequest(args={'wait': str(value).lower()}))['wait'] is expected
+
+@pytest.mark.parametrize('value', ['maybe', '', 2, None, [True]])
+def test_invalid_boolean_is_rejected(value):
+    body, status = main.entry_point(FakeRequest(json={'refresh': value}))
+    assert status == 400 and 'refresh' in body['error']
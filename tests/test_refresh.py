@@ -0,0 +1,62 @@
+import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+import benchmark
+import instrumentation
+import sql_get
+
+TICKERS = ['SYM0000', 'SYM0001']
+
+def call(symbol, days_ago, text):
+    report_date = datetime.date.today() - datetime.timedelta(days=days_ago)
+    return {
+        'symbol': symbol, 'fiscal_year': report_date.year, 'fiscal_quarter': (report_date.month - 1) // 3 + 1,
+        'report_date': report_date.isoformat(),
+        'transcripts': [{'paragraph_number': 1, 'speaker': 'Operator', 'content': text}],
+    }
+
+def write_dataset(path, rows):
+    pq.write_table(pa.Table.from_pylist(rows, schema=benchmark.DATASET_SCHEMA), path)
+    return path
+
+class RecordingBigQuery(benchmark.InMemoryBigQuery):
+    def __init__(self):
+        super().__init__()
+        self.written = []
+
+    def write(self, metadata_df, content_df, paragraph_text=None, replace=False):
+        self.written += metadata_df['symbol'].tolist()
+        super().write(metadata_df, content_df, paragraph_text=paragraph_text, replace=replace)
+
+def collect(dataset, bigquery, refresh):
+    report = instrumentation.RunReport()
+    bigquery.written = []
+    with benchmark.stand_ins(dataset, bigquery):
+        sql_get.collect_transcripts(list(TICKERS), start_date='1900-01-01', batch_size=10, threads=1,
+                                    bq_sink=bigquery, refresh=refresh, report=report)
+    return report.counters
+
+def test_refresh_reingests_only_changed_fingerprints(tmp_path, monkeypatch, caplog):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('K_SERVICE', 'test')
+    dataset = str(tmp_path / 'transcripts.parquet')
+    rows = [call('SYM0000', 91, 'First call.'), call('SYM0000', 182, 'Second call.'), call('SYM0001', 91, 'Third call.')]
+    bigquery = RecordingBigQuery()
+
+    counters = collect(write_dataset(dataset, rows), bigquery, refresh=False)
+    assert counters['new_calls'] == 3 and len(bigquery.ids) == 3
+
+    # Nothing changed upstream: nothing is written again
+    counters = collect(dataset, bigquery, refresh=True)
+    assert (counters['new_calls'], counters['revised_calls']) == (0, 0)
+    assert bigquery.written == []
+
+    # One call revised, one call added: each is counted on its own
+    rows[2] = call('SYM0001', 91, 'Third call, corrected.')
+    rows.append(call('SYM0001', 182, 'Fourth call.'))
+    with caplog.at_level('INFO', logger='sql_get'):
+        counters = collect(write_dataset(dataset, rows), bigquery, refresh=True)
+    assert (counters['new_calls'], counters['revised_calls']) == (1, 1)
+    assert '1 new calls, 1 revised calls.' in caplog.text
+    assert bigquery.written == ['SYM0001', 'SYM0001']
+    assert len(bigquery.ids) == 4
@@ -0,0 +1,71 @@
+import pandas as pd
+import pytest
+import db_utils
+import search
+
+PARAGRAPHS = {
+    'a': ['Tariffs on China weigh on margins.', 'We raised "full-year" guidance.'],
+    'b': ['Tariffs on China weigh on margins.', 'No tariff impact NOT expected.'],
+}
+SYMBOLS = {'a': 'AAPL', 'b': 'MSFT'}
+
+def insert(calls, replace=()):
+    ids = list(calls)
+    metadata_df = pd.DataFrame({'transcript_id': ids, 'symbol': [SYMBOLS[t] for t in ids], 'report_date': '2024-01-30',
+                                'fiscal_year': 2024, 'fiscal_quarter': 1})
+    content_df = pd.DataFrame([
+        {'transcript_id': t, 'paragraph_number': n, 'speaker': 'CEO', 'content': text}
+        for t, texts in calls.items() for n, text in enumerate(texts, start=1)
+    ])
+    db_utils.insert_batch(metadata_df, content_df, replace=replace)
+
+def found(query, **kwargs):
+    return [(r['transcript_id'], r['paragraph_number']) for r in search.search(query, **kwargs)]
+
+@pytest.fixture(params=['inline', 'normalized'])
+def indexed(local_db, request):
+    local_db(request.param)
+    # One call is backfilled by sync_fts(), the other indexed by the insert trigger
+    insert({'a': PARAGRAPHS['a']})
+    db_utils.sync_fts()
+    insert({'b': PARAGRAPHS['b']})
+    return request.param
+
+def test_matches_are_stemmed_and_highlighted(indexed):
+    results = search.search('tariff', highlight=('<b>', '</b>'))
+    assert sorted((r['transcript_id'], r['paragraph_number']) for r in results) == [('a', 1), ('b', 1), ('b', 2)]
+    assert sorted({r['snippet'] for r in results}) == ['<b>Tariffs</b> on China weigh on margins.',
+                                                        'No <b>tariff</b> impact NOT expected.']
+
+def test_query_syntax_is_escaped_unless_raw(indexed):
+    # Quotes and operators are plain text in a phrase query
+    assert found('"full-year" guidance') == [('a', 2)]
+    assert found('impact NOT expected') == [('b', 2)]
+    assert found('tariff NOT china', raw=True) == [('b', 2)]
+    assert found('guid*', raw=True) == [('a', 2)]
+
+def test_filters(indexed):
+    assert found('china', symbol='MSFT') == [('b', 1)]
+    assert found('china', since='2024-01-31') == []
+    assert found('china', until='2024-01-30', speaker='ceo', limit=1) != []
+
+def test_index_follows_replaced_calls(indexed):
+    insert({'b': ['Demand recovered.']}, replace=['b'])
+    assert found('tariff') == [('a', 1)]
+    assert found('demand') == [('b', 1)]
+
+def test_index_follows_edits_by_hand(local_db):
+    local_db('inline')
+    insert({'a': PARAGRAPHS['a']})
+    db_utils.enable_fts()
+    insert({'b': PARAGRAPHS['b']})
+    conn = db_utils.get_connection()
+    with conn:
+        conn.execute("UPDATE transcript_content SET content = 'Demand recovered.' WHERE transcript_id = 'b' AND paragraph_number = 1")
+        conn.execute("DELETE FROM transcript_content WHERE transcript_id = 'b' AND paragraph_number = 2")
+    db_utils.sync_fts()
+
+    assert found('demand') == [('b', 1)]
+    assert found('tariff') == [('a', 1)]
+    # The index holds exactly what the table holds
+    conn.execute(f"INSERT INTO {db_utils.FTS_TABLE} ({db_utils.FTS_TABLE}, rank) VALUES ('integrity-check', 1)")
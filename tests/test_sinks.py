@@ -0,0 +1,88 @@
+import threading
+import pandas as pd
+import pyarrow as pa
+import pytest
+from bq_storage_sink import LocalArrowBackend, StorageWriteSink
+from sinks import BigQuerySink, MemorySink, Sink, SinkBatch, SinkPipeline
+
+def make_batch(number, calls=3, paragraphs=2):
+    ids = [f"call-{number}-{i}" for i in range(calls)]
+    metadata_df = pd.DataFrame({'transcript_id': ids, 'symbol': 'AAPL'})
+    content = pa.table({
+        'transcript_id': [t for t in ids for _ in range(paragraphs)],
+        'paragraph_number': [p for _ in ids for p in range(paragraphs)],
+        'speaker': ['Operator'] * (calls * paragraphs),
+        'content': [f"{t} paragraph {p}" for t in ids for p in range(paragraphs)],
+    })
+    return SinkBatch(number, metadata_df, content)
+
+class FailingWriter:
+    def write(self, metadata_df, content, replace=False):
+        raise RuntimeError("quota exceeded")
+
+class BrokenSink(Sink):
+    name = 'broken'
+
+    def write(self, batch):
+        raise RuntimeError("disk full")
+
+def test_batches_are_written_in_order():
+    memory, arrow = MemorySink(), MemorySink(accepts_arrow=True)
+    arrow.name = 'memory_arrow'
+    backend = LocalArrowBackend()
+    written = []
+    sinks = [memory, arrow, BigQuerySink(StorageWriteSink(None, None, backend=backend))]
+
+    with SinkPipeline(sinks, on_written=lambda batch, results: written.append((batch.number, results)), depth=2) as pipeline:
+        assert pipeline.accepts_arrow
+        for number in range(5):
+            pipeline.submit(make_batch(number))
+
+    assert [number for number, _ in written] == list(range(5))
+    assert all(results == {'memory': True, 'memory_arrow': True, 'bigquery': True} for _, results in written)
+    assert [df['transcript_id'].iloc[0] for df in memory.metadata] == [f"call-{n}-0" for n in range(5)]
+    # Only sinks that take Arrow get the Table; the others get a DataFrame
+    assert all(isinstance(c, pd.DataFrame) for c in memory.content)
+    assert all(isinstance(c, pa.Table) for c in arrow.content)
+    assert backend.metadata.num_rows == 15 and backend.content.num_rows == 30
+
+def test_normalized_backend_streams_hash_references():
+    backend = LocalArrowBackend(content_mode='normalized')
+    with SinkPipeline([BigQuerySink(StorageWriteSink(None, None, backend=backend))]) as pipeline:
+        pipeline.submit(make_batch(0))
+        pipeline.submit(make_batch(1))
+    # Every paragraph text is distinct here, so each hash reference has one stored text
+    assert backend.content.num_rows == 12 and backend.paragraph_text.num_rows == 12
+
+def test_failed_bigquery_write_still_reaches_other_sinks():
+    memory = MemorySink()
+    written = []
+    with SinkPipeline([memory, BigQuerySink(FailingWriter())], on_written=lambda batch, results: written.append(results)) as pipeline:
+        pipeline.submit(make_batch(0))
+        pipeline.submit(make_batch(1))
+
+    assert written == [{'memory': True, 'bigquery': False}] * 2
+    assert len(memory.metadata) == 2
+
+def test_sink_error_stops_the_pipeline():
+    written = []
+    pipeline = SinkPipeline([BrokenSink()], on_written=lambda batch, results: written.append(results))
+    pipeline.submit(make_batch(0))
+    with pytest.raises(RuntimeError, match="disk full"):
+        for number in range(1, 5):
+            pipeline.submit(make_batch(number))
+        pipeline.close()
+    assert written == []
+
+def test_concurrent_storage_writes_store_each_call_once():
+    backend = LocalArrowBackend()
+    sinks = [StorageWriteSink(None, None, backend=backend) for _ in range(4)]
+    batch = make_batch(0)
+    threads = [threading.Thread(target=sink.write, args=(batch.metadata_df, batch.content(arrow=True))) for sink in sinks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert backend.metadata.num_rows == 3 and backend.content.num_rows == 6
+    assert backend.staging == {}
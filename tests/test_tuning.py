@@ -0,0 +1,56 @@
+import os
+import pytest
+import tuning
+
+GIB = 1024 ** 3
+
+def cgroup(tmp_path, files):
+    for name, value in files.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(value + '\n')
+    return str(tmp_path)
+
+@pytest.fixture(autouse=True)
+def cpus(monkeypatch):
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: set(range(8)), raising=False)
+    monkeypatch.delenv('DUCKDB_TEMP_DIRECTORY', raising=False)
+
+def test_cgroup_v2(tmp_path):
+    root = cgroup(tmp_path, {'cpu.max': '200000 100000', 'memory.max': str(GIB)})
+    assert tuning.detect_cpus(root) == 2
+    assert tuning.detect_memory(root) == GIB
+
+def test_cgroup_v1(tmp_path):
+    root = cgroup(tmp_path, {'cpu/cpu.cfs_quota_us': '50000', 'cpu/cpu.cfs_period_us': '100000',
+                             'memory/memory.limit_in_bytes': str(GIB)})
+    assert tuning.detect_cpus(root) == 0.5
+    assert tuning.detect_memory(root) == GIB
+
+def test_unlimited_cgroup_falls_back_to_the_machine(tmp_path):
+    root = cgroup(tmp_path, {'cpu.max': 'max 100000', 'memory.max': 'max'})
+    assert tuning.detect_cpus(root) == 8
+    assert tuning.detect_memory(root) == os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+def test_local_budget(tmp_path):
+    root = cgroup(tmp_path, {'cpu.max': '100000 100000', 'memory.max': str(GIB)})
+    settings = tuning.auto_tune(root=root)
+    assert settings['threads'] == 1
+    assert settings['memory_limit'] == '384MiB'
+    assert settings['batch_size'] == 128
+    assert settings['max_temp_directory_size'] is None
+
+def test_cloud_run_budget_includes_the_in_memory_spill(tmp_path):
+    root = cgroup(tmp_path, {'cpu.max': '100000 100000', 'memory.max': str(GIB)})
+    settings = tuning.auto_tune(root=root, is_cloud_run=True)
+    duckdb = tuning.parse_bytes(settings['memory_limit'])
+    spill = tuning.parse_bytes(settings['max_temp_directory_size'])
+    batches = settings['batch_size'] * tuning.ESTIMATED_CALL_BYTES * tuning.PIPELINE_BATCHES
+    assert duckdb + spill + batches + tuning.BASE_RESERVE_BYTES <= GIB
+    assert settings['temp_directory'] == tuning.CLOUD_RUN_SPILL_DIR
+
+def test_workers_split_the_container(tmp_path):
+    root = cgroup(tmp_path, {'cpu.max': '400000 100000', 'memory.max': str(8 * GIB)})
+    single, shared = tuning.auto_tune(root=root), tuning.auto_tune(root=root, workers=4)
+    assert (single['threads'], shared['threads']) == (4, 1)
+    assert tuning.parse_bytes(shared['memory_limit']) < tuning.parse_bytes(single['memory_limit']) / 2
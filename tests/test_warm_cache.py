@@ -0,0 +1,57 @@
+import pytest
+import warm_cache
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(warm_cache.time, 'monotonic', clock)
+    return clock
+
+def test_values_expire_after_the_ttl(clock):
+    disposed = []
+    cache = warm_cache.TTLCache(ttl=60, dispose=disposed.append)
+    assert cache.get_or_create('url', lambda: 'v1') == 'v1'
+
+    clock.now += 59
+    assert cache.get_or_create('url', lambda: 'v2') == 'v1'
+    assert disposed == []
+
+    clock.now += 1
+    assert cache.get('url') is None
+    assert disposed == ['v1']
+    assert cache.get_or_create('url', lambda: 'v2') == 'v2'
+
+def test_replaced_and_invalidated_values_are_disposed(clock):
+    disposed = []
+    cache = warm_cache.TTLCache(ttl=60, dispose=disposed.append)
+    cache.put('a', 'a1')
+    cache.put('a', 'a2')
+    cache.put('b', 'b1')
+    cache.invalidate('a')
+    cache.invalidate()
+    assert disposed == ['a1', 'a2', 'b1']
+
+def test_idle_clients_are_closed_after_the_ttl(clock):
+    closed = []
+    pool = warm_cache.ClientPool(ttl=60, close=closed.append, max_idle=1)
+    client, reused = pool.acquire('duckdb', lambda: 'c1')
+    assert (client, reused) == ('c1', False)
+    pool.release('duckdb', client)
+    # Beyond max_idle the returned client is closed at once
+    pool.release('duckdb', 'extra')
+    assert closed == ['extra']
+
+    clock.now += 30
+    assert pool.acquire('duckdb', lambda: 'c2') == ('c1', True)
+    pool.release('duckdb', 'c1')
+
+    clock.now += 60
+    assert pool.acquire('duckdb', lambda: 'c2') == ('c2', False)
+    assert closed == ['extra', 'c1']
@@ -0,0 +1,154 @@
+import logging
+import math
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+# Memory left to the interpreter, libraries and the BigQuery client before any budget is split
+BASE_RESERVE_BYTES = 256 * 1024 ** 2
+# Share of the remaining memory given to DuckDB; the rest holds the batches being flattened and written
+DUCKDB_MEMORY_SHARE = 0.5
+# Rough peak cost of one call in flight in Python: Arrow batch, flattened content, pandas and Parquet copies
+ESTIMATED_CALL_BYTES = 1024 ** 2
+# Batches in memory at once with the pipelined writer (sinks.SinkPipeline): one being
+# flattened, one queued and one being written
+PIPELINE_BATCHES = 3
+MIN_BATCH_SIZE = 10
+MAX_BATCH_SIZE = 500
+MIN_DUCKDB_MEMORY_BYTES = 128 * 1024 ** 2
+
+# On Cloud Run the filesystem is in memory, so spilled data counts against the
+# instance's memory; spill is capped to this share of it there.
+CLOUD_RUN_SPILL_SHARE = 0.25
+DEFAULT_SPILL_DIR = '.duckdb_spill'
+CLOUD_RUN_SPILL_DIR = '/tmp/duckdb_spill'
+
+_UNITS = {'': 1, 'b': 1, 'kb': 1000, 'mb': 1000 ** 2, 'gb': 1000 ** 3, 'tb': 1000 ** 4,
+          'kib': 1024, 'mib': 1024 ** 2, 'gib': 1024 ** 3, 'tib': 1024 ** 4}
+
+def parse_bytes(value):
+    """'512MB', '1GiB', '2 GB' or a number of bytes -> int bytes."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.fullmatch(r'\s*([\d.]+)\s*([a-zA-Z]*)\s*', str(value))
+    if not match or match.group(2).lower() not in _UNITS:
+        raise ValueError(f"Cannot parse memory size '{value}'")
+    return int(float(match.group(1)) * _UNITS[match.group(2).lower()])
+
+def format_bytes(num_bytes):
+    """Bytes as a DuckDB size setting, in whole MiB."""
+    return f"{max(1, num_bytes // 1024 ** 2)}MiB"
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def detect_cpus(root=CGROUP_ROOT):
+    """
+    CPUs this process may use: the cgroup quota (v2 cpu.max or v1 cfs quota/period)
+    capped by the CPU affinity mask. Fractional quotas are kept (e.g. 0.5).
+    """
+    try:
+        available = len(os.sched_getaffinity(0))
+    except AttributeError:
+        available = os.cpu_count() or 1
+
+    quota = None
+    cpu_max = _read(os.path.join(root, 'cpu.max'))
+    if cpu_max:
+        limit, _, period = cpu_max.partition(' ')
+        if limit != 'max' and period:
+            quota = int(limit) / int(period)
+    else:
+        cfs_quota = _read(os.path.join(root, 'cpu', 'cpu.cfs_quota_us')) or _read(os.path.join(root, 'cpu.cfs_quota_us'))
+        cfs_period = _read(os.path.join(root, 'cpu', 'cpu.cfs_period_us')) or _read(os.path.join(root, 'cpu.cfs_period_us'))
+        if cfs_quota and cfs_period and int(cfs_quota) > 0:
+            quota = int(cfs_quota) / int(cfs_period)
+
+    return min(available, quota) if quota else float(available)
+
+def detect_memory(root=CGROUP_ROOT):
+    """Memory available to this process: the cgroup limit (v2 or v1) or physical memory."""
+    physical = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    for path in (os.path.join(root, 'memory.max'),
+                 os.path.join(root, 'memory', 'memory.limit_in_bytes'),
+                 os.path.join(root, 'memory.limit_in_bytes')):
+        value = _read(path)
+        if value and value != 'max':
+            # cgroup v1 reports "unlimited" as a huge number
+            return min(int(value), physical)
+    return physical
+
+def is_cloud_run():
+    """K_SERVICE is set on Cloud Run services, CLOUD_RUN_JOB on Cloud Run jobs."""
+    return os.environ.get('K_SERVICE') is not None or os.environ.get('CLOUD_RUN_JOB') is not None
+
+def auto_tune(threads=None, memory_limit=None, batch_size=None, temp_directory=None,
+              is_cloud_run=False, workers=1, root=CGROUP_ROOT):
+    """
+    DuckDB and streaming settings sized to the container. Explicit arguments win;
+    everything else is derived from the cgroup CPU/memory limits, split evenly
+    across `workers` processes sharing the container. On Cloud Run the spill cap
+    is taken from the same share, since spilled data sits in memory there.
+    Returns a dict with threads, memory_limit (DuckDB setting string),
+    temp_directory, max_temp_directory_size (or None) and batch_size, plus the
+    detected cpus / memory_bytes.
+    """
+    cpus = detect_cpus(root)
+    total_memory = detect_memory(root)
+    memory_share = total_memory // workers
+
+    if threads is None:
+        threads = max(1, math.floor(cpus / workers))
+
+    max_temp_directory_size = None
+    if temp_directory is None:
+        temp_directory = os.environ.get('DUCKDB_TEMP_DIRECTORY')
+    if temp_directory is None:
+        temp_directory = CLOUD_RUN_SPILL_DIR if is_cloud_run else DEFAULT_SPILL_DIR
+        if is_cloud_run:
+            max_temp_directory_size = int(memory_share * CLOUD_RUN_SPILL_SHARE)
+
+    available = max(0, memory_share - BASE_RESERVE_BYTES - (max_temp_directory_size or 0))
+    if memory_limit is None:
+        duckdb_bytes = max(MIN_DUCKDB_MEMORY_BYTES, int(available * DUCKDB_MEMORY_SHARE))
+        memory_limit = format_bytes(duckdb_bytes)
+    else:
+        duckdb_bytes = parse_bytes(memory_limit)
+
+    if batch_size is None:
+        python_bytes = max(0, available - duckdb_bytes)
+        batch_size = min(MAX_BATCH_SIZE, max(MIN_BATCH_SIZE, int(python_bytes // (ESTIMATED_CALL_BYTES * PIPELINE_BATCHES))))
+
+    planned = duckdb_bytes + batch_size * ESTIMATED_CALL_BYTES * PIPELINE_BATCHES
+    if planned > available:
+        logger.warning(f"DuckDB and batch minimums ({planned / 1024 ** 2:.0f} MiB) exceed the "
+                       f"{available / 1024 ** 2:.0f} MiB left of this worker's memory share; consider fewer workers.")
+
+    return {
+        'cpus': cpus,
+        'memory_bytes': total_memory,
+        'threads': int(threads),
+        'memory_limit': memory_limit,
+        'temp_directory': temp_directory,
+        'max_temp_directory_size': format_bytes(max_temp_directory_size) if max_temp_directory_size else None,
+        'batch_size': int(batch_size),
+    }
+
+def apply(connection, settings):
+    """Apply auto_tune() settings to a DuckDB connection."""
+    os.makedirs(settings['temp_directory'], exist_ok=True)
+    connection.execute(f"SET threads = {settings['threads']}")
+    connection.execute(f"SET memory_limit = '{settings['memory_limit']}'")
+    connection.execute(f"SET temp_directory = '{settings['temp_directory']}'")
+    if settings['max_temp_directory_size']:
+        connection.execute(f"SET max_temp_directory_size = '{settings['max_temp_directory_size']}'")
+    logger.info(f"DuckDB tuned for {settings['cpus']:g} CPUs / {settings['memory_bytes'] / 1024 ** 3:.1f} GiB: "
+                f"threads={settings['threads']}, memory_limit={settings['memory_limit']}, "
+                f"temp_directory={settings['temp_directory']}, batch_size={settings['batch_size']}")
@@ -0,0 +1,128 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# How long clients, resolved URLs and the dedup index are reused by later requests
+# on a warm instance before being rebuilt
+DEFAULT_TTL_SECONDS = float(os.environ.get('WARM_CACHE_TTL_SECONDS', 600))
+# Idle DuckDB clients kept per key; each holds a connection and its buffer pool
+MAX_IDLE_CLIENTS = 2
+
+class TTLCache:
+    """
+    Process-wide values kept for ttl seconds (thread-safe).
+    dispose(value) is called for values that expire or are invalidated.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS, dispose=None):
+        self.ttl = ttl
+        self.dispose = dispose
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The cached value for key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if time.monotonic() - stored_at < self.ttl:
+                return value
+            del self._entries[key]
+        self._dispose(value)
+        return None
+
+    def put(self, key, value):
+        with self._lock:
+            previous = self._entries.get(key)
+            self._entries[key] = (value, time.monotonic())
+        if previous is not None and previous[0] is not value:
+            self._dispose(previous[0])
+
+    def get_or_create(self, key, factory):
+        """Cached value for key, creating it with factory() when missing or expired."""
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop key, or everything if key is None."""
+        with self._lock:
+            if key is None:
+                dropped = [value for value, _ in self._entries.values()]
+                self._entries.clear()
+            else:
+                entry = self._entries.pop(key, None)
+                dropped = [entry[0]] if entry else []
+        for value in dropped:
+            self._dispose(value)
+
+    def _dispose(self, value):
+        if self.dispose is not None:
+            try:
+                self.dispose(value)
+            except Exception as e:
+                logger.warning(f"Could not dispose cached value: {e}")
+
+class ClientPool:
+    """
+    Idle clients reused across requests. A client is used by one run at a time:
+    acquire() takes an idle one (or creates it) and release() returns it. Clients
+    idle for longer than ttl, or beyond max_idle per key, are closed.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS, close=None, max_idle=MAX_IDLE_CLIENTS):
+        self.ttl = ttl
+        self.close = close
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, factory):
+        """Return (client, reused)."""
+        expired = []
+        client = None
+        with self._lock:
+            idle = self._idle.get(key, [])
+            now = time.monotonic()
+            while idle:
+                candidate, released_at = idle.pop()
+                if now - released_at < self.ttl:
+                    client = candidate
+                    break
+                expired.append(candidate)
+        for stale in expired:
+            self._close(stale)
+        if client is not None:
+            return client, True
+        return factory(), False
+
+    def release(self, key, client, reuse=True):
+        """Return client to the pool, or close it if not reusable (e.g. after an error)."""
+        if reuse and self.ttl > 0:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle:
+                    idle.append((client, time.monotonic()))
+                    return
+        self._close(client)
+
+    def clear(self):
+        with self._lock:
+            clients = [client for idle in self._idle.values() for client, _ in idle]
+            self._idle.clear()
+        for client in clients:
+            self._close(client)
+
+    def _close(self, client):
+        if self.close is not None:
+            try:
+                self.close(client)
+            except Exception as e:
+                logger.warning(f"Could not close pooled client: {e}")